@@ -14,8 +14,26 @@
 
 import gzip
 import bz2
+import codecs
+import hashlib
+import io
+import mmap
+import os
 import os.path
+import struct
+import sys
 from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from heapq import merge
+from itertools import accumulate, combinations, product
+from multiprocessing.pool import ThreadPool
+from pyngsqc import _compression
+try:
+    import numpy as np
+except ImportError:
+    # Name indices are sorted in chunks, which are merged, instead
+    np = None
 
 # TODO
 ## Make proper docstrings
@@ -25,17 +43,45 @@ from array import array
 ## Defaults
 DEFAULT_QUAL_OFFSET = 33
 DEFAULT_QUAL_THRESHOLD = 15
+DEFAULT_BLOCK_SIZE = 4096  # records per FastqBlock
+DEFAULT_CHUNK_SIZE = 1 << 20  # bytes per read() of the underlying file
 
 ## Compression
 GUESS_COMPRESSION = 0
 NO_COMPRESSION = 1
 GZIPPED = 2
 BZIPP2ED = 3
+BGZIPPED = 4
+DEFAULT_COMPRESSION_LEVEL = 9
+
+## Writer pools
+WRITER_POOL_BUFFER_SIZE = 1 << 18  # bytes buffered per file before a write
+WRITER_POOL_MAX_BUFFERED = 1 << 26  # bytes buffered over all files
+WRITER_POOL_MAX_OPEN = 256  # file handles open at once
+
+## Fastq index (.fqi) files
+FQI_MAGIC = b"FQI\x01"
+FQI_VERSION = 2
+# magic, version, flags, source file size, source mtime (ns), num records
+FQI_HEADER = struct.Struct("<4sHHQQQ")
+FQI_VIRTUAL_OFFSETS = 1
+FQI_LENGTHS = 2
+FQI_NAME_HASHES = 4
+FQI_BIG_ENDIAN = 8
+# Name hashes sorted at once when building a name index without NumPy
+NAME_SORT_CHUNK = 1 << 20
 
 ## Barcode postion
-BARCODE_FORWARD_ONLY = 0
-BARCODE_REVERSE_ONLY = 0  # Not Implemented
-BARCODE_FORWARD_REVERSE = 0  # Not Implemented
+BARCODE_FORWARD_ONLY = 0  # At the 5' end
+BARCODE_REVERSE_ONLY = 1  # At the 3' end, as it appears in the read
+BARCODE_FORWARD_OR_REVERSE = 2  # At whichever end matches best
+BARCODE_FORWARD_REVERSE = 3  # Dual barcodes, "FWD+REV", one at each end
+
+## Quality trimming modes
+TRIM_TRAILING = 0  # Low quality bases at the 3' end
+TRIM_LEADING_TRAILING = 1  # Low quality bases at both ends
+TRIM_MOTT = 2  # Running sum of qual_threshold - score from the 3' end
+TRIM_SLIDING_WINDOW = 3  # At the first window of low mean quality
 
 ## CSV DIALECTS
 SNIFF_CSV_DIALECT = 0
@@ -78,26 +124,45 @@ class Base(object):
             verbose=False,
             compression=GUESS_COMPRESSION,
             deduplicate_header=True,
-            print_summary=False
+            print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL
     ):
+        # Each tool's own, not the class's dict shared by every tool
+        self.stats = {}
         self.in_file_name = in_file_name
         self.out_file_name = out_file_name
         # self.compression = compression  # this is set in the reader and
         # writer
         self.verbose = verbose
+        # If binary, reads are handled as bytes and are never decoded
+        self.binary = binary
         if self.in_file_name is not None:
             self.reader = FastqReader(
                 self.in_file_name,
                 compression=compression,
-                deduplicate_header=deduplicate_header
+                deduplicate_header=deduplicate_header,
+                binary=binary,
+                threads=threads
             )
         if self.out_file_name is not None:
             self.writer = FastqWriter(
                 self.out_file_name,
-                compression=compression
+                compression=compression,
+                binary=binary,
+                threads=threads,
+                compression_level=compression_level
             )
         self.print_summary = print_summary
 
+    def _run_shard(self):
+        """Runs this tool over one shard of its input, in a ShardProcess,
+        returning what its run_sharded() needs from the shard
+        """
+        self.run()
+        return {"reader": self.reader.stats, "writer": self.writer.stats}
+
 
 class QualBase(Base):
 
@@ -112,6 +177,9 @@ class QualBase(Base):
             print_summary=False,
             compression=GUESS_COMPRESSION,
             deduplicate_header=True,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL,
             # Local kwargs
             qual_offset=DEFAULT_QUAL_OFFSET,
             qual_threshold=DEFAULT_QUAL_THRESHOLD
@@ -122,7 +190,10 @@ class QualBase(Base):
             verbose=verbose,
             print_summary=print_summary,
             compression=compression,
-            deduplicate_header=True
+            deduplicate_header=True,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         self.qual_offset = qual_offset
         self.qual_threshold = qual_threshold
@@ -132,16 +203,27 @@ class _GenericFileHandle(object):
     READ = 0
     WRITE = 1
 
-    def __init__(self, file_name, mode=READ, compression=GUESS_COMPRESSION):
+    def __init__(
+            self,
+            file_name,
+            mode=READ,
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL
+    ):
         self.file_name = file_name
+        self.binary = binary
+        # If more than one, gzip files are (de)compressed in other threads
+        self.threads = threads
+        self.compression_level = compression_level
         if mode == self.READ or mode == self.WRITE:
             self.mode = mode
         else:
             raise ValueError("%i is not a valid IO mode" % mode)
         if compression == GUESS_COMPRESSION:
             self.compression = self._guess_compression(self.file_name)
-        elif compression == NO_COMPRESSION or compression == GZIPPED or \
-                compression == BZIPP2ED:
+        elif compression in (NO_COMPRESSION, GZIPPED, BZIPP2ED, BGZIPPED):
             self.compression = compression
         else:
             raise ValueError(
@@ -152,9 +234,12 @@ class _GenericFileHandle(object):
     def _guess_compression(self, file_name):
         path, ext = os.path.splitext(file_name)
         gz_exts = [".gz", ".gzip"]
+        bgz_exts = [".bgz", ".bgzf"]
         bz2_exts = [".bz", ".bz2", ".bzip2"]
         if ext in gz_exts:
             return GZIPPED
+        elif ext in bgz_exts:
+            return BGZIPPED
         elif ext in bz2_exts:
             return BZIPP2ED
         else:
@@ -165,6 +250,8 @@ class _GenericFileHandle(object):
             return self._get_plaintext()
         elif self.compression == GZIPPED:
             return self._get_gzip()
+        elif self.compression == BGZIPPED:
+            return self._get_bgzf()
         elif self.compression == BZIPP2ED:
             return self._get_bzip2()
         else:
@@ -172,28 +259,76 @@ class _GenericFileHandle(object):
 
     def _get_plaintext(self):
         if self.mode == self.READ:
-            return open(self.file_name, "r")
+            return open(self.file_name, "rb" if self.binary else "r")
         elif self.mode == self.WRITE:
-            return open(self.file_name, "w")
+            return open(self.file_name, "wb" if self.binary else "w")
 
     def _get_gzip(self):
+        if self.threads > 1:
+            return self._get_threaded_gzip()
         if self.mode == self.READ:
-            return gzip.open(self.file_name, "r")
+            return gzip.open(self.file_name, "rb" if self.binary else "rt")
         elif self.mode == self.WRITE:
-            return gzip.open(self.file_name, "w")
+            return gzip.open(
+                self.file_name,
+                "wb" if self.binary else "wt",
+                compresslevel=self.compression_level
+            )
+
+    def _get_threaded_gzip(self):
+        if self.mode == self.READ:
+            raw = _compression.ThreadedGzipReader(self.file_name)
+            fh = io.BufferedReader(raw, _compression.COMPRESSED_CHUNK_SIZE)
+        elif self.mode == self.WRITE:
+            raw = _compression.ParallelGzipWriter(
+                self.file_name,
+                threads=self.threads,
+                compression_level=self.compression_level
+            )
+            fh = io.BufferedWriter(raw, _compression.UNCOMPRESSED_BLOCK_SIZE)
+        if self.binary:
+            return fh
+        return io.TextIOWrapper(fh)
+
+    def _get_bgzf(self):
+        if self.mode == self.READ:
+            # BGZF files are valid gzip files
+            return self._get_gzip()
+        elif self.mode == self.WRITE:
+            raw = _compression.BgzfWriter(
+                self.file_name,
+                threads=self.threads,
+                compression_level=self.compression_level
+            )
+            fh = io.BufferedWriter(raw, _compression.UNCOMPRESSED_BLOCK_SIZE)
+            if self.binary:
+                return fh
+            return io.TextIOWrapper(fh)
 
     def _get_bzip2(self):
         if self.mode == self.READ:
-            return bz2.BZ2File(self.file_name, "r")
+            return bz2.open(self.file_name, "rb" if self.binary else "rt")
         elif self.mode == self.WRITE:
-            return bz2.BZ2File(self.file_name, "w")
+            return bz2.open(
+                self.file_name,
+                "wb" if self.binary else "wt",
+                compresslevel=self.compression_level
+            )
 
 
 class _IOObject(object):
 
-    def __init__(self):
+    def __init__(self, binary=False):
         self.stats = {}
         self.stats["num_reads"] = 0
+        # Lines are str in text mode, and bytes in binary mode
+        self.binary = binary
+        if binary:
+            self._empty, self._newline, self._cr = b"", b"\n", b"\r"
+            self._at, self._plus, self._gt = b"@", b"+", b">"
+        else:
+            self._empty, self._newline, self._cr = "", "\n", "\r"
+            self._at, self._plus, self._gt = "@", "+", ">"
 
     def close(self):
         self.io.close()
@@ -201,49 +336,262 @@ class _IOObject(object):
 
 class _Writer(_IOObject):
 
-    def __init__(self, file_name, compression=GUESS_COMPRESSION):
-        super(_Writer, self).__init__()
-        self.io = _GenericFileHandle(
+    def __init__(
+            self,
+            file_name,
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL
+    ):
+        super(_Writer, self).__init__(binary)
+        handle = _GenericFileHandle(
             file_name,
             mode=_GenericFileHandle.WRITE,
-            compression=compression
-        ).get()
+            compression=compression,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
+        )
+        self.compression = handle.compression
+        self.threads = threads
+        self.compression_level = compression_level
+        self.io = handle.get()
 
 
 class FastqWriter(_Writer):
 
-    def __init__(self, file_name, compression=GUESS_COMPRESSION):
-        super(FastqWriter, self).__init__(file_name, compression)
+    def __init__(
+            self,
+            file_name,
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL
+    ):
+        super(FastqWriter, self).__init__(
+            file_name,
+            compression,
+            binary,
+            threads,
+            compression_level
+        )
 
     def write(self, reads):
         if len(reads) == 4:
             self.stats["num_reads"] += 1
             for line in reads:
-                self.io.write(line + "\n")
+                self.io.write(line + self._newline)
         elif len(reads) % 4 == 0:
             self.stats["num_reads"] += len(reads) / 4
             for line in reads:
-                self.io.write(line + "\n")
+                self.io.write(line + self._newline)
         else:
             raise ValueError("Bad Fastq Read: %s" % repr(reads))
 
+    def write_block(self, block):
+        """Writes all records of a FastqBlock with a single write() call"""
+        if len(block) < 1:
+            return
+        self.io.write(self._newline.join(block.lines()) + self._newline)
+        self.stats["num_reads"] += len(block)
+
 
 class FastaWriter(_Writer):
-    def __init__(self, file_name, compression=GUESS_COMPRESSION):
-        super(FastaWriter, self).__init__(file_name, compression)
+    def __init__(
+            self,
+            file_name,
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL
+    ):
+        super(FastaWriter, self).__init__(
+            file_name,
+            compression,
+            binary,
+            threads,
+            compression_level
+        )
 
     def write(self, reads):
         if len(reads) == 2:
             self.stats["num_reads"] += 1
             for line in reads:
-                self.io.write(line + "\n")
+                self.io.write(line + self._newline)
         elif len(reads) % 2 == 0:
             self.stats["num_reads"] += len(reads) / 2
-            for line in reads:
-                self.io.write(line + "\n")
+            self.io.write(self._newline.join(reads) + self._newline)
         else:
             raise ValueError("Bad Fasta Read: %s" % repr(reads))
 
+    def write_block(self, block):
+        """Writes the records of a FastqBlock as fasta records, keeping their
+        headers
+        """
+        if len(block) < 1:
+            return
+        gt = self._gt
+        lines = [None] * (2 * len(block))
+        lines[0::2] = [gt + header[1:] for header in block.headers]
+        lines[1::2] = block.seqs
+        self.io.write(self._newline.join(lines) + self._newline)
+        self.stats["num_reads"] += len(block)
+
+
+class FastqWriterPool(_IOObject):
+    """Writes reads to many files at once, e.g. one per sample.
+
+    Reads are gathered in a buffer per file, which is written once it holds
+    buffer_size bytes, or when max_buffered bytes are held over all files.
+    At most max_open files are open at any one time: the least recently
+    written is closed to open another, and reopened in append mode when
+    next written.
+
+    Each buffer of a gzip or bzip2 file is compressed as a separate member
+    (or stream), whose concatenation is a valid file. If threads > 1, the
+    buffers are compressed in a pool of threads.
+    """
+
+    def __init__(
+            self,
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1,
+            compression_level=DEFAULT_COMPRESSION_LEVEL,
+            buffer_size=WRITER_POOL_BUFFER_SIZE,
+            max_buffered=WRITER_POOL_MAX_BUFFERED,
+            max_open=WRITER_POOL_MAX_OPEN
+    ):
+        super(FastqWriterPool, self).__init__(binary)
+        self.compression = compression
+        self.threads = threads
+        self.compression_level = compression_level
+        self.buffer_size = buffer_size
+        self.max_buffered = max_buffered
+        self.max_open = max_open
+        # Per file name, its compression, buffered lines and their size
+        self._compressions = {}
+        self._buffers = {}
+        self._buffer_sizes = {}
+        self._total_buffered = 0
+        # Open handles, least recently written first
+        self._handles = OrderedDict()
+        # Files which have been written, so are appended to if reopened
+        self._started = set()
+        # Made on the first write, as a pool may be forked into another
+        # process first, and a pool's threads do not survive a fork
+        self._pool = None
+        # Compressed data being made by the pool, as (file name, result)
+        self._pending = deque()
+        self.stats["num_files"] = 0
+
+    def write(self, file_name, read):
+        """Buffers read, a list of four lines, to be written to file_name"""
+        try:
+            buf = self._buffers[file_name]
+        except KeyError:
+            buf = self._buffers[file_name] = []
+            self._buffer_sizes[file_name] = 0
+            self._compressions[file_name] = _GenericFileHandle(
+                file_name,
+                mode=_GenericFileHandle.WRITE,
+                compression=self.compression
+            ).compression
+            self.stats["num_files"] += 1
+        buf.extend(read)
+        size = len(read[0]) + len(read[1]) + len(read[2]) + len(read[3]) + 4
+        self._buffer_sizes[file_name] += size
+        self._total_buffered += size
+        self.stats["num_reads"] += 1
+        if self._buffer_sizes[file_name] >= self.buffer_size:
+            self._flush_buffer(file_name)
+        elif self._total_buffered >= self.max_buffered:
+            self.flush()
+
+    def _encode(self, file_name):
+        """Empties the buffer of file_name, returning its contents as bytes"""
+        buf = self._buffers[file_name]
+        data = self._newline.join(buf) + self._newline
+        del buf[:]
+        self._total_buffered -= self._buffer_sizes[file_name]
+        self._buffer_sizes[file_name] = 0
+        if not self.binary:
+            data = data.encode("utf-8")
+        return data
+
+    def _compress(self, data, compression):
+        if compression == GZIPPED:
+            return _compression.compress_member(data, self.compression_level)
+        elif compression == BGZIPPED:
+            return b"".join(
+                _compression.compress_bgzf_block(
+                    data[start:start + _compression.BGZF_BLOCK_SIZE],
+                    self.compression_level
+                )
+                for start in range(0, len(data), _compression.BGZF_BLOCK_SIZE)
+            )
+        elif compression == BZIPP2ED:
+            return bz2.compress(data, self.compression_level)
+        return data
+
+    def _flush_buffer(self, file_name):
+        if self._buffer_sizes[file_name] == 0:
+            return
+        data = self._encode(file_name)
+        compression = self._compressions[file_name]
+        if self.threads <= 1 or compression == NO_COMPRESSION:
+            self._write_data(file_name, self._compress(data, compression))
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+        self._pending.append((
+            file_name,
+            self._pool.apply_async(self._compress, (data, compression))
+        ))
+        # Bounds the number of buffers held in memory
+        while len(self._pending) > 2 * self.threads:
+            self._write_pending()
+
+    def _write_pending(self):
+        file_name, result = self._pending.popleft()
+        self._write_data(file_name, result.get())
+
+    def _write_data(self, file_name, data):
+        try:
+            fh = self._handles.pop(file_name)
+        except KeyError:
+            if file_name in self._started:
+                fh = open(file_name, "ab")
+            else:
+                fh = open(file_name, "wb")
+                self._started.add(file_name)
+            if len(self._handles) >= self.max_open:
+                self._handles.popitem(last=False)[1].close()
+        # Most recently written last
+        self._handles[file_name] = fh
+        fh.write(data)
+
+    def flush(self):
+        """Writes out the buffers of all files"""
+        for file_name in self._buffers:
+            self._flush_buffer(file_name)
+        while self._pending:
+            self._write_pending()
+
+    def close(self):
+        self.flush()
+        for file_name, compression in self._compressions.items():
+            if compression == BGZIPPED:
+                self._write_data(file_name, _compression.BGZF_EOF)
+        for fh in self._handles.values():
+            fh.close()
+        self._handles.clear()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
 
 class _Reader(_IOObject):
 
@@ -251,121 +599,920 @@ class _Reader(_IOObject):
             self,
             file_name,
             deduplicate_header=True,
-            compression=GUESS_COMPRESSION
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1
     ):
-        super(_Reader, self).__init__()
+        super(_Reader, self).__init__(binary)
         self.file_name = file_name
         self.deduplicate_header = deduplicate_header
-        self.io = _GenericFileHandle(
+        handle = _GenericFileHandle(
             self.file_name,
             mode=_GenericFileHandle.READ,
-            compression=compression
-        ).get()
+            compression=compression,
+            binary=binary,
+            threads=threads
+        )
+        self.compression = handle.compression
+        self.io = handle.get()
         self.stats["num_reads"] = 0
 
     def __iter__(self):
         return self
 
 
+class FastqBlock(object):
+    """A batch of fastq records, stored as four parallel lists of lines.
+
+    Iterating over a block, or indexing it, gives each record as a list of
+    four lines, in the same format as FastqReader.next().
+    """
+
+    def __init__(self, headers=None, seqs=None, qual_headers=None, quals=None):
+        self.headers = [] if headers is None else headers
+        self.seqs = [] if seqs is None else seqs
+        self.qual_headers = [] if qual_headers is None else qual_headers
+        self.quals = [] if quals is None else quals
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __iter__(self):
+        return map(
+            list,
+            zip(self.headers, self.seqs, self.qual_headers, self.quals)
+        )
+
+    def __getitem__(self, index):
+        return [
+            self.headers[index],
+            self.seqs[index],
+            self.qual_headers[index],
+            self.quals[index]
+        ]
+
+    def append(self, read):
+        self.headers.append(read[0])
+        self.seqs.append(read[1])
+        self.qual_headers.append(read[2])
+        self.quals.append(read[3])
+
+    def extend(self, block):
+        self.headers.extend(block.headers)
+        self.seqs.extend(block.seqs)
+        self.qual_headers.extend(block.qual_headers)
+        self.quals.extend(block.quals)
+
+    def lines(self):
+        """Returns a flat list of the lines of all records, in file order"""
+        lines = [None] * (4 * len(self.headers))
+        lines[0::4] = self.headers
+        lines[1::4] = self.seqs
+        lines[2::4] = self.qual_headers
+        lines[3::4] = self.quals
+        return lines
+
+
 class FastqReader(_Reader):
 
     def __init__(
             self,
             file_name,
             deduplicate_header=True,
-            compression=GUESS_COMPRESSION
+            compression=GUESS_COMPRESSION,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            binary=False,
+            threads=1
     ):
         super(FastqReader, self).__init__(
             file_name,
             deduplicate_header,
-            compression
+            compression,
+            binary,
+            threads
         )
+        self.chunk_size = chunk_size
+        # Complete lines read from self.io, and the index of the first one
+        # which has not yet been made into a record
+        self._lines = []
+        self._line_idx = 0
+        # Incomplete last line of the most recent chunk
+        self._partial = self._empty
+        self._at_start = True
+        self._eof = False
+        # Block which next() takes records from, one at a time
+        self._pending = FastqBlock()
+        self._pending_idx = 0
+
+    def _read_chunk(self):
+        return self.io.read(self.chunk_size)
+
+    def _next_lines(self):
+        """Returns the complete lines of the next chunk of the file, and the
+        text they were split from
+        """
+        chunk = self._read_chunk()
+        text = self._partial + chunk
+        if chunk:
+            lines = text.split(self._newline)
+            self._partial = lines.pop()
+        else:
+            self._eof = True
+            lines = [text] if text else []
+            self._partial = self._empty
+        return lines, text
+
+    def _fill(self):
+        """Reads the next chunk of the file into the line buffer. Returns
+        False once the file is exhausted.
+        """
+        if self._eof:
+            return False
+        lines, text = self._next_lines()
+        if self._cr in text:
+            lines = [line.rstrip(self._cr) for line in lines]
+        if self._at_start:
+            # Skip anything before the first record
+            for iii in range(len(lines)):
+                if lines[iii][:1] == self._at:
+                    lines = lines[iii:]
+                    self._at_start = False
+                    break
+            else:
+                lines = []
+        self._lines = self._lines[self._line_idx:] + lines
+        self._line_idx = 0
+        return True
 
-    def __next__(self):
-        this_read = []
-        at_start = True
-        num_lines = 0
-        for line in self.io:
-            num_lines += 1
-            line = line.strip()
-            if at_start:
-                if line[0] != "@":
-                    continue
-                else:
-                    at_start = False
-            this_read.append(line)
-            if len(this_read) == 4:
-                if not len(this_read[1]) == len(this_read[3]):
+    def _check_block(self, block):
+        if list(map(len, block.seqs)) != list(map(len, block.quals)):
+            for read in block:
+                if len(read[1]) != len(read[3]):
                     err = "Read %s has seq and qual of different lengths"
-                    raise ValueError(err % repr(this_read))
-                if not this_read[2][0] == "+":
+                    raise ValueError(err % repr(read))
+        plus = self._plus
+        if block.qual_headers.count(plus) != len(block):
+            for read in block:
+                if read[2][:1] != plus:
                     err = "Read %s has no quality header, or is misformed"
-                    raise ValueError(err % repr(this_read))
-                if self.deduplicate_header:
-                    # Save disk space, remove duplicate headers
-                    if this_read[0][1:] == this_read[2][1:]:
-                        this_read[2] = "+"
-                self.stats["num_reads"] += 1
-                return this_read
-        raise StopIteration
+                    raise ValueError(err % repr(read))
+            if self.deduplicate_header:
+                # Save disk space, remove duplicate headers
+                block.qual_headers = [
+                    plus if qual_header[1:] == header[1:] else qual_header
+                    for header, qual_header in
+                    zip(block.headers, block.qual_headers)
+                ]
+
+    def _parse_block(self, n_records):
+        block = FastqBlock()
+        while len(block) < n_records:
+            available = (len(self._lines) - self._line_idx) // 4
+            if available < 1:
+                if not self._fill():
+                    # Any remaining lines are a truncated record
+                    break
+                continue
+            start = self._line_idx
+            stop = start + 4 * min(available, n_records - len(block))
+            lines = self._lines
+            block.headers.extend(lines[start:stop:4])
+            block.seqs.extend(lines[start + 1:stop:4])
+            block.qual_headers.extend(lines[start + 2:stop:4])
+            block.quals.extend(lines[start + 3:stop:4])
+            self._line_idx = stop
+        self._check_block(block)
+        return block
+
+    def read_block(self, n_records=DEFAULT_BLOCK_SIZE):
+        """Returns a FastqBlock of up to n_records records. The block is
+        empty once the file is exhausted.
+        """
+        block = FastqBlock()
+        if self._pending_idx < len(self._pending):
+            # Hand over any records buffered by next()
+            pending = self._pending
+            stop = min(len(pending), self._pending_idx + n_records)
+            block.headers = pending.headers[self._pending_idx:stop]
+            block.seqs = pending.seqs[self._pending_idx:stop]
+            block.qual_headers = pending.qual_headers[self._pending_idx:stop]
+            block.quals = pending.quals[self._pending_idx:stop]
+            self._pending_idx = stop
+        if len(block) < n_records:
+            block.extend(self._parse_block(n_records - len(block)))
+        self.stats["num_reads"] += len(block)
+        return block
+
+    def iter_blocks(self, n_records=DEFAULT_BLOCK_SIZE):
+        """Iterates over the file as FastqBlocks of up to n_records records"""
+        while True:
+            block = self.read_block(n_records)
+            if len(block) < 1:
+                break
+            yield block
+
+    def __next__(self):
+        if self._pending_idx >= len(self._pending):
+            self._pending = self._parse_block(DEFAULT_BLOCK_SIZE)
+            self._pending_idx = 0
+            if len(self._pending) < 1:
+                raise StopIteration
+        read = self._pending[self._pending_idx]
+        self._pending_idx += 1
+        self.stats["num_reads"] += 1
+        return read
 
     def next(self):
         return self.__next__()
 
 
+class PairedFastqReader(object):
+    """Reads several fastq files in lockstep, e.g. read 1 and read 2 of a
+    paired end run, and its index reads. iter_blocks() gives a list of one
+    FastqBlock per file, each holding the same number of records.
+    """
+
+    def __init__(
+            self,
+            file_names,
+            deduplicate_header=True,
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            threads=1
+    ):
+        self.file_names = list(file_names)
+        self.readers = [
+            FastqReader(
+                file_name,
+                deduplicate_header=deduplicate_header,
+                compression=compression,
+                binary=binary,
+                threads=threads
+            )
+            for file_name in self.file_names
+        ]
+        self.stats = {"num_reads": 0}
+
+    def iter_blocks(self, n_records=DEFAULT_BLOCK_SIZE):
+        """Iterates over the files as lists of FastqBlocks of up to
+        n_records records
+        """
+        while True:
+            blocks = [reader.read_block(n_records) for reader in self.readers]
+            num_reads = len(blocks[0])
+            if any(len(block) != num_reads for block in blocks):
+                raise ValueError(
+                    "%s have different numbers of reads" %
+                    ", ".join(self.file_names)
+                )
+            if num_reads < 1:
+                break
+            self.stats["num_reads"] += num_reads
+            yield blocks
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+
+def _map_file(file_name):
+    """Returns a read-only mmap of file_name, which is opened and closed
+    here, as the mapping stays valid after its file is closed
+    """
+    with open(file_name, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            # Empty files can't be mapped, but bytes work the same way
+            return b""
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MmapFastqReader(FastqReader):
+    """A FastqReader for uncompressed files, which memory-maps the file and
+    splits it into lines directly from the mapping, rather than by read()
+    calls.
+
+    If zero_copy is True, lines are memoryview slices of the mapping, and
+    no data is copied; such lines can be compared with bytes, but must be
+    converted with bytes() for most other uses. zero_copy implies binary.
+    Finding each line end is slower than splitting a copied chunk, so
+    zero_copy is for holding many records in little memory, not for speed.
+    """
+
+    def __init__(
+            self,
+            file_name,
+            deduplicate_header=True,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            binary=False,
+            zero_copy=False
+    ):
+        super(MmapFastqReader, self).__init__(
+            file_name,
+            deduplicate_header,
+            compression=GUESS_COMPRESSION,
+            chunk_size=chunk_size,
+            binary=binary or zero_copy
+        )
+        if self.compression != NO_COMPRESSION:
+            raise ValueError(
+                "MmapFastqReader can only read uncompressed files, not %s" %
+                file_name
+            )
+        self.io.close()
+        self.zero_copy = zero_copy
+        self.map = _map_file(file_name)
+        self._map_pos = 0
+
+    def _next_lines(self):
+        mapping = self.map
+        start = self._map_pos
+        end = min(start + self.chunk_size, len(mapping))
+        if end < len(mapping):
+            # End the chunk after its last complete line
+            newline_pos = mapping.rfind(b"\n", start, end)
+            if newline_pos < 0:
+                newline_pos = mapping.find(b"\n", end)
+            end = len(mapping) if newline_pos < 0 else newline_pos + 1
+        self._map_pos = end
+        if end <= start:
+            self._eof = True
+            return [], self._empty
+        if self.zero_copy:
+            return self._line_views(start, end), self._empty
+        text = mapping[start:end]
+        if not self.binary:
+            text = text.decode("utf-8")
+        lines = text.split(self._newline)
+        if not lines[-1]:
+            lines.pop()
+        return lines, text
+
+    def _line_views(self, start, end):
+        """Returns memoryview slices of each line from start to end of the
+        mapping, without their line endings
+        """
+        mapping = self.map
+        view = memoryview(mapping)
+        lines = []
+        while start < end:
+            line_end = mapping.find(b"\n", start, end)
+            if line_end < 0:
+                line_end = end
+            next_start = line_end + 1
+            if line_end > start and mapping[line_end - 1] == 13:  # \r
+                line_end -= 1
+            lines.append(view[start:line_end])
+            start = next_start
+        return lines
+
+    def close(self):
+        # Zero copy lines still in use keep the mapping open
+        try:
+            self.map.close()
+        except (AttributeError, BufferError):
+            pass
+
+
+def _is_record_start(lines):
+    """Returns True if lines, from a possible record boundary onwards, look
+    like the start of a Fastq record. A quality line may start with "@", but
+    is then followed by a header, not a sequence and a "+" line.
+    """
+    lines = [line.rstrip(b"\r") for line in lines[:5]]
+    if len(lines) < 4:
+        return False
+    if lines[0][:1] != b"@" or lines[2][:1] != b"+":
+        return False
+    if len(lines[1]) != len(lines[3]):
+        return False
+    return len(lines) < 5 or lines[4][:1] == b"@"
+
+
+def _find_record_start(fh, pos, file_size):
+    """Returns the offset of the first record of an uncompressed Fastq file
+    which starts at or after pos, or file_size if there is none
+    """
+    window = 1 << 16
+    while True:
+        start = max(pos - 1, 0)
+        fh.seek(start)
+        data = fh.read(pos - start + window)
+        at_eof = start + len(data) >= file_size
+        # Offsets within data of each line start at or after pos
+        if pos == 0:
+            line_starts = [0]
+        else:
+            line_starts = []
+        line_end = data.find(b"\n")
+        while line_end >= 0:
+            line_starts.append(line_end + 1)
+            line_end = data.find(b"\n", line_end + 1)
+        for iii in range(len(line_starts)):
+            lines = data[line_starts[iii]:].split(b"\n")
+            if not at_eof:
+                # The last line may be incomplete
+                lines.pop()
+            if len(lines) < 5 and not at_eof:
+                break
+            if _is_record_start(lines):
+                return start + line_starts[iii]
+        else:
+            if at_eof:
+                return file_size
+        # Not enough lines to check, so read more
+        window *= 2
+
+
+def _find_bgzf_record_start(reader, block_start):
+    """Returns the virtual offset of the first record of a BGZF Fastq file
+    which starts in or after the block at block_start, or None if there is
+    none
+    """
+    reader.seek_virtual(_compression.make_virtual_offset(block_start, 0))
+    offsets = []
+    lines = []
+    # The first record starts within the first four whole lines
+    for iii in range(9):
+        offsets.append(reader.tell_virtual())
+        line = reader.readline()
+        if not line:
+            break
+        lines.append(line.rstrip(b"\n"))
+    if block_start == 0:
+        first = 0
+    else:
+        # The first line may be the end of one from the previous block
+        first = 1
+    for iii in range(first, len(lines)):
+        if _is_record_start(lines[iii:]):
+            return offsets[iii]
+    return None
+
+
+def plan_shards(file_name, num_shards):
+    """Splits an uncompressed or BGZF Fastq file into at most num_shards
+    ranges of similar size, each starting at a record boundary, so that each
+    may be read independently by a FastqShardReader.
+
+    Returns a list of (start, end) tuples. These are byte offsets for
+    uncompressed files, and virtual offsets for BGZF files, as they can only
+    be split at block boundaries. Any data before the first record is
+    skipped.
+    """
+    compression = _GenericFileHandle(file_name).compression
+    file_size = os.path.getsize(file_name)
+    if compression == NO_COMPRESSION:
+        with open(file_name, "rb") as fh:
+            starts = [
+                _find_record_start(fh, file_size * iii // num_shards, file_size)
+                for iii in range(num_shards)
+            ]
+        end = file_size
+    elif compression in (GZIPPED, BGZIPPED) and \
+            _compression.is_bgzf(file_name):
+        block_starts = list(_compression.bgzf_block_offsets(file_name))
+        reader = _compression.BgzfReader(file_name)
+        starts = []
+        for iii in range(num_shards):
+            block_idx = bisect_left(
+                block_starts,
+                file_size * iii // num_shards
+            )
+            if block_idx == len(block_starts):
+                continue
+            start = _find_bgzf_record_start(reader, block_starts[block_idx])
+            if start is not None:
+                starts.append(start)
+        reader.close()
+        end = _compression.make_virtual_offset(file_size, 0)
+    else:
+        raise ValueError(
+            "Only uncompressed and BGZF files can be split, not %s" %
+            file_name
+        )
+    # Small shards may find the same record, and the last few no record
+    starts = sorted(set(start for start in starts if start < end))
+    return list(zip(starts, starts[1:] + [end]))
+
+
+class FastqShardReader(FastqReader):
+    """A FastqReader for the records of one shard of an uncompressed or BGZF
+    file, as planned by plan_shards()
+    """
+
+    def __init__(
+            self,
+            file_name,
+            shard,
+            deduplicate_header=True,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            binary=False
+    ):
+        super(FastqShardReader, self).__init__(
+            file_name,
+            deduplicate_header,
+            compression=GUESS_COMPRESSION,
+            chunk_size=chunk_size,
+            binary=binary
+        )
+        self.io.close()
+        self.shard = shard
+        start, self._end = shard
+        if self.compression == NO_COMPRESSION:
+            self.bgzf = False
+            self.io = open(file_name, "rb")
+            self.io.seek(start)
+            self._remaining = self._end - start
+        elif self.compression in (GZIPPED, BGZIPPED) and \
+                _compression.is_bgzf(file_name):
+            self.bgzf = True
+            self.io = _compression.BgzfReader(file_name)
+            self.io.seek_virtual(start)
+        else:
+            raise ValueError(
+                "FastqShardReader can only read uncompressed or BGZF files, "
+                "not %s" % file_name
+            )
+        if binary:
+            self._decoder = None
+        else:
+            self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def _read_chunk(self):
+        if self.bgzf:
+            chunk = self.io.read(self.chunk_size, self._end)
+        else:
+            chunk = self.io.read(min(self.chunk_size, self._remaining))
+            self._remaining -= len(chunk)
+        if self._decoder is not None:
+            chunk = self._decoder.decode(chunk, final=not chunk)
+        return chunk
+
+
 class FastqRandomAccess(_Reader):
+    """Reads fastq records by their index within the file.
+
+    The start of each record is found when the reader is created. BGZF
+    files are indexed by virtual offset, so get() decompresses only the
+    block holding the record; other compressed files are decompressed from
+    their start on every get().
+
+    If persist_index is True, the index is saved to index_file_name
+    (file_name + ".fqi" by default), and is memory-mapped rather than rebuilt
+    by later readers, as long as the size and modification time of the fastq
+    file are unchanged. Read lengths and read name hashes may also be
+    indexed.
+
+    If use_mmap is True, uncompressed files are read through a memory map
+    rather than by seek() and readline() calls on a file object.
+
+    If index_names is True, reads can also be fetched by name, with
+    get_by_name() and get_many(). Names are looked up by binary search of an
+    array of their sorted hashes, which takes 16 bytes per read.
+    """
 
     def __init__(
             self,
             file_name,
             deduplicate_header=True,
-            compression=GUESS_COMPRESSION
+            compression=GUESS_COMPRESSION,
+            binary=False,
+            persist_index=False,
+            index_file_name=None,
+            index_lengths=False,
+            index_names=False,
+            use_mmap=False
     ):
         super(FastqRandomAccess, self).__init__(
             file_name,
             deduplicate_header,
-            compression
+            compression,
+            binary
         )
-        self.record_positions = array("L")
-        self._build_cache()
+        # Records are located by byte offset, so the file is always read as
+        # bytes, and lines are decoded in text mode
+        self.io.close()
+        self.bgzf = self.compression in (GZIPPED, BGZIPPED) and \
+            _compression.is_bgzf(file_name)
+        if self.bgzf:
+            self.io = _compression.BgzfReader(file_name)
+        elif use_mmap and self.compression == NO_COMPRESSION:
+            # mmaps have file-like readline(), seek() and tell() methods
+            self.io = _map_file(file_name)
+            if not self.io:
+                self.io = io.BytesIO()
+        else:
+            self.io = _GenericFileHandle(
+                file_name,
+                mode=_GenericFileHandle.READ,
+                compression=self.compression,
+                binary=True
+            ).get()
+        if index_file_name is None:
+            index_file_name = file_name + ".fqi"
+        self.index_file_name = index_file_name
+        self.index_lengths = index_lengths
+        self.index_names = index_names
+        self._index_map = None
+        # Byte offsets, or BGZF virtual offsets, of the start of each record,
+        # and optionally the length and name hash of each record
+        self.record_positions = array("Q")
+        self.record_lengths = array("I") if index_lengths else None
+        self.name_hashes = array("Q") if index_names else None
+        # Name hashes in sorted order, and the index of each one's record
+        self.sorted_name_hashes = None
+        self.name_order = None
+        if not (persist_index and self._load_index()):
+            source_stat = os.stat(file_name)
+            self._build_cache()
+            if index_names:
+                self._build_name_index()
+            if persist_index:
+                self._write_index(source_stat)
+
+    def __len__(self):
+        return len(self.record_positions)
+
+    def _tell(self):
+        if self.bgzf:
+            return self.io.tell_virtual()
+        return self.io.tell()
+
+    def _seek(self, position):
+        if self.bgzf:
+            self.io.seek_virtual(position)
+        else:
+            self.io.seek(position)
 
     def get(self, index):
-        start_pos = self.record_positions[index]
-        self.io.seek(start_pos)
-        this_read = []
-        for iii in range(4):
-            this_read.append(self.io.readline())
-        # print index, this_read
+        self._seek(self.record_positions[index])
+        this_read = [self.io.readline().rstrip(b"\r\n") for iii in range(4)]
+        if not self.binary:
+            this_read = [line.decode("utf-8") for line in this_read]
         if not len(this_read[1]) == len(this_read[3]):
             err = "Read %s has seq and qual of different lengths"
             raise ValueError(err % repr(this_read))
-        if not this_read[2][0] == "+":
+        if not this_read[2][:1] == self._plus:
             err = "Read %s has no quality header, or is misformed"
             raise ValueError(err % repr(this_read))
         if self.deduplicate_header:
             # Save space, remove duplicate headers
-            if this_read[0][1:] == this_read[0][2:]:
-                this_read[2] = "+"
+            if this_read[0][1:] == this_read[2][1:]:
+                this_read[2] = self._plus
         self.stats["num_reads"] += 1
         return this_read
 
     def _build_cache(self):
-        at_start = True
-        current_pos = 0
-        record_str = ""
-        for line in self.io:
-            if at_start:
-                if line[0] != "@":
-                    current_pos += len(line)
-                    continue
+        position = self._tell()
+        line = self.io.readline()
+        while line:
+            # Anything other than a header here is junk before the first
+            # record, or blank lines
+            if line[:1] == b"@":
+                self.record_positions.append(position)
+                if self.name_hashes is not None:
+                    self.name_hashes.append(name_hash(line))
+                seq = self.io.readline()
+                if self.record_lengths is not None:
+                    self.record_lengths.append(len(seq.rstrip(b"\r\n")))
+                self.io.readline()
+                self.io.readline()
+            position = self._tell()
+            line = self.io.readline()
+
+    def _build_name_index(self):
+        """Sorts the name hashes, keeping the index of each one's record.
+        The index is held in arrays as it is built: it is sorted by NumPy if
+        it is installed, or else in chunks of NAME_SORT_CHUNK records which
+        are then merged.
+        """
+        name_hashes = self.name_hashes
+        if np is not None:
+            hashes = np.frombuffer(name_hashes, dtype=np.uint64)
+            order = np.argsort(hashes, kind="stable")
+            self.name_order = array("Q", order.astype(np.uint64).tobytes())
+            self.sorted_name_hashes = array("Q", hashes[order].tobytes())
+            return
+        chunks = []
+        for start in range(0, len(name_hashes), NAME_SORT_CHUNK):
+            order = sorted(
+                range(start, min(start + NAME_SORT_CHUNK, len(name_hashes))),
+                key=name_hashes.__getitem__
+            )
+            chunks.append(zip(
+                array("Q", (name_hashes[iii] for iii in order)),
+                array("Q", order)
+            ))
+        self.name_order = array("Q")
+        self.sorted_name_hashes = array("Q")
+        for this_hash, index in merge(*chunks):
+            self.sorted_name_hashes.append(this_hash)
+            self.name_order.append(index)
+
+    def _name_range(self, name):
+        """Returns name, without any leading "@" or comment, and the range of
+        positions in sorted_name_hashes of the reads which may be called name
+        """
+        if self.sorted_name_hashes is None:
+            raise ValueError(
+                "Reads can only be fetched by name if index_names is True"
+            )
+        if not isinstance(name, str):
+            name = name.decode("utf-8")
+        if name[:1] == "@":
+            name = read_name(name)
+        this_hash = name_hash(name)
+        sorted_hashes = self.sorted_name_hashes
+        return (
+            name,
+            bisect_left(sorted_hashes, this_hash),
+            bisect_right(sorted_hashes, this_hash)
+        )
+
+    def _find_name(self, name):
+        """Returns the index of the read called name"""
+        name, start, end = self._name_range(name)
+        # Hashes may collide, so check the name of each read with this hash
+        for iii in range(start, end):
+            index = self.name_order[iii]
+            self._seek(self.record_positions[index])
+            header = self.io.readline().decode("utf-8")
+            if read_name(header) == name:
+                return index
+        raise KeyError(name)
+
+    def get_by_name(self, name):
+        return self.get(self._find_name(name))
+
+    def get_many(self, names):
+        """Returns the reads called names, in the same order. Reads are
+        fetched in order of their position in the file, so that the file is
+        read in a single forward pass, and their names are checked as they
+        are fetched. Only reads whose name hash collides with another's need
+        a further pass.
+        """
+        wanted = [self._name_range(name) for name in names]
+        for name, start, end in wanted:
+            if start == end:
+                raise KeyError(name)
+        positions = self.record_positions
+        order = self.name_order
+        reads = [None] * len(wanted)
+        # Each name, and the position in sorted_name_hashes of the read next
+        # checked for it
+        pending = [(iii, start) for iii, (_, start, _) in enumerate(wanted)]
+        while pending:
+            pending.sort(key=lambda item: positions[order[item[1]]])
+            collided = []
+            for iii, jjj in pending:
+                read = self.get(order[jjj])
+                header = read[0]
+                if not isinstance(header, str):
+                    header = header.decode("utf-8")
+                name, start, end = wanted[iii]
+                if read_name(header) == name:
+                    reads[iii] = read
+                elif jjj + 1 < end:
+                    collided.append((iii, jjj + 1))
                 else:
-                    at_start = False
-            if line[0] == "@":
-                current_pos += len(record_str)
-                self.record_positions.append(current_pos)
-                record_str = line
-            else:
-                record_str += line
+                    raise KeyError(name)
+            pending = collided
+        return reads
+
+    def _index_flags(self):
+        flags = 0
+        if self.bgzf:
+            flags |= FQI_VIRTUAL_OFFSETS
+        if self.record_lengths is not None:
+            flags |= FQI_LENGTHS
+        if self.name_hashes is not None:
+            flags |= FQI_NAME_HASHES
+        if sys.byteorder == "big":
+            flags |= FQI_BIG_ENDIAN
+        return flags
+
+    def _write_index(self, source_stat):
+        """Saves the index. Failure to do so, e.g. as the directory is read
+        only, is not an error, the index just won't be reused.
+        """
+        tmp_file_name = self.index_file_name + ".tmp"
+        try:
+            with open(tmp_file_name, "wb") as fh:
+                fh.write(FQI_HEADER.pack(
+                    FQI_MAGIC,
+                    FQI_VERSION,
+                    self._index_flags(),
+                    source_stat.st_size,
+                    source_stat.st_mtime_ns,
+                    len(self.record_positions)
+                ))
+                self.record_positions.tofile(fh)
+                if self.record_lengths is not None:
+                    self.record_lengths.tofile(fh)
+                if self.name_hashes is not None:
+                    self.name_hashes.tofile(fh)
+                    self.sorted_name_hashes.tofile(fh)
+                    self.name_order.tofile(fh)
+            os.replace(tmp_file_name, self.index_file_name)
+        except (IOError, OSError):
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+
+    def _load_index(self):
+        """Memory-maps a saved index, returning False if there is none, or if
+        it is out of date or lacks anything requested of this reader.
+        """
+        try:
+            fh = open(self.index_file_name, "rb")
+        except (IOError, OSError):
+            return False
+        with fh:
+            header = fh.read(FQI_HEADER.size)
+            if len(header) < FQI_HEADER.size:
+                return False
+            magic, version, flags, size, mtime, num_records = \
+                FQI_HEADER.unpack(header)
+            source_stat = os.stat(self.file_name)
+            wanted_flags = self._index_flags()
+            if magic != FQI_MAGIC or version != FQI_VERSION or \
+                    size != source_stat.st_size or \
+                    mtime != source_stat.st_mtime_ns or \
+                    flags & wanted_flags != wanted_flags or \
+                    flags & FQI_VIRTUAL_OFFSETS != \
+                    wanted_flags & FQI_VIRTUAL_OFFSETS or \
+                    flags & FQI_BIG_ENDIAN != wanted_flags & FQI_BIG_ENDIAN:
+                return False
+            index_size = FQI_HEADER.size + 8 * num_records
+            if flags & FQI_LENGTHS:
+                index_size += 4 * num_records
+            if flags & FQI_NAME_HASHES:
+                index_size += 3 * 8 * num_records
+            if os.fstat(fh.fileno()).st_size != index_size:
+                return False
+            self._index_map = mmap.mmap(
+                fh.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+        view = memoryview(self._index_map)
+        start = FQI_HEADER.size
+        self.record_positions = view[start:start + 8 * num_records].cast("Q")
+        start += 8 * num_records
+        if flags & FQI_LENGTHS:
+            self.record_lengths = \
+                view[start:start + 4 * num_records].cast("I")
+            start += 4 * num_records
+        if flags & FQI_NAME_HASHES:
+            for name in ("name_hashes", "sorted_name_hashes", "name_order"):
+                setattr(
+                    self,
+                    name,
+                    view[start:start + 8 * num_records].cast("Q")
+                )
+                start += 8 * num_records
+        return True
+
+    def close(self):
+        if self._index_map is not None:
+            for name in ("record_positions", "record_lengths", "name_hashes",
+                         "sorted_name_hashes", "name_order"):
+                view = getattr(self, name)
+                if isinstance(view, memoryview):
+                    view.release()
+                    setattr(self, name, None)
+            self._index_map.close()
+            self._index_map = None
+        self.io.close()
+
+
+def read_name(header):
+    """Returns the name of a read, its header up to the first whitespace,
+    without the leading "@"
+    """
+    name = header[1:].split(None, 1)
+    return name[0] if name else header[1:1]
+
+
+def mate_name(header):
+    """Returns the name shared by the reads of a pair: that of read_name(),
+    without any "/1" or "/2" mate suffix
+    """
+    name = read_name(header)
+    if name[-2:] in ("/1", "/2", b"/1", b"/2"):
+        name = name[:-2]
+    return name
+
+
+def name_hash(name):
+    """Returns a 64 bit hash of a read's name, which is stable between runs
+    and machines. name may be a header line, or a bare name, as str or bytes.
+    """
+    if isinstance(name, str):
+        name = name.encode("utf-8")
+    if name[:1] == b"@":
+        name = read_name(name)
+    digest = hashlib.blake2b(name.rstrip(b"\r\n"), digest_size=8).digest()
+    return struct.unpack("<Q", digest)[0]
 
 
 def base_match(base_1, base_2, allow_ambiguity=True):
@@ -412,21 +1559,47 @@ def seq_match(seq_1, seq_2, mismatches=0, allow_ambiguity=False):
         return True
 
 
+def hamming_neighbors(seq, max_distance, alphabet="ACGTN"):
+    """
+    hamming_neighbors(seq, max_distance):
+        Yields (neighbor, distance) for seq itself and every sequence which
+        differs from it by at most max_distance substitutions of bases from
+        alphabet
+    """
+    yield seq, 0
+    for distance in range(1, max_distance + 1):
+        for positions in combinations(range(len(seq)), distance):
+            choices = [
+                [base for base in alphabet if base != seq[pos]]
+                for pos in positions
+            ]
+            for bases in product(*choices):
+                neighbor = list(seq)
+                for pos, base in zip(positions, bases):
+                    neighbor[pos] = base
+                yield "".join(neighbor), distance
+
+
 def num_Ns_in_read(read):
     seq = read[1]
-    seq = seq.upper()
-    if "N" not in seq:
+    if isinstance(seq, str):
+        n_count = seq.count("N") + seq.count("n")
+    else:
+        n_count = seq.count(b"N") + seq.count(b"n")
+    if n_count == 0:
         return False
     else:
-        return seq.count('N')
+        return n_count
 
 
 def get_qual_from_phred(phred, offset):
-    qual = ord(phred) - offset
+    # Items of a bytes phred string are already ints
+    phred_ord = phred if isinstance(phred, int) else ord(phred)
+    qual = phred_ord - offset
     if qual < 0:
         raise ValueError(
-            "Invalid quality score %i from phred %s (ord %i)" %
-            (qual, phred, ord(phred))
+            "Invalid quality score %i from phred %r (ord %i)" %
+            (qual, phred, phred_ord)
         )
     return qual
 
@@ -435,48 +1608,68 @@ def get_phred_from_qual(qual, offset):
     return chr(qual + offset)
 
 
-def percentile_from_counts(count_list, percentile):
-    """Returns the median value from a list whose values are counts of the
-    index i
+def _percentile_from_cumulative(count_list, cumulative, percentile):
+    """Returns the percentile of a list whose values are counts of the index
+    i, given the cumulative sums of the list. Takes a binary search of the
+    sums, rather than a step through every count.
     """
-    # The index of the median, or of the lower of the two values if sum is even
-    halfway_index = int(round(float(sum(count_list) * percentile))) - 1
-    current_index = 0
-    pos_within_value = 0  # Governs when we skip to the next median value
-    median = 0
-    while current_index <= halfway_index:
-        # If we have not iterated through all counts of this value of median
-        if pos_within_value < count_list[median]:
-            pos_within_value += 1
-            current_index += 1
-        else:
-            # Move to next median
-            median += 1
-            pos_within_value = 0
-    # At this point, median == lower of two values if the number of counts is
-    # even, so we need to average the current value of median with the
-    # following value of median (which may be the same number) to get the
-    # median. If the number of counts is odd, then median == true median
-    if sum(count_list) % 2 == 0:
-        lower_score = median
-        if count_list[median] < pos_within_value + 1:
-            upper_score = median + 1
+    total = cumulative[-1] if cumulative else 0
+    # The index of the percentile, or of the lower of the two values around
+    # it if the total is even
+    index = int(round(float(total * percentile))) - 1
+    if index < 0:
+        value = 0
+        pos_within_value = 0
+    else:
+        value = bisect_right(cumulative, index)
+        # How many counts of value are at or before index
+        pos_within_value = index + 1
+        if value > 0:
+            pos_within_value -= cumulative[value - 1]
+    # If the total is even, average the value with the following one, which
+    # is the next index if index is the last count of value
+    if total % 2 == 0:
+        if count_list[value] < pos_within_value + 1:
+            upper_value = value + 1
         else:
-            upper_score = median
-        median = float(lower_score + upper_score) / 2.0
-    return float(median)
+            upper_value = value
+        return float(value + upper_value) / 2.0
+    return float(value)
 
 
-def whiskers_from_counts(count_list):
-    q1 = percentile_from_counts(count_list, 0.25)
-    q3 = percentile_from_counts(count_list, 0.75)
-    median = percentile_from_counts(count_list, 0.5)
+def percentile_from_counts(count_list, percentile):
+    """Returns the percentile of a list whose values are counts of the index
+    i
+    """
+    return _percentile_from_cumulative(
+        count_list,
+        list(accumulate(count_list)),
+        percentile
+    )
+
+
+def quartiles_from_counts(count_list):
+    """Returns the first quartile, median and third quartile of a list whose
+    values are counts of the index i
+    """
+    cumulative = list(accumulate(count_list))
+    return tuple(
+        _percentile_from_cumulative(count_list, cumulative, percentile)
+        for percentile in (0.25, 0.5, 0.75)
+    )
+
+
+def whiskers_from_quartiles(q1, median, q3):
     iqr = q3 - q1
     left_whisker = median - 1.5 * iqr
     right_whisker = median + 1.5 * iqr
     return (left_whisker, right_whisker)
 
 
+def whiskers_from_counts(count_list):
+    return whiskers_from_quartiles(*quartiles_from_counts(count_list))
+
+
 def dict_to_tuples(this_dict):
     tuples = []
     for key, value in this_dict:
@@ -492,6 +1685,11 @@ def tuples_to_dict(tuples):
 
 
 def convert_phred_offset(in_phred, in_qual_offset, out_qual_offset):
+    if not isinstance(in_phred, str):
+        return bytes(bytearray(
+            get_qual_from_phred(char, in_qual_offset) + out_qual_offset
+            for char in in_phred
+        ))
     out_phred = ""
     for char in in_phred:
         out_phred += get_phred_from_qual(
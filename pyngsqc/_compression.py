@@ -0,0 +1,414 @@
+# Copyright 2012 Kevin Murray
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import struct
+import threading
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# zlib wbits which read and write gzip headers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+COMPRESSED_CHUNK_SIZE = 1 << 20
+UNCOMPRESSED_BLOCK_SIZE = 1 << 20
+
+## BGZF
+# Uncompressed size of each block, chosen (as by samtools) so that even
+# incompressible data fits in a 64 KiB block
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_MAX_BLOCK_SIZE = 1 << 16
+# Fixed gzip header with a "BC" extra subfield. The subfield holds the total
+# block size minus one, as a little endian uint16
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+BGZF_EOF = BGZF_HEADER + b"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+
+def compress_member(data, compression_level):
+    """Compresses data as a complete, independent gzip member"""
+    compressor = zlib.compressobj(
+        compression_level,
+        zlib.DEFLATED,
+        GZIP_WBITS
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_bgzf_block(data, compression_level):
+    """Compresses up to BGZF_BLOCK_SIZE bytes of data as one BGZF block"""
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    # Header, BSIZE, data, CRC32 and ISIZE
+    block_size = len(BGZF_HEADER) + 2 + len(cdata) + 8
+    if block_size > BGZF_MAX_BLOCK_SIZE:
+        # Incompressible, so store it
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        block_size = len(BGZF_HEADER) + 2 + len(cdata) + 8
+    return b"".join([
+        BGZF_HEADER,
+        struct.pack("<H", block_size - 1),
+        cdata,
+        struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+    ])
+
+
+def is_bgzf(file_name):
+    """Returns True if file_name starts with a BGZF block header"""
+    with open(file_name, "rb") as fh:
+        header = fh.read(len(BGZF_HEADER))
+    # MTIME, XFL and OS may differ between BGZF writers
+    return header[:4] == BGZF_HEADER[:4] and header[10:] == BGZF_HEADER[10:]
+
+
+def bgzf_block_offsets(file_name):
+    """Yields the compressed offset of each block of a BGZF file. Only block
+    headers are read, so this is fast even for very large files.
+    """
+    with open(file_name, "rb") as fh:
+        block_start = 0
+        while True:
+            fh.seek(block_start)
+            header = fh.read(len(BGZF_HEADER) + 2)
+            if len(header) < len(BGZF_HEADER) + 2:
+                break
+            if header[:4] != BGZF_HEADER[:4] or \
+                    header[10:len(BGZF_HEADER)] != BGZF_HEADER[10:]:
+                raise ValueError(
+                    "%s is not a BGZF file (bad block at %i)" %
+                    (file_name, block_start)
+                )
+            yield block_start
+            block_start += struct.unpack("<H", header[-2:])[0] + 1
+
+
+def make_virtual_offset(block_start, within_block):
+    return (block_start << 16) | within_block
+
+
+def split_virtual_offset(virtual_offset):
+    """Returns the (compressed offset of the block, offset within the
+    decompressed block) of a BGZF virtual offset
+    """
+    return (virtual_offset >> 16, virtual_offset & 0xffff)
+
+
+class ThreadedGzipReader(io.RawIOBase):
+    """A raw file object which reads a gzip file, which may consist of many
+    members, decompressing it in a separate thread.
+
+    Decompressed chunks are passed to the reading thread through a queue of
+    at most queue_size chunks, so decompression runs alongside parsing.
+    """
+
+    def __init__(self, file_name, queue_size=8):
+        self.file_name = file_name
+        self._queue = queue.Queue(queue_size)
+        self._buffer = b""
+        self._buffer_pos = 0
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        # Gives up if the reader is closed while the queue is full
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress(self):
+        try:
+            with open(self.file_name, "rb") as fh:
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                in_member = False
+                while not self._stop.is_set():
+                    data = fh.read(COMPRESSED_CHUNK_SIZE)
+                    if not data:
+                        break
+                    while data:
+                        in_member = True
+                        chunk = decompressor.decompress(data)
+                        if chunk and not self._put(chunk):
+                            return
+                        if decompressor.eof:
+                            # Start of the next gzip member
+                            data = decompressor.unused_data
+                            decompressor = zlib.decompressobj(GZIP_WBITS)
+                            in_member = False
+                        else:
+                            data = b""
+                if in_member:
+                    raise EOFError(
+                        "%s ended before the end of a gzip member" %
+                        self.file_name
+                    )
+            self._put(None)
+        except Exception as err:
+            self._put(err)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while self._buffer_pos >= len(self._buffer):
+            if self._eof:
+                return 0
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                return 0
+            if isinstance(chunk, Exception):
+                self._eof = True
+                raise chunk
+            self._buffer = chunk
+            self._buffer_pos = 0
+        size = min(len(buf), len(self._buffer) - self._buffer_pos)
+        buf[:size] = self._buffer[self._buffer_pos:self._buffer_pos + size]
+        self._buffer_pos += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super(ThreadedGzipReader, self).close()
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """A raw file object which writes a gzip file, compressing blocks of
+    block_size bytes as independent gzip members in a pool of threads.
+
+    The members are written in order, and their concatenation is a valid
+    gzip file which any gzip reader can decompress.
+    """
+
+    def __init__(
+            self,
+            file_name,
+            threads=2,
+            compression_level=6,
+            block_size=UNCOMPRESSED_BLOCK_SIZE
+    ):
+        self.file_name = file_name
+        self.threads = threads
+        self.compression_level = compression_level
+        self.block_size = block_size
+        self._fh = open(file_name, "wb")
+        # Made on the first write, as a writer may be forked into another
+        # process first, and a pool's threads do not survive a fork
+        self._pool = None
+        self._pending = deque()
+        self._buffer = []
+        self._buffer_len = 0
+
+    def writable(self):
+        return True
+
+    def _compress(self, data):
+        return compress_member(data, self.compression_level)
+
+    def _submit(self, data):
+        if self.threads <= 1:
+            self._fh.write(self._compress(data))
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+        self._pending.append(self._pool.apply_async(self._compress, (data,)))
+        # Bounds the number of blocks held in memory
+        while len(self._pending) > 2 * self.threads:
+            self._fh.write(self._pending.popleft().get())
+
+    def write(self, data):
+        num_bytes = len(data)
+        self._buffer.append(bytes(data))
+        self._buffer_len += num_bytes
+        if self._buffer_len >= self.block_size:
+            data = b"".join(self._buffer)
+            for start in range(0, len(data), self.block_size):
+                block = data[start:start + self.block_size]
+                if len(block) < self.block_size:
+                    # Keep the remainder for the next block
+                    self._buffer = [block]
+                    self._buffer_len = len(block)
+                    break
+                self._submit(block)
+            else:
+                self._buffer = []
+                self._buffer_len = 0
+        return num_bytes
+
+    def flush(self):
+        if self._fh.closed:
+            return
+        if self._buffer_len > 0:
+            self._submit(b"".join(self._buffer))
+            self._buffer = []
+            self._buffer_len = 0
+        while self._pending:
+            self._fh.write(self._pending.popleft().get())
+        self._fh.flush()
+
+    def _finish(self):
+        """Writes anything which must follow the last block"""
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._finish()
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+            self._fh.close()
+        super(ParallelGzipWriter, self).close()
+
+
+class BgzfWriter(ParallelGzipWriter):
+    """A raw file object which writes a BGZF (blocked gzip) file, as used by
+    samtools and tabix. It is a valid gzip file of many small members, each
+    of which can be decompressed alone, allowing random access.
+    """
+
+    def __init__(self, file_name, threads=1, compression_level=6):
+        super(BgzfWriter, self).__init__(
+            file_name,
+            threads=threads,
+            compression_level=compression_level,
+            block_size=BGZF_BLOCK_SIZE
+        )
+
+    def _compress(self, data):
+        return compress_bgzf_block(data, self.compression_level)
+
+    def _finish(self):
+        self._fh.write(BGZF_EOF)
+
+
+class BgzfReader(object):
+    """Reads lines from a BGZF file, with seeking to and telling of virtual
+    offsets. A virtual offset is the compressed offset of a block shifted
+    left 16 bits, plus the offset within that block's decompressed data.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._fh = open(file_name, "rb")
+        self._block_start = 0
+        self._next_block_start = 0
+        self._data = b""
+        self._pos = 0
+        self._load_block(0)
+
+    def _load_block(self, block_start):
+        """Loads the block at compressed offset block_start, returning False
+        if it is past the end of the file
+        """
+        self._fh.seek(block_start)
+        header = self._fh.read(12)
+        if len(header) < 12:
+            self._block_start = self._next_block_start = block_start
+            self._data = b""
+            self._pos = 0
+            return False
+        if header[:4] != BGZF_HEADER[:4]:
+            raise ValueError(
+                "%s is not a BGZF file (bad block at %i)" %
+                (self.file_name, block_start)
+            )
+        extra_len = struct.unpack("<H", header[10:12])[0]
+        extra = self._fh.read(extra_len)
+        block_size = None
+        pos = 0
+        while pos + 4 <= extra_len:
+            sub_len = struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+            if extra[pos:pos + 2] == b"BC":
+                block_size = struct.unpack("<H", extra[pos + 4:pos + 6])[0] + 1
+            pos += 4 + sub_len
+        if block_size is None:
+            raise ValueError(
+                "%s is not a BGZF file (no block size at %i)" %
+                (self.file_name, block_start)
+            )
+        cdata = self._fh.read(block_size - 12 - extra_len - 8)
+        self._data = zlib.decompress(cdata, -15)
+        self._block_start = block_start
+        self._next_block_start = block_start + block_size
+        self._pos = 0
+        return True
+
+    def _next_block(self):
+        """Moves to the start of the next non-empty block"""
+        while self._pos >= len(self._data):
+            if not self._load_block(self._next_block_start):
+                return False
+        return True
+
+    def seek_virtual(self, virtual_offset):
+        block_start, within_block = split_virtual_offset(virtual_offset)
+        if block_start != self._block_start or not self._data:
+            self._load_block(block_start)
+        self._pos = within_block
+
+    def tell_virtual(self):
+        self._next_block()
+        return make_virtual_offset(self._block_start, self._pos)
+
+    def read(self, size=-1, end_virtual_offset=None):
+        """Reads up to size bytes, or all if size is negative, stopping at
+        end_virtual_offset if it is given
+        """
+        parts = []
+        num_read = 0
+        if end_virtual_offset is not None:
+            end_block, end_within = split_virtual_offset(end_virtual_offset)
+        while (size < 0 or num_read < size) and self._next_block():
+            stop = len(self._data)
+            if end_virtual_offset is not None:
+                if self._block_start > end_block or \
+                        (self._block_start == end_block and
+                         self._pos >= end_within):
+                    break
+                if self._block_start == end_block:
+                    stop = min(stop, end_within)
+            if size >= 0:
+                stop = min(stop, self._pos + size - num_read)
+            parts.append(self._data[self._pos:stop])
+            num_read += stop - self._pos
+            self._pos = stop
+        return b"".join(parts)
+
+    def readline(self):
+        parts = []
+        while self._next_block():
+            end = self._data.find(b"\n", self._pos)
+            if end >= 0:
+                parts.append(self._data[self._pos:end + 1])
+                self._pos = end + 1
+                break
+            parts.append(self._data[self._pos:])
+            self._pos = len(self._data)
+        return b"".join(parts)
+
+    def close(self):
+        self._fh.close()
@@ -13,6 +13,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import multiprocessing as mp
+import os
+import shutil
+import pyngsqc
+from pyngsqc import _compression
+
+# Bytes copied at a time when joining the outputs of shards
+COPY_BUFFER_SIZE = 1 << 20
 
 
 class Process(mp.Process):
@@ -30,21 +37,29 @@ class Process(mp.Process):
                 # None is the Poison pill, means shutdown
                 self.task_queue.task_done()
                 break
-            answer = next_task()
+            # Tasks are tagged with their chunk's sequence number
+            seq_num, task = next_task
+            answer = task()
             self.task_queue.task_done()
-            self.result_queue.put(answer)
+            self.result_queue.put((seq_num, answer))
 
 
 class WriterProcess(mp.Process):
 
-    def __init__(self, queue, output_queue, writer):
-#    def __init__(self, queue, writer):
+    def __init__(self, queue, output_queue, writer, in_flight=None):
         mp.Process.__init__(self)
         self.queue = queue
         self.output_queue = output_queue
         self.writer = writer
+        # If given, results are written in order of their sequence numbers,
+        # and in_flight is released as each one is written
+        self.in_flight = in_flight
 
     def run(self):
+        # Results which arrived before those preceding them, by sequence
+        # number
+        reorder_buffer = {}
+        next_seq_num = 0
         while True:
             result = self.queue.get()
             if result is None:
@@ -52,36 +67,105 @@ class WriterProcess(mp.Process):
                 self.writer.close()
                 self.queue.task_done()
                 break
-            self.writer.write(result)
+            seq_num, answer = result
+            if self.in_flight is None:
+                self.writer.write_block(answer)
+            else:
+                reorder_buffer[seq_num] = answer
+                while next_seq_num in reorder_buffer:
+                    self.writer.write_block(reorder_buffer.pop(next_seq_num))
+                    next_seq_num += 1
+                    self.in_flight.release()
             self.queue.task_done()
         self.output_queue.put(self.writer.stats)
 
 
 class ParallelRunner(object):
+    """Runs a task over every read of reader in num_procs worker processes,
+    writing the results with writer in a separate process.
+
+    Reads are sent to the workers in chunks of chunk_size records. task is
+    constructed as task(block, *task_args) for each chunk, and calling it
+    must return one result for the whole chunk, which is passed to
+    writer.write_block(). At most queue_depth chunks are queued for the
+    workers, and for the writer, at any one time.
+
+    If ordered is True, results are written in the order of the input, so
+    output is identical to that of a serial run. Chunks which finish early
+    are held by the writer until those before them are written; at most
+    reorder_buffer chunks may be read but not yet written at any one time.
+
+    If with_offsets is True, task is instead constructed as
+    task(block, offset, *task_args), where offset is the number of reads
+    before the chunk.
+    """
 
-    def __init__(self, task, reader, writer, task_args=tuple()):
+    def __init__(
+            self,
+            task,
+            reader,
+            writer,
+            task_args=tuple(),
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False,
+            reorder_buffer=None,
+            with_offsets=False
+    ):
         self.task = task
         self.reader = reader
         self.writer = writer
         self.task_args = task_args
+        self.chunk_size = chunk_size
+        if num_procs is None:
+            num_procs = mp.cpu_count()
+        self.num_procs = num_procs
+        if queue_depth is None:
+            queue_depth = 4 * num_procs
+        self.queue_depth = queue_depth
+        self.ordered = ordered
+        if reorder_buffer is None:
+            reorder_buffer = 2 * queue_depth + num_procs
+        self.reorder_buffer = reorder_buffer
+        self.with_offsets = with_offsets
         self.num_reads = 0
         self.num_written_reads = 0
 
     def run(self):
-        tasks = mp.JoinableQueue(5000)
-        results = mp.JoinableQueue(5000)
+        tasks = mp.JoinableQueue(self.queue_depth)
+        results = mp.JoinableQueue(self.queue_depth)
         writer_result = mp.Queue()
-        num_procs = mp.cpu_count()
+        num_procs = self.num_procs
 
         procs = [Process(tasks, results) for i in range(num_procs)]
         for proc in procs:
             proc.start()
 
-        writer_proc = WriterProcess(results, writer_result, self.writer)
+        if self.ordered:
+            in_flight = mp.BoundedSemaphore(self.reorder_buffer)
+        else:
+            in_flight = None
+        writer_proc = WriterProcess(
+            results,
+            writer_result,
+            self.writer,
+            in_flight
+        )
         writer_proc.start()
 
-        for read in self.reader:
-            tasks.put(self.task(read, *self.task_args))
+        seq_num = 0
+        for block in self.reader.iter_blocks(self.chunk_size):
+            if in_flight is not None:
+                # Bounds the writer's reorder buffer
+                in_flight.acquire()
+            if self.with_offsets:
+                task = self.task(block, self.num_reads, *self.task_args)
+            else:
+                task = self.task(block, *self.task_args)
+            self.num_reads += len(block)
+            tasks.put((seq_num, task))
+            seq_num += 1
 
         # Add a poison pill for each process
         for i in range(num_procs):
@@ -95,3 +179,136 @@ class ParallelRunner(object):
         results.put(None)
 
         self.stats = writer_result.get()
+        self.num_written_reads = self.stats["num_reads"]
+
+
+class ShardProcess(mp.Process):
+    """Runs tool over one shard of its input file, writing to out_file_name
+    if the tool has an output file
+    """
+
+    def __init__(self, tool, shard_num, shard, out_file_name, result_queue):
+        mp.Process.__init__(self)
+        self.tool = tool
+        self.shard_num = shard_num
+        self.shard = shard
+        self.out_file_name = out_file_name
+        self.result_queue = result_queue
+
+    def run(self):
+        tool = self.tool
+        try:
+            tool.reader = pyngsqc.FastqShardReader(
+                tool.in_file_name,
+                self.shard,
+                deduplicate_header=tool.reader.deduplicate_header,
+                binary=tool.binary
+            )
+            if self.out_file_name is not None:
+                tool.writer = pyngsqc.FastqWriter(
+                    self.out_file_name,
+                    compression=tool.writer.compression,
+                    binary=tool.binary,
+                    compression_level=tool.writer.compression_level
+                )
+            tool.print_summary = False
+            answer = tool._run_shard()
+            if self.out_file_name is not None:
+                tool.writer.close()
+        except Exception as err:
+            # Re-raised by the ShardRunner, rather than leaving it waiting
+            answer = err
+        self.result_queue.put((self.shard_num, answer))
+
+
+def _copy_without_eof(in_fh, out_fh):
+    """Copies BGZF file in_fh to out_fh, less any EOF marker block at its
+    end, as only the last EOF marker of a file should be kept
+    """
+    in_fh.seek(0, os.SEEK_END)
+    size = in_fh.tell()
+    eof_size = len(_compression.BGZF_EOF)
+    if size >= eof_size:
+        in_fh.seek(size - eof_size)
+        if in_fh.read(eof_size) == _compression.BGZF_EOF:
+            size -= eof_size
+    in_fh.seek(0)
+    while size > 0:
+        data = in_fh.read(min(size, COPY_BUFFER_SIZE))
+        if not data:
+            break
+        out_fh.write(data)
+        size -= len(data)
+
+
+class ShardRunner(object):
+    """Runs tool over num_shards byte ranges of its input file at once, each
+    in its own process with its own reader, as planned by
+    pyngsqc.plan_shards(). The input must be uncompressed or BGZF.
+
+    Each shard is written to a temporary file, and these are joined in order
+    once all shards are done, so output is identical to that of a serial run.
+    tool._run_shard() is called in each process, and its answers are kept in
+    self.answers, by shard. The reader and writer num_reads of each shard are
+    summed into self.stats.
+    """
+
+    def __init__(self, tool, num_shards=None):
+        self.tool = tool
+        if num_shards is None:
+            num_shards = mp.cpu_count()
+        self.num_shards = num_shards
+        self.answers = []
+        self.stats = {}
+
+    def _join_outputs(self, shard_file_names):
+        out_file_name = self.tool.out_file_name
+        strip_eof = self.tool.writer.compression == pyngsqc.BGZIPPED
+        self.tool.writer.close()
+        with open(out_file_name, "wb") as out_fh:
+            for iii, file_name in enumerate(shard_file_names):
+                with open(file_name, "rb") as in_fh:
+                    # Shards are streamed, as each may be many GB
+                    if strip_eof and iii < len(shard_file_names) - 1:
+                        _copy_without_eof(in_fh, out_fh)
+                    else:
+                        shutil.copyfileobj(in_fh, out_fh)
+                os.remove(file_name)
+
+    def run(self):
+        tool = self.tool
+        shards = pyngsqc.plan_shards(tool.in_file_name, self.num_shards)
+        has_output = getattr(tool, "out_file_name", None) is not None
+        if has_output:
+            shard_file_names = [
+                "%s.shard%i" % (tool.out_file_name, iii)
+                for iii in range(len(shards))
+            ]
+        else:
+            shard_file_names = [None for shard in shards]
+
+        results = mp.Queue()
+        procs = [
+            ShardProcess(tool, iii, shards[iii], shard_file_names[iii], results)
+            for iii in range(len(shards))
+        ]
+        for proc in procs:
+            proc.start()
+        # Results must be taken from the queue before the processes can end
+        answers = dict(results.get() for proc in procs)
+        for proc in procs:
+            proc.join()
+        self.answers = [answers[iii] for iii in range(len(shards))]
+        for answer in self.answers:
+            if isinstance(answer, Exception):
+                raise answer
+
+        if has_output:
+            self._join_outputs(shard_file_names)
+        for key in ("reader", "writer"):
+            if all(key in answer for answer in self.answers):
+                self.stats[key] = {
+                    "num_reads": sum(
+                        answer[key]["num_reads"] for answer in self.answers
+                    )
+                }
@@ -0,0 +1,408 @@
+# Copyright 2012 Kevin Murray
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import lru_cache
+from itertools import product
+from sys import stderr
+import pyngsqc
+from pyngsqc import _parallel
+
+# Most sequences an ambiguous adapter k-mer may stand for before the adapter
+# is instead checked at every position of every read
+MAX_KMER_EXPANSIONS = 256
+# Range of k-mer sizes considered for the adapter index, and the read length
+# for which the best of them is chosen
+MIN_KMER_SIZE = 4
+MAX_KMER_SIZE = 12
+NOMINAL_READ_LENGTH = 150
+# Most AdapterMatchers kept by each process, by their constructor arguments,
+# so that a parallel worker builds a matcher's index once, not for every
+# chunk, without keeping every matcher ever built
+MATCHER_CACHE_SIZE = 16
+
+
+class AdapterMatcher(object):
+    """Finds 3' adapters in reads, allowing up to error_rate mismatches per
+    base of overlap (no gaps), and partial adapters of at least min_overlap
+    bases at the 3' end of the read. If allow_ambiguity, IUPAC codes in
+    adapters match as in pyngsqc.base_match().
+
+    Every k-mer of every adapter is indexed up front. Any match which is
+    long enough must, by the pigeonhole principle, contain a k-mer with no
+    mismatches, so reads sharing no k-mer with any adapter are ruled out
+    by one set operation. Only shorter overlaps at the 3' end of the read
+    are checked directly.
+    """
+
+    def __init__(
+            self,
+            adapters,
+            error_rate=0.1,
+            min_overlap=3,
+            allow_ambiguity=True,
+            kmer_size=None
+    ):
+        self.adapters = [adapter.upper() for adapter in adapters]
+        self.error_rate = error_rate
+        self.min_overlap = min_overlap
+        # For each base of each adapter, the read characters which match it
+        self._allowed = []
+        for adapter in self.adapters:
+            allowed = []
+            for base in adapter:
+                if allow_ambiguity:
+                    bases = pyngsqc.AMBIGUITY_DICT.get(base, [base])
+                else:
+                    bases = [base]
+                chars = "".join(bases)
+                allowed.append(frozenset((chars + chars.lower()).encode()))
+            self._allowed.append(allowed)
+        # Mismatches allowed for each length of overlap
+        self._errors = [
+            self._max_errors(overlap)
+            for overlap in range(max(map(len, self.adapters)) + 1)
+        ]
+        if kmer_size is None:
+            kmer_size = min(
+                range(MIN_KMER_SIZE, MAX_KMER_SIZE + 1),
+                key=self._expected_checks
+            )
+        self.kmer_size = kmer_size
+        self._build_index()
+        self._slices = {}
+
+    def _max_errors(self, overlap):
+        return int(overlap * self.error_rate)
+
+    def _min_exact_run(self, overlap):
+        """Returns the length of exact match which any match of overlap
+        bases must contain
+        """
+        errors = self._max_errors(overlap)
+        return (overlap - errors) // (errors + 1)
+
+    def _min_indexed_overlap(self, adapter_len, kmer_size):
+        """Returns the smallest overlap from which every longer match of an
+        adapter of adapter_len bases contains an exact kmer_size-mer
+        """
+        indexed_overlap = adapter_len + 1
+        for overlap in range(adapter_len, self.min_overlap - 1, -1):
+            if self._min_exact_run(overlap) < kmer_size:
+                break
+            indexed_overlap = overlap
+        return indexed_overlap
+
+    def _expected_checks(self, kmer_size):
+        """Estimates the number of positions checked per read of
+        NOMINAL_READ_LENGTH random bases with an index of kmer_size-mers.
+        Shorter k-mers leave fewer overlaps to check directly, but make
+        more chance hits.
+        """
+        checks = 0.0
+        for adapter in self.adapters:
+            checks += self._min_indexed_overlap(len(adapter), kmer_size) - \
+                self.min_overlap
+            num_kmers = max(len(adapter) - kmer_size + 1, 0)
+            checks += float(NOMINAL_READ_LENGTH * num_kmers) / 4 ** kmer_size
+        return checks
+
+    def _build_index(self):
+        k = self.kmer_size
+        # Adapter k-mers, and the adapters and offsets they come from
+        self._index = {}
+        # Per adapter, the smallest overlap from which all matches are found
+        # by the index, or None if the adapter is checked at every position
+        self._indexed_overlap = []
+        for adapter_idx, adapter in enumerate(self.adapters):
+            allowed = self._allowed[adapter_idx]
+            indexed_overlap = self._min_indexed_overlap(len(adapter), k)
+            kmers = []
+            for offset in range(len(adapter) - k + 1):
+                # Only unambiguous read bases are indexed
+                choices = [
+                    sorted(set(allowed[iii]) & set(b"ACGT"))
+                    for iii in range(offset, offset + k)
+                ]
+                num_expansions = 1
+                for choice in choices:
+                    num_expansions *= len(choice)
+                if num_expansions > MAX_KMER_EXPANSIONS:
+                    indexed_overlap = len(adapter) + 1
+                    break
+                for kmer in product(*choices):
+                    kmers.append((bytes(kmer), offset))
+            if indexed_overlap > len(adapter):
+                self._indexed_overlap.append(None)
+                continue
+            self._indexed_overlap.append(indexed_overlap)
+            for kmer, offset in kmers:
+                self._index.setdefault(kmer, []).append((adapter_idx, offset))
+        self._kmers = frozenset(self._index)
+
+    def _kmer_slices(self, length):
+        try:
+            return self._slices[length]
+        except KeyError:
+            slices = [
+                slice(iii, iii + self.kmer_size)
+                for iii in range(length - self.kmer_size + 1)
+            ]
+            self._slices[length] = slices
+            return slices
+
+    def matches_at(self, adapter_idx, seq, pos):
+        """Returns True if adapter adapter_idx matches bytes seq from pos"""
+        allowed = self._allowed[adapter_idx]
+        overlap = min(len(allowed), len(seq) - pos)
+        if overlap < self.min_overlap:
+            return False
+        errors = self._errors[overlap]
+        for iii in range(overlap):
+            if seq[pos + iii] not in allowed[iii]:
+                errors -= 1
+                if errors < 0:
+                    return False
+        return True
+
+    def find(self, seq):
+        """Returns the position and index of the leftmost adapter match in
+        seq, or None if there is none
+        """
+        if isinstance(seq, str):
+            seq = seq.encode("latin-1")
+        seq = seq.upper()
+        length = len(seq)
+        last_pos = length - self.min_overlap
+        candidates = set()
+        # Reads with ambiguous bases may match without a shared k-mer
+        check_all = seq.translate(None, b"ACGT") != b""
+        slices = self._kmer_slices(length)
+        if not check_all and \
+                not self._kmers.isdisjoint(map(seq.__getitem__, slices)):
+            index = self._index
+            for read_pos, kmer in enumerate(map(seq.__getitem__, slices)):
+                for adapter_idx, offset in index.get(kmer, ()):
+                    if read_pos >= offset:
+                        candidates.add((read_pos - offset, adapter_idx))
+        for adapter_idx, indexed_overlap in enumerate(self._indexed_overlap):
+            if check_all or indexed_overlap is None:
+                first_pos = 0
+            else:
+                # Overlaps too short to be found by the index
+                first_pos = max(0, length - indexed_overlap + 1)
+            for pos in range(first_pos, last_pos + 1):
+                candidates.add((pos, adapter_idx))
+        for pos, adapter_idx in sorted(candidates):
+            if self.matches_at(adapter_idx, seq, pos):
+                return pos, adapter_idx
+        return None
+
+
+@lru_cache(maxsize=MATCHER_CACHE_SIZE)
+def _get_matcher(adapters, error_rate, min_overlap, allow_ambiguity):
+    return AdapterMatcher(
+        adapters,
+        error_rate=error_rate,
+        min_overlap=min_overlap,
+        allow_ambiguity=allow_ambiguity
+    )
+
+
+class AdapterTrimmer(pyngsqc.Base):
+    """
+    Usage:
+        AdapterTrimmer(in_file_name, out_file_name, adapters,
+                       error_rate=0.1, min_overlap=3, min_length=0)
+            adapters (list): 3' adapter sequences, which may contain IUPAC
+                codes
+            error_rate (float): mismatches allowed per base of overlap
+            min_overlap (int): shortest partial adapter removed from the 3'
+                end of a read
+            min_length (int): drop reads shorter than this once trimmed
+    """
+
+    def __init__(
+            self,
+            # Inherited args
+            in_file_name,
+            out_file_name,
+            # Local args
+            adapters,
+            # Inherited kwargs
+            verbose=False,
+            compression=pyngsqc.GUESS_COMPRESSION,
+            deduplicate_header=True,
+            print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
+            # Local kwargs
+            error_rate=0.1,
+            min_overlap=3,
+            min_length=0,
+            allow_ambiguity=True
+    ):
+        super(AdapterTrimmer, self).__init__(
+            in_file_name,
+            out_file_name,
+            verbose=verbose,
+            compression=compression,
+            deduplicate_header=deduplicate_header,
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
+        )
+        self.adapters = list(adapters)
+        self.error_rate = error_rate
+        self.min_overlap = min_overlap
+        self.min_length = min_length
+        self.allow_ambiguity = allow_ambiguity
+        # Cached, so that worker processes forked from this one already
+        # have it
+        self.matcher = _get_matcher(
+            tuple(self.adapters),
+            error_rate,
+            min_overlap,
+            allow_ambiguity
+        )
+        self.stats["adapters"] = dict.fromkeys(self.adapters, 0)
+
+    def trim_read(self, read):
+        match = self.matcher.find(read[1])
+        if match is not None:
+            pos, adapter_idx = match
+            self.stats["adapters"][self.adapters[adapter_idx]] += 1
+            read[1] = read[1][:pos]  # Bases
+            read[3] = read[3][:pos]  # Phred Scores
+        if len(read[1]) < self.min_length:
+            return ()
+        return read
+
+    def trim_block(self, block):
+        trimmed = pyngsqc.FastqBlock()
+        for read in block:
+            read = self.trim_read(read)
+            if len(read) == 4:  # If it's a valid read
+                trimmed.append(read)
+        return trimmed
+
+    def _print_summary(self):
+        stderr.write("AdapterTrimmer finished:\n")
+        for adapter in self.adapters:
+            stderr.write(
+                "\t%i reads had %s removed\n" %
+                (self.stats["adapters"][adapter], adapter)
+            )
+        stderr.write(
+            "\tWrote %i reads to %s\n" %
+            (self.stats["writer"]["num_reads"], self.out_file_name)
+        )
+
+    def run(self):
+        for block in self.reader.iter_blocks():
+            self.writer.write_block(self.trim_block(block))
+
+        self.stats["reader"] = self.reader.stats
+        self.stats["writer"] = self.writer.stats
+        if self.print_summary:
+            self._print_summary()
+
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
+        runner = _parallel.ParallelRunner(
+            AdapterTrimmerTask,
+            self.reader,
+            _AdapterTrimmerWriter(self.writer, self.adapters),
+            (  # Task options
+                self.adapters,
+                self.error_rate,
+                self.min_overlap,
+                self.allow_ambiguity,
+                self.min_length
+            ),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
+        )
+        runner.run()
+
+        self.stats["runner"] = runner.stats
+        self.stats["reader"] = self.reader.stats
+        self.stats["writer"] = runner.stats["writer"]
+        for adapter, count in runner.stats["adapters"].items():
+            self.stats["adapters"][adapter] += count
+        if self.print_summary:
+            self._print_summary()
+
+
+class AdapterTrimmerTask(AdapterTrimmer):
+
+    def __init__(
+            self,
+            block,
+            adapters,
+            error_rate,
+            min_overlap,
+            allow_ambiguity,
+            min_length
+    ):
+        self.block = block
+        self.adapters = adapters
+        self.error_rate = error_rate
+        self.min_overlap = min_overlap
+        self.allow_ambiguity = allow_ambiguity
+        self.min_length = min_length
+        self.stats = {"adapters": dict.fromkeys(adapters, 0)}
+
+    def __call__(self):
+        # Built in the worker, as the matcher is too costly to send with
+        # every chunk
+        self.matcher = _get_matcher(
+            tuple(self.adapters),
+            self.error_rate,
+            self.min_overlap,
+            self.allow_ambiguity
+        )
+        return (self.trim_block(self.block), self.stats["adapters"])
+
+
+class _AdapterTrimmerWriter(object):
+    """Writes the blocks of AdapterTrimmerTasks with writer, summing the
+    number of reads each chunk had each adapter removed from
+    """
+
+    def __init__(self, writer, adapters):
+        self.writer = writer
+        self.stats = {
+            "num_reads": 0,
+            "adapters": dict.fromkeys(adapters, 0)
+        }
+
+    def write_block(self, answer):
+        block, adapters = answer
+        self.writer.write_block(block)
+        self.stats["num_reads"] += len(block)
+        for adapter, count in adapters.items():
+            self.stats["adapters"][adapter] += count
+
+    def close(self):
+        self.writer.close()
+        self.stats["writer"] = self.writer.stats
@@ -12,15 +12,156 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import lru_cache
 from sys import stderr
 import pyngsqc
 import csv
 from os import path
-from pyngsqc import seq_match, _parallel
+from pyngsqc import hamming_neighbors, _parallel
 
-FORWARD_ONLY = 0
-REVERSE_ONLY = 1
-FORWARD_OR_REVERSE = 2
+FORWARD_ONLY = pyngsqc.BARCODE_FORWARD_ONLY
+REVERSE_ONLY = pyngsqc.BARCODE_REVERSE_ONLY
+FORWARD_OR_REVERSE = pyngsqc.BARCODE_FORWARD_OR_REVERSE
+FORWARD_AND_REVERSE = pyngsqc.BARCODE_FORWARD_REVERSE
+
+# Names of the outputs for reads which match no barcode, and for those which
+# match more than one equally well
+UNMATCHED = "unmatched"
+AMBIGUOUS = "ambiguous"
+
+# Most indices kept by each process, so that tasks sent to worker processes
+# need not carry their tables, without keeping every index ever built
+INDEX_CACHE_SIZE = 16
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def _get_index(barcodes, mismatches, binary):
+    return BarcodeIndex(barcodes, mismatches=mismatches, binary=binary)
+
+
+class BarcodeIndex(object):
+    """Maps the start, or end, of a read to the barcode it matches, with at
+    most mismatches substitutions.
+
+    Every sequence within mismatches of each barcode is expanded into a
+    table when the index is built, so looking up a read takes one dict
+    lookup per distinct barcode length, however many barcodes there are.
+    A sequence equally close to two barcodes of the same length matches
+    neither; such pairs of barcodes are listed in collisions.
+    """
+
+    def __init__(self, barcodes, mismatches=0, binary=False):
+        self.barcodes = tuple(barcodes)
+        self.mismatches = mismatches
+        self.binary = binary
+        self.collisions = set()
+        # Per barcode length, a table of sequence: (barcode, distance), with
+        # barcode None where the sequence is ambiguous. Longest first.
+        self._tables = []
+        by_length = {}
+        for barcode in self.barcodes:
+            by_length.setdefault(len(barcode), []).append(barcode)
+        for length in sorted(by_length, reverse=True):
+            self._tables.append((length, self._build_table(by_length[length])))
+
+    def _build_table(self, barcodes):
+        # The closest barcodes to each sequence, and their distance
+        closest = {}
+        for barcode in barcodes:
+            for neighbor, distance in hamming_neighbors(
+                    barcode, self.mismatches):
+                entry = closest.get(neighbor)
+                if entry is None or distance < entry[1]:
+                    closest[neighbor] = ([barcode], distance)
+                elif distance == entry[1] and barcode not in entry[0]:
+                    entry[0].append(barcode)
+        table = {}
+        for neighbor, (nearest, distance) in closest.items():
+            if len(nearest) > 1:
+                for iii, barcode in enumerate(nearest):
+                    for other in nearest[iii + 1:]:
+                        self.collisions.add((barcode, other))
+                barcode = None
+            else:
+                barcode = nearest[0]
+            if self.binary:
+                neighbor = neighbor.encode("ascii")
+            table[neighbor] = (barcode, distance)
+        return table
+
+    def __reduce__(self):
+        return (_get_index, (self.barcodes, self.mismatches, self.binary))
+
+    def lookup(self, seq, from_end=False):
+        """Returns (barcode, mismatches) for the closest barcode seq starts
+        with, or ends with if from_end, preferring longer barcodes, or None
+        if there is none. barcode is None if seq is equally close to more
+        than one.
+        """
+        best = None
+        for length, table in self._tables:
+            if from_end:
+                match = table.get(seq[-length:])
+            else:
+                match = table.get(seq[:length])
+            if match is not None and (best is None or match[1] < best[1]):
+                best = match
+        return best
+
+
+class DualBarcodeIndex(object):
+    """Matches pairs of barcodes, given as "FWD+REV", one BarcodeIndex for
+    each half. Any combination of halves may be listed, so that one forward
+    barcode may be paired with many reverse barcodes. Mismatches are
+    allowed in each half, and are summed for the pair.
+    """
+
+    def __init__(self, barcodes, mismatches=0, binary=False):
+        self.barcodes = tuple(barcodes)
+        self.mismatches = mismatches
+        self._pairs = {}
+        for barcode in self.barcodes:
+            halves = tuple(barcode.split("+"))
+            if len(halves) != 2:
+                raise ValueError(
+                    "Dual barcode %r is not of the form FWD+REV" % barcode
+                )
+            self._pairs[halves] = barcode
+        self.forward = _get_index(
+            tuple(sorted(set(fwd for fwd, rev in self._pairs))),
+            mismatches,
+            binary
+        )
+        self.reverse = _get_index(
+            tuple(sorted(set(rev for fwd, rev in self._pairs))),
+            mismatches,
+            binary
+        )
+        self.collisions = self.forward.collisions | self.reverse.collisions
+
+    def combine(self, forward, reverse):
+        """Returns (barcode, mismatches) for the pair listed for forward and
+        reverse, matches of each half as from BarcodeIndex.lookup(), or
+        None if there is none. barcode is None if either half is ambiguous.
+        """
+        if forward is None or reverse is None:
+            return None
+        mismatches = forward[1] + reverse[1]
+        if forward[0] is None or reverse[0] is None:
+            return (None, mismatches)
+        barcode = self._pairs.get((forward[0], reverse[0]))
+        if barcode is None:
+            return None
+        return (barcode, mismatches)
+
+    def lookup(self, seq):
+        """Returns (barcode, mismatches) for the pair with its forward half
+        at the start of seq and its reverse half at the end
+        """
+        return self.combine(
+            self.forward.lookup(seq),
+            self.reverse.lookup(seq, from_end=True)
+        )
 
 
 class BarcodeSplitter(pyngsqc.Base):
@@ -36,10 +177,14 @@ class BarcodeSplitter(pyngsqc.Base):
             deduplicate_header=True,
             verbose=False,
             print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
             # Local kwargs
             barcode_end=FORWARD_ONLY,
             mismatches=0,
-            write_to_header=False
+            write_to_header=False,
+            write_unassigned=False
     ):
         # Initialise base class
         super(BarcodeSplitter, self).__init__(
@@ -48,19 +193,46 @@ class BarcodeSplitter(pyngsqc.Base):
             compression=compression,
             deduplicate_header=deduplicate_header,
             verbose=verbose,
-            print_summary=print_summary
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         self.output_dir = output_dir
+        self.barcode_end = barcode_end
         self.mismatches = mismatches
         self.barcodes = self._set_barcodes_from_file(
             barcode_file,
             pyngsqc.SNIFF_CSV_DIALECT
         )
         self.write_to_header = write_to_header
+        if barcode_end == FORWARD_AND_REVERSE:
+            self.index = DualBarcodeIndex(
+                self.barcodes,
+                mismatches=mismatches,
+                binary=binary
+            )
+        elif barcode_end in (FORWARD_ONLY, REVERSE_ONLY, FORWARD_OR_REVERSE):
+            # Cached, so that worker processes forked from this one already
+            # have it
+            self.index = _get_index(tuple(self.barcodes), mismatches, binary)
+        else:
+            raise ValueError("Invalid barcode_end %r" % (barcode_end,))
+        if self.verbose and self.index.collisions:
+            stderr.write(
+                "Reads within %i mismatches of these barcode pairs are "
+                "ambiguous, and will not be written:\n" % mismatches
+            )
+            for barcode, other in sorted(self.index.collisions):
+                stderr.write("\t%s\t%s\n" % (barcode, other))
         self.writer = _BarcodeWriter(
             self.barcodes,
             self.in_file_name,
-            self.output_dir
+            self.output_dir,
+            binary=self.binary,
+            threads=threads,
+            compression_level=compression_level,
+            write_unassigned=write_unassigned
         )
 
     def _sniff_csv_dialect(self, file_name):
@@ -83,19 +255,57 @@ class BarcodeSplitter(pyngsqc.Base):
         csv_fh.close()
         return barcodes
 
+    def _match(self, seq):
+        """Returns (barcode, mismatches, start, end): the barcode which best
+        matches seq, and the slice of seq left once it is removed. barcode
+        is UNMATCHED if seq matches none, or AMBIGUOUS if it matches more
+        than one equally well.
+        """
+        length = len(seq)
+        if self.barcode_end == FORWARD_AND_REVERSE:
+            match = self.index.lookup(seq)
+            from_end = False
+        else:
+            forward = reverse = None
+            if self.barcode_end != REVERSE_ONLY:
+                forward = self.index.lookup(seq)
+            if self.barcode_end != FORWARD_ONLY:
+                reverse = self.index.lookup(seq, from_end=True)
+            if reverse is None:
+                match, from_end = forward, False
+            elif forward is None or reverse[1] < forward[1]:
+                match, from_end = reverse, True
+            elif reverse[1] == forward[1] and reverse[0] != forward[0]:
+                return (AMBIGUOUS, forward[1], 0, length)
+            else:
+                match, from_end = forward, False
+        if match is None:
+            return (UNMATCHED, None, 0, length)
+        barcode, mismatches = match
+        if barcode is None:
+            return (AMBIGUOUS, mismatches, 0, length)
+        if self.barcode_end == FORWARD_AND_REVERSE:
+            fwd, rev = barcode.split("+")
+            return (barcode, mismatches, len(fwd), length - len(rev))
+        if from_end:
+            return (barcode, mismatches, 0, length - len(barcode))
+        return (barcode, mismatches, len(barcode), length)
+
+    def _split_read(self, read):
+        barcode, mismatches, start, end = self._match(read[1])
+        if barcode != UNMATCHED and barcode != AMBIGUOUS:
+            if self.write_to_header:
+                read[0] += _header_tag(read[0], barcode, self.barcodes)
+            read[1] = read[1][start:end]
+            read[3] = read[3][start:end]
+        return (barcode, mismatches, read)
+
     def _parse_read_barcode(self, read):
-        for barcode in self.barcodes:
-            barcode_len = len(barcode)
-            read_barcode = read[1][0:barcode_len]
-            if seq_match(barcode, read_barcode, mismatches=self.mismatches):
-                if self.write_to_header:
-                    read[0] += " bcd:%s desc:%s" % (
-                        barcode,
-                        self.barcodes[barcode]
-                    )
-                read[1] = read[1][barcode_len:]
-                read[3] = read[3][barcode_len:]
-                self.writer.write((barcode, read))
+        self.writer.write(self._split_read(read))
+
+    def split_block(self, block):
+        """Returns (barcode, mismatches, read) for each read of block"""
+        return [self._split_read(read) for read in block]
 
     def _print_summary(self):
         stderr.write("Barcode Splitter finished:\n")
@@ -106,10 +316,27 @@ class BarcodeSplitter(pyngsqc.Base):
             )
         )
 
+        stderr.write(
+            "\t%i reads matched no barcode, and %i were ambiguous\n" % (
+                self.stats["writer"][UNMATCHED],
+                self.stats["writer"][AMBIGUOUS]
+            )
+        )
+
         if self.verbose:
-            stderr.write("\tThe following barcodes were parsed:\n")
+            stderr.write(
+                "\tThe following barcodes were parsed (reads with 0, 1, "
+                "... mismatches):\n"
+            )
+            mismatch_counts = self.stats["writer"]["mismatch_counts"]
             for bcd, count in self.stats["writer"]["barcode_counts"].items():
-                stderr.write("\t%s:\t%i\n" % (bcd, count))
+                stderr.write(
+                    "\t%s:\t%i\t(%s)\n" % (
+                        bcd,
+                        count,
+                        ", ".join(str(num) for num in mismatch_counts[bcd])
+                    )
+                )
 
     def run(self):
         if len(self.barcodes) < 1:
@@ -117,15 +344,24 @@ class BarcodeSplitter(pyngsqc.Base):
                 "You must supply a barcode dict or file before"
                 " run()-ing BarcodeSplitter"
             )
-        for read in self.reader:
-            self._parse_read_barcode(read)
+        for block in self.reader.iter_blocks():
+            for read in block:
+                self._parse_read_barcode(read)
+        # Writes out the reads still buffered by the writer pool
+        self.writer.close()
 
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.writer.stats
         if self.print_summary:
             self._print_summary()
 
-    def run_parallel(self):
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
         if len(self.barcodes) < 1:
             raise ValueError(
                 "You must supply a barcode dict or file before"
@@ -137,187 +373,391 @@ class BarcodeSplitter(pyngsqc.Base):
             self.writer,
             (  # Task options
                 self.barcodes,
-                self.mismatches,
+                self.index,
+                self.barcode_end,
                 self.write_to_header,
-            )
+            ),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
         )
         runner.run()
 
         self.stats["runner"] = runner.stats
         self.stats["reader"] = self.reader.stats
-        self.stats["writer"] = self.writer.stats
+        # The reads were written, and counted, in the writer process
+        self.stats["writer"] = runner.stats
         if self.print_summary:
             self._print_summary()
 
 
-class BarcodeSplitTask(object):
+class BarcodeSplitTask(BarcodeSplitter):
 
-    def __init__(self, read, barcodes, mismatches, write_to_header):
-        self.read = read
+    def __init__(self, block, barcodes, index, barcode_end, write_to_header):
+        self.block = block
         self.barcodes = barcodes
-        self.mismatches = mismatches
+        self.index = index
+        self.barcode_end = barcode_end
         self.write_to_header = write_to_header
 
     def __call__(self):
-        for barcode in self.barcodes:
-            barcode_len = len(barcode)
-            read_barcode = self.read[1][0:barcode_len]
-            if seq_match(barcode, read_barcode, mismatches=self.mismatches):
-                if self.write_to_header:
-                    self.read[0] += " bcd:%s desc:%s" % (
-                        barcode,
-                        str(self.barcodes[barcode])
-                    )
-                self.read[1] = self.read[1][barcode_len:]
-                self.read[3] = self.read[3][barcode_len:]
-                return (barcode, self.read)
-        return (None, self.read)
+        return self.split_block(self.block)
+
+
+def _header_tag(header, barcode, barcodes):
+    """Returns the barcode tag to append to a read's header, of the same type
+    as the header
+    """
+    tag = " bcd:%s desc:%s" % (barcode, str(barcodes[barcode]))
+    if isinstance(header, str):
+        return tag
+    return tag.encode("ascii")
 
 
 class _BarcodeWriter(pyngsqc.Base):
     """Provides a pyngsqc.FastqWriter compatible interface to write to many
-    files at once.
+    files at once, through a pyngsqc.FastqWriterPool.
     """
-    def __init__(self, barcodes, in_file_name, output_dir=None):
+    def __init__(
+            self,
+            barcodes,
+            in_file_name,
+            output_dir=None,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
+            write_unassigned=False
+    ):
         self.in_file_name = in_file_name
         self.output_dir = output_dir
+        self.binary = binary
+        self.compression_level = compression_level
         self.barcodes = barcodes
+        self.write_unassigned = write_unassigned
+        self.pool = pyngsqc.FastqWriterPool(
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
+        )
         self.stats = {}
         self.stats["barcode_counts"] = {}
+        # Per barcode, the number of reads with 0, 1, 2... mismatches
+        self.stats["mismatch_counts"] = {}
+        self.stats[UNMATCHED] = 0
+        self.stats[AMBIGUOUS] = 0
         self.barcode_files = {}
         self.stats["num_reads"] = 0
 
-    def _get_barcode_writer(self, barcode):
-        if self.barcodes[barcode] == "" or self.barcodes[barcode] is None:
+    def _get_barcode_path(self, barcode, in_file_name=None):
+        if in_file_name is None:
+            in_file_name = self.in_file_name
+        description = self.barcodes.get(barcode)
+        if description == "" or description is None:
             identifier = barcode
         else:
             # Not sure if this is a good idea, is possibility of the
             # barcode's decsription being non-unique
-            identifier = self.barcodes[barcode]
+            identifier = description
         if self.output_dir is None:
-            dir_path = path.dirname(self.in_file_name)
+            dir_path = path.dirname(in_file_name)
         else:
             dir_path = self.output_dir
-        split_path = path.basename(self.in_file_name).split(".")
+        split_path = path.basename(in_file_name).split(".")
         out_path = path.join(dir_path, split_path[0] + "_%s" % identifier)
         if len(split_path) > 1:
             # If the path had extensions, add them
             out_path += "." + ".".join(split_path[1:])
-        writer = pyngsqc.FastqWriter(out_path)
-        return writer
-
-    def write(self, pair):
-        barcode, read = pair
-        if barcode is not None:
-            if barcode not in self.barcode_files:
-                self.barcode_files[barcode] = \
-                    self._get_barcode_writer(barcode)
+        return out_path
+
+    def _write_read(self, barcode, read):
+        try:
+            out_path = self.barcode_files[barcode]
+        except KeyError:
+            out_path = self.barcode_files[barcode] = \
+                self._get_barcode_path(barcode)
+        self.pool.write(out_path, read)
+
+    def write(self, result):
+        barcode, mismatches, read = result
+        if barcode == UNMATCHED or barcode == AMBIGUOUS:
+            self.stats[barcode] += 1
+            if not self.write_unassigned:
+                return
+        else:
             self.stats["num_reads"] += 1
-            self.barcode_files[barcode].write(read)
             try:
                 self.stats["barcode_counts"][barcode] += 1
             except KeyError:
                 self.stats["barcode_counts"][barcode] = 1
+            counts = self.stats["mismatch_counts"].setdefault(barcode, [])
+            while len(counts) <= mismatches:
+                counts.append(0)
+            counts[mismatches] += 1
+        self._write_read(barcode, read)
+
+    def write_block(self, results):
+        for result in results:
+            self.write(result)
 
     def close(self):
-        for barcode in self.barcode_files:
-            self.barcode_files[barcode].close()
+        self.pool.close()
+
+
+class _PairedBarcodeWriter(_BarcodeWriter):
+    """A _BarcodeWriter for pairs of reads, each of which is written beside
+    the file it was read from
+    """
+    def __init__(
+            self,
+            barcodes,
+            in_file_names,
+            output_dir=None,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
+            write_unassigned=False
+    ):
+        super(_PairedBarcodeWriter, self).__init__(
+            barcodes,
+            in_file_names[0],
+            output_dir=output_dir,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level,
+            write_unassigned=write_unassigned
+        )
+        self.in_file_names = in_file_names
+
+    def _write_read(self, barcode, reads):
+        try:
+            out_paths = self.barcode_files[barcode]
+        except KeyError:
+            out_paths = self.barcode_files[barcode] = [
+                self._get_barcode_path(barcode, in_file_name)
+                for in_file_name in self.in_file_names
+            ]
+        for out_path, read in zip(out_paths, reads):
+            self.pool.write(out_path, read)
+
+
+def _check_names(blocks):
+    """Raises a ValueError unless the reads of each record of blocks, one
+    FastqBlock per file, have the same names
+    """
+    names = [list(map(pyngsqc.mate_name, block.headers)) for block in blocks]
+    for other_names in names[1:]:
+        if other_names != names[0]:
+            for name, other_name in zip(names[0], other_names):
+                if name != other_name:
+                    raise ValueError(
+                        "Paired reads are out of sync: %r and %r" %
+                        (name, other_name)
+                    )
 
 
 class PairedBarcodeSplitter(BarcodeSplitter):
+    """
+    Usage:
+        PairedBarcodeSplitter(pair_1_file_name, pair_2_file_name,
+                              output_dir, barcode_file,
+                              index_1_file_name=None, index_2_file_name=None,
+                              check_names=True)
+            Splits pairs of reads by barcode, writing each read of a pair
+            beside the file it came from.
+
+            Without index reads, barcodes are found in read 1, as by
+            BarcodeSplitter with barcode_end, and removed from it. Given
+            index_1_file_name, barcodes are matched to the start of the
+            first index read; given index_2_file_name too, they must be
+            dual barcodes, "I1+I2", one half at the start of each index
+            read. Index reads are not written.
+
+            check_names (bool): raise a ValueError if the reads of a pair
+                have different names
+    """
+
     def __init__(
             self,
+            # Inherited args
             pair_1_file_name,
             pair_2_file_name,
-            output_dir=None,
+            output_dir,
+            barcode_file,
+            # Local args
+            index_1_file_name=None,
+            index_2_file_name=None,
+            # Inherited kwargs
             compression=pyngsqc.GUESS_COMPRESSION,
-            verbose=False
+            deduplicate_header=True,
+            verbose=False,
+            print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
+            barcode_end=FORWARD_ONLY,
+            mismatches=0,
+            write_to_header=False,
+            write_unassigned=False,
+            # Local kwargs
+            check_names=True
     ):
+        if index_2_file_name is not None:
+            if index_1_file_name is None:
+                raise ValueError("index_2_file_name needs index_1_file_name")
+            barcode_end = FORWARD_AND_REVERSE
+        elif index_1_file_name is not None:
+            barcode_end = FORWARD_ONLY
+        super(PairedBarcodeSplitter, self).__init__(
+            pair_1_file_name,
+            output_dir,
+            barcode_file,
+            compression=compression,
+            deduplicate_header=deduplicate_header,
+            verbose=verbose,
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level,
+            barcode_end=barcode_end,
+            mismatches=mismatches,
+            write_to_header=write_to_header,
+            write_unassigned=write_unassigned
+        )
         self.pair_1_file_name = pair_1_file_name
         self.pair_2_file_name = pair_2_file_name
-        self.output_dir = output_dir
-        self.pair_1_reader = pyngsqc.FastqReader(
-            self.pair_1_file_name,
-            compression=compression
+        self.index_file_names = [
+            file_name for file_name in (index_1_file_name, index_2_file_name)
+            if file_name is not None
+        ]
+        self.check_names = check_names
+        # Replace the single end reader and writer of the base class
+        self.reader.close()
+        self.reader = pyngsqc.PairedFastqReader(
+            [pair_1_file_name, pair_2_file_name] + self.index_file_names,
+            deduplicate_header=deduplicate_header,
+            compression=compression,
+            binary=binary,
+            threads=threads
         )
-        self.pair_2_reader = pyngsqc.FastqReader(
-            self.pair_2_file_name,
-            compression=compression
+        self.writer = _PairedBarcodeWriter(
+            self.barcodes,
+            [pair_1_file_name, pair_2_file_name],
+            self.output_dir,
+            binary=self.binary,
+            threads=threads,
+            compression_level=compression_level,
+            write_unassigned=write_unassigned
         )
-        self.verbose = verbose
-        self.barcodes = {}
-        self.barcode_counts = {}
-        # Note that files will be stored as a tuple of writers (pair_1, pair_2)
-        self.barcode_files = {}
-        self.num_reads = 0
 
-    def _get_barcode_writers(self, barcode):
-        if self.barcodes[barcode] == "" or self.barcodes[barcode] is None:
-            identifier = barcode
-        else:
-            # Not sure if this is a good idea, is possibility of the
-            # barcode's decsription being non-unique
-            identifier = self.barcodes[barcode]
-        if self.output_dir is None:
-            dir_path = path.dirname(self.pair_1_file_name)
+    def _match_index(self, index_seqs):
+        """Returns (barcode, mismatches) for the index reads of a pair"""
+        if len(index_seqs) == 2:
+            match = self.index.combine(
+                self.index.forward.lookup(index_seqs[0]),
+                self.index.reverse.lookup(index_seqs[1])
+            )
         else:
-            dir_path = self.output_dir
-
-        # Read 1
-        read_1_split_path = path.basename(self.pair_1_file_name).split(".")
-        out_path = path.join(
-            dir_path,
-            read_1_split_path[0] + "_%s" % identifier
-        )
-        if len(read_1_split_path) > 1:
-            # If the path had extensions, add them
-            out_path += "." + ".".join(read_1_split_path[1:])
-        read_1_writer = pyngsqc.FastqWriter(out_path)
-
-        # Read 2
-        read_2_split_path = path.basename(self.pair_1_file_name).split(".")
-        out_path = path.join(
-            dir_path,
-            read_2_split_path[0] + "_%s" % identifier
-        )
-
-        # If the path had extensions, add them
-        if len(read_2_split_path) > 1:
-            out_path += "." + ".".join(read_2_split_path[1:])
-        read_2_writer = pyngsqc.FastqWriter(out_path)
-
-        return (read_1_writer, read_2_writer)
-
-    def _parse_paired_reads_barcode(self, paired_reads):
-        (read_1, read_2) = paired_reads
-        for barcode in self.barcodes:
-            barcode_len = len(barcode)
-            if read_1[1][0:barcode_len] == barcode:
-                if barcode not in self.barcode_files:
-                    writers = self._get_barcode_writers(barcode)
-                    self.barcode_files[barcode] = writers
-                if barcode not in self.barcode_counts:
-                    self.barcode_counts[barcode] = 0
-                read_1[0] += " bcd:%s desc:%s" % \
-                    (barcode, self.barcodes[barcode])
-                read_1[1] = read_1[1][barcode_len:]
-                read_1[3] = read_1[3][barcode_len:]
-                (read_1_writer, read_2_writer) = self.barcode_files[barcode]
-                read_1_writer.write(read_1)
-                read_2_writer.write(read_2)
-                self.barcode_counts[barcode] += 1
+            match = self.index.lookup(index_seqs[0])
+        if match is None:
+            return (UNMATCHED, None)
+        if match[0] is None:
+            return (AMBIGUOUS, match[1])
+        return match
+
+    def _split_block(self, blocks):
+        """Returns (barcode, mismatches, (read_1, read_2)) for each pair of
+        reads of blocks, one FastqBlock per file
+        """
+        if self.check_names:
+            _check_names(blocks)
+        results = []
+        if len(blocks) == 2:
+            for read_1, read_2 in zip(blocks[0], blocks[1]):
+                barcode, mismatches, read_1 = self._split_read(read_1)
+                results.append((barcode, mismatches, (read_1, read_2)))
+            return results
+        for read_1, read_2, index_seqs in zip(
+                blocks[0], blocks[1], zip(*[b.seqs for b in blocks[2:]])):
+            barcode, mismatches = self._match_index(index_seqs)
+            if self.write_to_header and \
+                    barcode != UNMATCHED and barcode != AMBIGUOUS:
+                read_1[0] += _header_tag(read_1[0], barcode, self.barcodes)
+            results.append((barcode, mismatches, (read_1, read_2)))
+        return results
 
     def run(self):
         if len(self.barcodes) < 1:
             raise ValueError(
                 "You must supply a barcode dict or file before"
-                " run()-ing BarcodeSplitter"
+                " run()-ing PairedBarcodeSplitter"
             )
-        for paired_reads in zip(self.pair_1_reader, self.pair_2_reader):
-            self.num_reads += 1
-            self._parse_paired_reads_barcode(paired_reads)
+        for blocks in self.reader.iter_blocks():
+            self.writer.write_block(self._split_block(blocks))
+        self.writer.close()
 
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.writer.stats
         if self.print_summary:
             self._print_summary()
+
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
+        if len(self.barcodes) < 1:
+            raise ValueError(
+                "You must supply a barcode dict or file before"
+                " run()-ing PairedBarcodeSplitter"
+            )
+        # Each task is given the blocks of all files for the same reads, so
+        # the reads of a pair are always split together
+        runner = _parallel.ParallelRunner(
+            PairedBarcodeSplitTask,
+            self.reader,
+            self.writer,
+            (  # Task options
+                self.barcodes,
+                self.index,
+                self.barcode_end,
+                self.write_to_header,
+                self.check_names
+            ),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
+        )
+        runner.run()
+
+        self.stats["runner"] = runner.stats
+        self.stats["reader"] = self.reader.stats
+        # The reads were written, and counted, in the writer process
+        self.stats["writer"] = runner.stats
+        if self.print_summary:
+            self._print_summary()
+
+
+class PairedBarcodeSplitTask(PairedBarcodeSplitter):
+
+    def __init__(
+            self,
+            blocks,
+            barcodes,
+            index,
+            barcode_end,
+            write_to_header,
+            check_names
+    ):
+        self.blocks = blocks
+        self.barcodes = barcodes
+        self.index = index
+        self.barcode_end = barcode_end
+        self.write_to_header = write_to_header
+        self.check_names = check_names
+
+    def __call__(self):
+        return self._split_block(self.blocks)
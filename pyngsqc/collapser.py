@@ -33,6 +33,9 @@ class Collapser(pyngsqc.Base):
             deduplicate_header=True,
             verbose=False,
             print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
             # Local kwargs
             key_length=5,
             tmp_dir=None
@@ -44,7 +47,10 @@ class Collapser(pyngsqc.Base):
             compression=compression,
             deduplicate_header=deduplicate_header,
             verbose=verbose,
-            print_summary=print_summary
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         # Initialise local variables
         self.tmp_dir = tmp_dir
@@ -58,24 +64,39 @@ class Collapser(pyngsqc.Base):
         Splits input file into subfiles based on their "key", or first
          key_length bases, to allow for a memory efficient sort
         """
-        for read in self.reader:
-            key = read[1][:self.key_length]
-            if key in self.tmp_file_names:
-                fh = open(self.tmp_file_names[key], "a")
-            else:
-                self.keys.append(key)
-                # If in keys, file handle should exist
-                fh = namedtmp(
-                    mode="w",
-                    dir=self.tmp_dir,
-                    prefix=key + "_",
-                    delete=False
-                )
-                file_name = fh.name
-                self.tmp_file_names[key] = file_name
-            read_str = "\n".join(read) + "\n"
-            fh.write(read_str)
-            fh.close()
+        for block in self.reader.iter_blocks():
+            # Group this block's reads by key, so each subfile is opened once
+            # per block rather than once per read
+            key_blocks = {}
+            for read in block:
+                key = read[1][:self.key_length]
+                try:
+                    key_blocks[key].append(read)
+                except KeyError:
+                    key_blocks[key] = pyngsqc.FastqBlock()
+                    key_blocks[key].append(read)
+            mode = "b" if self.binary else ""
+            newline = self.writer._newline
+            for key, key_block in key_blocks.items():
+                if key in self.tmp_file_names:
+                    fh = open(self.tmp_file_names[key], "a" + mode)
+                else:
+                    self.keys.append(key)
+                    if self.binary:
+                        prefix = key.decode("ascii") + "_"
+                    else:
+                        prefix = key + "_"
+                    # If in keys, file handle should exist
+                    fh = namedtmp(
+                        mode="w" + mode,
+                        dir=self.tmp_dir,
+                        prefix=prefix,
+                        delete=False
+                    )
+                    file_name = fh.name
+                    self.tmp_file_names[key] = file_name
+                fh.write(newline.join(key_block.lines()) + newline)
+                fh.close()
 
         # get file size
         for key in self.tmp_file_names:
@@ -100,12 +121,12 @@ class Collapser(pyngsqc.Base):
         for key in sorted(self.keys):
             these_reads = []
             file_name = self.tmp_file_names[key]
-            reader = pyngsqc.FastqReader(file_name)
+            reader = pyngsqc.FastqReader(file_name, binary=self.binary)
             for read in reader:
                 these_reads.append(self._read_to_tuple(read))
             these_reads.sort()
             reader.close()
-            last_read_seq = ""
+            last_read_seq = None
             for read_tuple in these_reads:
                 if read_tuple[0] != last_read_seq:
                     last_read_seq = read_tuple[0]
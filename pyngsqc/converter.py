@@ -24,32 +24,48 @@ class FastqToFasta(pyngsqc.Base):
         out_file_name,
         remove_header=False,
         deduplicate_header=True,
-        compression=pyngsqc.GUESS_COMPRESSION
+        compression=pyngsqc.GUESS_COMPRESSION,
+        binary=False,
+        threads=1,
+        compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL
     ):
         super(FastqToFasta, self).__init__(
             in_file_name,
             out_file_name,
             compression=compression,
-            deduplicate_header=deduplicate_header
+            deduplicate_header=deduplicate_header,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         self.writer = pyngsqc.FastaWriter(
             self.out_file_name,
-            compression
+            compression,
+            binary,
+            threads,
+            compression_level
         )
         self.remove_header = remove_header
 
     def run(self):
-        for read in self.reader:
-            fasta_read = []
+        num_reads = 0
+        for block in self.reader.iter_blocks():
             if self.remove_header:
-                header = ">%i" % self.stats["reader"]["num_reads"]
+                headers = [
+                    ">%i" % iii
+                    for iii in range(num_reads + 1, num_reads + len(block) + 1)
+                ]
+                if self.binary:
+                    headers = [header.encode("ascii") for header in headers]
             else:
-                header = ">%s" % read[0][1:]  # Keep fastq header
-
-            fasta_read.append(header)
-            fasta_read.append(read[1])  # Seq
-
-            self.writer.write(fasta_read)
+                # Keep fastq header
+                gt = self.writer._gt
+                headers = [gt + header[1:] for header in block.headers]
+            num_reads += len(block)
+            fasta_reads = [None] * (2 * len(block))
+            fasta_reads[0::2] = headers
+            fasta_reads[1::2] = block.seqs  # Seq
+            self.writer.write(fasta_reads)
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.writer.stats
 
@@ -63,26 +79,37 @@ class ConvertQualOffset(pyngsqc.Base):
         in_qual_offset=33,
         out_qual_offset=64,
         deduplicate_header=True,
-        compression=pyngsqc.GUESS_COMPRESSION
+        compression=pyngsqc.GUESS_COMPRESSION,
+        binary=False,
+        threads=1,
+        compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL
     ):
         super(ConvertQualOffset, self).__init__(
             in_file_name,
             out_file_name,
             compression=compression,
-            deduplicate_header=deduplicate_header
+            deduplicate_header=deduplicate_header,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         self.in_qual_offset = in_qual_offset
         self.out_qual_offset = out_qual_offset
 
-    def run(self):
-        for read in self.reader:
-            in_phred_str = read[3]
-            read[3] = pyngsqc.convert_phred_offset(
+    def convert_block(self, block):
+        block.quals = [
+            pyngsqc.convert_phred_offset(
                 in_phred_str,
                 self.in_qual_offset,
                 self.out_qual_offset
             )
-            self.writer.write(read)
+            for in_phred_str in block.quals
+        ]
+        return block
+
+    def run(self):
+        for block in self.reader.iter_blocks():
+            self.writer.write_block(self.convert_block(block))
 
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.writer.stats
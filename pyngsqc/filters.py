@@ -0,0 +1,332 @@
+# Copyright 2012 Kevin Murray
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from collections import Counter
+from math import log
+import pyngsqc
+
+# Number of quality characters counted before checking whether a read can
+# still pass
+QUAL_SEGMENT_SIZE = 64
+
+
+class ReadFilter(object):
+    """A predicate on reads. passes() is given the sequence and quality of
+    a read, always as bytes, and returns True if the read should be kept.
+
+    cost is a rough relative cost of calling passes(), by which a
+    FilterChain orders its filters before it has seen any reads.
+    """
+    cost = 1
+
+    def __init__(self):
+        self.num_checked = 0
+        self.num_rejected = 0
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def passes(self, seq, qual):
+        raise NotImplementedError
+
+
+class PassRateFilter(ReadFilter):
+    """Keeps reads where more than pass_rate of the bases have a quality of
+    at least qual_threshold
+    """
+    cost = 2
+
+    def __init__(self, qual_threshold, pass_rate, qual_offset):
+        super(PassRateFilter, self).__init__()
+        self.qual_threshold = qual_threshold
+        self.pass_rate = float(pass_rate)
+        self.qual_offset = qual_offset
+        # Quality characters below qual_threshold translate to "L", those
+        # below qual_offset, which are invalid, to "!", and the rest are
+        # deleted
+        low_end = qual_offset + qual_threshold
+        self._low_table = bytes(
+            ord("!") if char < qual_offset else ord("L")
+            for char in range(256)
+        )
+        self._high_chars = bytes(range(max(low_end, qual_offset), 256))
+
+    @property
+    def name(self):
+        return "pass_rate"
+
+    def passes(self, seq, qual):
+        read_len = len(qual)
+        low_scores = 0
+        # Count segment by segment, as a read may fail long before its end
+        for start in range(0, read_len, QUAL_SEGMENT_SIZE):
+            if read_len <= QUAL_SEGMENT_SIZE:
+                segment = qual
+            else:
+                segment = qual[start:start + QUAL_SEGMENT_SIZE]
+            low = segment.translate(self._low_table, self._high_chars)
+            if b"!" in low:
+                for phred in segment:
+                    # Raises the error for the invalid character
+                    pyngsqc.get_qual_from_phred(phred, self.qual_offset)
+            low_scores += len(low)
+            if 1.0 - float(low_scores) / float(read_len) <= self.pass_rate:
+                return False
+        this_pass_rate = 1.0 - float(low_scores) / float(read_len)
+        return this_pass_rate > self.pass_rate
+
+
+class MaxNsFilter(ReadFilter):
+    """Keeps reads with at most max_Ns Ns"""
+    cost = 1
+
+    def __init__(self, max_Ns):
+        super(MaxNsFilter, self).__init__()
+        self.max_Ns = max_Ns
+
+    @property
+    def name(self):
+        return "max_Ns"
+
+    def passes(self, seq, qual):
+        return seq.count(b"N") + seq.count(b"n") <= self.max_Ns
+
+
+class LengthFilter(ReadFilter):
+    """Keeps reads of at least min_length, and at most max_length, bases"""
+    cost = 0
+
+    def __init__(self, min_length=0, max_length=None):
+        super(LengthFilter, self).__init__()
+        self.min_length = min_length
+        self.max_length = max_length
+
+    @property
+    def name(self):
+        return "length"
+
+    def passes(self, seq, qual):
+        if len(seq) < self.min_length:
+            return False
+        return self.max_length is None or len(seq) <= self.max_length
+
+
+class MeanQualityFilter(ReadFilter):
+    """Keeps reads with a mean quality score of at least min_mean"""
+    cost = 1
+
+    def __init__(self, min_mean, qual_offset):
+        super(MeanQualityFilter, self).__init__()
+        self.min_mean = min_mean
+        self.qual_offset = qual_offset
+
+    @property
+    def name(self):
+        return "mean_quality"
+
+    def passes(self, seq, qual):
+        if not qual:
+            return False
+        return float(sum(qual)) / len(qual) - self.qual_offset >= \
+            self.min_mean
+
+
+class ExpectedErrorsFilter(ReadFilter):
+    """Keeps reads with at most max_errors expected errors, the sum of the
+    error probability of each base
+    """
+    cost = 4
+
+    def __init__(self, max_errors, qual_offset):
+        super(ExpectedErrorsFilter, self).__init__()
+        self.max_errors = max_errors
+        self.qual_offset = qual_offset
+        # Error probability of each quality character
+        self._error_probs = [
+            10 ** (-max(char - qual_offset, 0) / 10.0) for char in range(256)
+        ]
+
+    @property
+    def name(self):
+        return "expected_errors"
+
+    def passes(self, seq, qual):
+        return sum(map(self._error_probs.__getitem__, qual)) <= \
+            self.max_errors
+
+
+class GCFilter(ReadFilter):
+    """Keeps reads whose G+C fraction is between min_gc and max_gc"""
+    cost = 1
+
+    def __init__(self, min_gc=0.0, max_gc=1.0):
+        super(GCFilter, self).__init__()
+        self.min_gc = min_gc
+        self.max_gc = max_gc
+
+    @property
+    def name(self):
+        return "gc"
+
+    def passes(self, seq, qual):
+        if not seq:
+            return False
+        upper = seq.upper()
+        gc = float(upper.count(b"G") + upper.count(b"C")) / len(seq)
+        return self.min_gc <= gc <= self.max_gc
+
+
+class HomopolymerFilter(ReadFilter):
+    """Keeps reads with no run of more than max_run of any one of bases,
+    e.g. bases="A" to remove reads with poly-A runs
+    """
+    cost = 1
+
+    def __init__(self, max_run, bases="ACGTN"):
+        super(HomopolymerFilter, self).__init__()
+        self.max_run = max_run
+        self.bases = bases
+        self._run_re = re.compile(
+            "|".join(
+                "%s{%i}" % (base, max_run + 1) for base in bases
+            ).encode("ascii"),
+            re.IGNORECASE
+        )
+
+    @property
+    def name(self):
+        return "homopolymer"
+
+    def passes(self, seq, qual):
+        return self._run_re.search(seq) is None
+
+
+class EntropyFilter(ReadFilter):
+    """Keeps reads whose base composition has a Shannon entropy of at least
+    min_entropy bits; 2 is the most possible, for equal counts of A, C, G
+    and T
+    """
+    cost = 2
+
+    def __init__(self, min_entropy):
+        super(EntropyFilter, self).__init__()
+        self.min_entropy = min_entropy
+
+    @property
+    def name(self):
+        return "entropy"
+
+    def passes(self, seq, qual):
+        if not seq:
+            return False
+        upper = seq.upper()
+        entropy = 0.0
+        for base in (b"A", b"C", b"G", b"T"):
+            fraction = float(upper.count(base)) / len(seq)
+            if fraction > 0:
+                entropy -= fraction * log(fraction, 2)
+        return entropy >= self.min_entropy
+
+
+class DustFilter(ReadFilter):
+    """Keeps reads with a DUST low complexity score of at most max_score.
+    The score is taken over the whole read: the sum over each triplet of
+    c * (c - 1) / 2, where c is its count, divided by one less than the
+    number of triplets. Repeats of short motifs score highly; random
+    sequence scores near 0.
+    """
+    cost = 8
+
+    def __init__(self, max_score=20):
+        super(DustFilter, self).__init__()
+        self.max_score = max_score
+
+    @property
+    def name(self):
+        return "dust"
+
+    def passes(self, seq, qual):
+        num_triplets = len(seq) - 2
+        if num_triplets < 2:
+            return True
+        upper = seq.upper()
+        counts = Counter(
+            upper[iii:iii + 3] for iii in range(num_triplets)
+        )
+        score = sum(count * (count - 1) for count in counts.values()) / 2.0
+        return score / (num_triplets - 1) <= self.max_score
+
+
+class FilterChain(object):
+    """Checks reads against each of filters in turn, stopping at the first
+    which rejects the read.
+
+    Filters start in order of cost. If adaptive is True, every
+    reorder_interval reads they are put in order of the fraction of reads
+    each rejects per unit cost, so those most likely to reject a read
+    cheaply come first. Which reads are kept does not depend on the order,
+    but a read which several filters would reject is counted against only
+    the first of them. If first_reorder is given, the first reordering is
+    made after that many reads instead.
+    """
+
+    def __init__(
+            self,
+            filters,
+            adaptive=True,
+            reorder_interval=10000,
+            first_reorder=None
+    ):
+        self.filters = sorted(filters, key=lambda filt: filt.cost)
+        self.adaptive = adaptive
+        self.reorder_interval = reorder_interval
+        if first_reorder is None:
+            first_reorder = reorder_interval
+        self._next_reorder = first_reorder
+        self.num_reads = 0
+
+    def _reorder(self):
+        def rejection_rate(filt):
+            if filt.num_checked == 0:
+                return 0.0
+            rate = float(filt.num_rejected) / filt.num_checked
+            return rate / (filt.cost + 1)
+        self.filters.sort(key=rejection_rate, reverse=True)
+        self._next_reorder = self.num_reads + self.reorder_interval
+
+    def passes(self, read):
+        seq = read[1]
+        qual = read[3]
+        if isinstance(seq, str):
+            seq = seq.encode("latin-1")
+            qual = qual.encode("latin-1")
+        self.num_reads += 1
+        if self.adaptive and self.num_reads >= self._next_reorder:
+            self._reorder()
+        for filt in self.filters:
+            filt.num_checked += 1
+            if not filt.passes(seq, qual):
+                filt.num_rejected += 1
+                return False
+        return True
+
+    def rejections(self):
+        """Returns a dict of the number of reads rejected by each filter"""
+        rejections = {}
+        for filt in self.filters:
+            rejections[filt.name] = \
+                rejections.get(filt.name, 0) + filt.num_rejected
+        return rejections
@@ -27,14 +27,20 @@ class HardTrimmer(pyngsqc.Base):
             length=15,
             verbose=False,
             compression=pyngsqc.GUESS_COMPRESSION,
-            print_summary=False
+            print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL
     ):
         super(HardTrimmer, self).__init__(
             in_file_name,
             out_file_name,
             verbose=verbose,
             compression=compression,
-            print_summary=print_summary
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         self.length = length
 
@@ -43,6 +49,12 @@ class HardTrimmer(pyngsqc.Base):
         read[3] = read[3][:self.length]  # Phred Score
         return read
 
+    def trim_block(self, block):
+        length = self.length
+        block.seqs = [seq[:length] for seq in block.seqs]
+        block.quals = [qual[:length] for qual in block.quals]
+        return block
+
     def _print_summary(self):
         stderr.write("HardTrimmer finished:\n")
         stderr.write(
@@ -54,22 +66,30 @@ class HardTrimmer(pyngsqc.Base):
         )
 
     def run(self):
-        for read in self.reader:
-            read = self.trim_read(read)
-            if len(read) == 4:
-                self.writer.write(read)
+        for block in self.reader.iter_blocks():
+            self.writer.write_block(self.trim_block(block))
 
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.writer.stats
         if self.print_summary:
             self._print_summary()
 
-    def run_parallel(self):
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
         runner = _parallel.ParallelRunner(
             HardTrimmerTask,
             self.reader,
             self.writer,
-            (self.length,)
+            (self.length,),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
         )
         runner.run()
 
@@ -79,12 +99,24 @@ class HardTrimmer(pyngsqc.Base):
         if self.print_summary:
             self._print_summary()
 
+    def run_sharded(self, num_shards=None):
+        """Trims num_shards byte ranges of an uncompressed or BGZF input file
+        at once, in separate processes
+        """
+        runner = _parallel.ShardRunner(self, num_shards)
+        runner.run()
+
+        self.stats["reader"] = runner.stats["reader"]
+        self.stats["writer"] = runner.stats["writer"]
+        if self.print_summary:
+            self._print_summary()
+
 
 class HardTrimmerTask(HardTrimmer):
 
-    def __init__(self, read, length):
-        self.read = read
+    def __init__(self, block, length):
+        self.block = block
         self.length = length
 
     def __call__(self):
-        return self.trim_read(self.read)
+        return self.trim_block(self.block)
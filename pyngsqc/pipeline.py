@@ -0,0 +1,302 @@
+# Copyright 2012 Kevin Murray
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+from sys import stderr
+from time import time
+import pyngsqc
+from pyngsqc import _parallel
+from pyngsqc import barcodesplitter
+
+# Methods by which a tool given as a stage processes a FastqBlock
+STAGE_METHODS = ("trim_block", "filter_block", "convert_block")
+
+
+def _stage_function(stage):
+    """Returns the function which runs stage over a FastqBlock"""
+    for method in STAGE_METHODS:
+        if hasattr(stage, method):
+            return getattr(stage, method)
+    if callable(stage):
+        return stage
+    raise ValueError("%r can not be used as a pipeline stage" % (stage,))
+
+
+def _stage_name(stage):
+    if hasattr(stage, "__name__"):
+        return stage.__name__
+    return stage.__class__.__name__
+
+
+def _copy_block(block):
+    return pyngsqc.FastqBlock(
+        list(block.headers),
+        list(block.seqs),
+        list(block.qual_headers),
+        list(block.quals)
+    )
+
+
+class Pipeline(pyngsqc.Base):
+    """
+    Usage:
+        pipeline = Pipeline(in_file_name)
+        pipeline.add_stage(HardTrimmer(None, None, length=100))
+        pipeline.add_stage(QualFilter(None, None, qual_threshold=20))
+        pipeline.add_writer(pyngsqc.FastqWriter("clean.fastq.gz"))
+        pipeline.add_writer(pyngsqc.FastaWriter("clean.fasta"))
+        pipeline.run()
+
+    Runs reads through a chain of stages in a single pass over
+    in_file_name, writing the result with any number of writers.
+
+    A stage is a tool constructed with no input or output file, whose
+    trim_block(), filter_block() or convert_block() is used, or any
+    function which takes and returns a FastqBlock. A writer is anything
+    with write_block() and close(), e.g. a FastqWriter or FastaWriter, or
+    a BarcodeSplitter, whose reads are split to its own outputs.
+    """
+
+    def __init__(
+            self,
+            # Inherited args
+            in_file_name,
+            # Inherited kwargs
+            verbose=False,
+            compression=pyngsqc.GUESS_COMPRESSION,
+            deduplicate_header=True,
+            print_summary=False,
+            binary=False,
+            threads=1
+    ):
+        super(Pipeline, self).__init__(
+            in_file_name,
+            None,  # Output goes to each writer
+            verbose=verbose,
+            compression=compression,
+            deduplicate_header=deduplicate_header,
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads
+        )
+        self.stats = {}
+        self.stages = []
+        self.stage_names = []
+        # The writers, and the number of stages each one's reads pass
+        # through first, or None for all of them
+        self.writers = []
+        self._writer_stages = []
+
+    def add_stage(self, stage, name=None):
+        """Adds stage to the end of the chain"""
+        self.stages.append(_stage_function(stage))
+        self.stage_names.append(_stage_name(stage) if name is None else name)
+
+    def add_writer(self, writer, after=None):
+        """Writes reads with writer once they have passed through the first
+        after stages, or all stages if after is None
+        """
+        self.writers.append(writer)
+        self._writer_stages.append(after)
+
+    def _outputs(self):
+        """Returns, for each writer, a function which prepares its blocks (or
+        None), and what they are written with
+        """
+        outputs = []
+        for writer in self.writers:
+            if isinstance(writer, barcodesplitter.BarcodeSplitter):
+                # Splits in the same way as the splitter's own tasks
+                task = barcodesplitter.BarcodeSplitTask(
+                    None,
+                    writer.barcodes,
+                    writer.index,
+                    writer.barcode_end,
+                    writer.write_to_header
+                )
+                outputs.append((task.split_block, writer.writer))
+            else:
+                outputs.append((None, writer))
+        return outputs
+
+    def _task_args(self):
+        writer_stages = [
+            len(self.stages) if after is None else after
+            for after in self._writer_stages
+        ]
+        for after in writer_stages:
+            if not 0 <= after <= len(self.stages):
+                raise ValueError(
+                    "Can not write after stage %i of %i" %
+                    (after, len(self.stages))
+                )
+        preparers = [preparer for preparer, sink in self._outputs()]
+        return (self.stages, writer_stages, preparers)
+
+    def _print_summary(self):
+        stderr.write("Pipeline finished:\n")
+        stderr.write(
+            "\tRead %i reads from %s\n" %
+            (self.stats["reader"]["num_reads"], self.in_file_name)
+        )
+        for stage in self.stats["stages"]:
+            stderr.write(
+                "\t%s: %i reads in, %i out, in %.2f seconds\n" % (
+                    stage["name"],
+                    stage["num_reads_in"],
+                    stage["num_reads_out"],
+                    stage["seconds"]
+                )
+            )
+
+    def _check(self):
+        if len(self.writers) < 1:
+            raise ValueError(
+                "You must add a writer before run()-ing Pipeline"
+            )
+
+    def run(self):
+        self._check()
+        task = PipelineTask(None, *self._task_args())
+        writer = _PipelineWriter(
+            [sink for preparer, sink in self._outputs()],
+            self.stage_names
+        )
+        for block in self.reader.iter_blocks():
+            task.block = block
+            writer.write_block(task())
+        writer.close()
+
+        self.stats["reader"] = self.reader.stats
+        self.stats["writer"] = writer.stats
+        self.stats["stages"] = writer.stats["stages"]
+        if self.print_summary:
+            self._print_summary()
+
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
+        """Runs the stages over chunks of reads in separate processes.
+
+        Each chunk is sent with its own copy of the stages, so counts which
+        a stage keeps itself, e.g. the rejections of a QualFilter's
+        filters, are not kept. The reads into and out of each stage are
+        counted in stats["stages"], as by run().
+        """
+        self._check()
+        task_args = self._task_args()
+        # Stages are sent to the workers with every block, and a stage which
+        # can't be pickled (e.g. a lambda) would otherwise hang the runner
+        pickle.dumps(task_args)
+        runner = _parallel.ParallelRunner(
+            PipelineTask,
+            self.reader,
+            _PipelineWriter(
+                [sink for preparer, sink in self._outputs()],
+                self.stage_names
+            ),
+            task_args,
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
+        )
+        runner.run()
+
+        self.stats["runner"] = {"num_reads": runner.num_written_reads}
+        self.stats["reader"] = self.reader.stats
+        # The writers are closed, and their stats kept, in the writer process
+        self.stats["writer"] = runner.stats
+        self.stats["stages"] = runner.stats["stages"]
+        if self.print_summary:
+            self._print_summary()
+
+
+class PipelineTask(object):
+    """Runs a block through every stage of a pipeline, returning what each
+    writer is given, and the number of reads into each stage, and out of
+    the last, with the time spent in each stage
+    """
+
+    def __init__(self, block, stages, writer_stages, preparers):
+        self.block = block
+        self.stages = stages
+        self.writer_stages = writer_stages
+        self.preparers = preparers
+
+    def __call__(self):
+        block = self.block
+        num_stages = len(self.stages)
+        outputs = [None] * len(self.writer_stages)
+        counts = [len(block)]
+        seconds = []
+        for stage_num in range(num_stages + 1):
+            for writer_num, after in enumerate(self.writer_stages):
+                if after == stage_num:
+                    if stage_num < num_stages:
+                        # Later stages may replace the block's reads
+                        outputs[writer_num] = _copy_block(block)
+                    else:
+                        outputs[writer_num] = block
+            if stage_num == num_stages:
+                break
+            start = time()
+            block = self.stages[stage_num](block)
+            seconds.append(time() - start)
+            counts.append(len(block))
+        for writer_num, preparer in enumerate(self.preparers):
+            if preparer is not None:
+                outputs[writer_num] = preparer(outputs[writer_num])
+        return (outputs, counts, seconds)
+
+
+class _PipelineWriter(object):
+    """Writes the results of PipelineTasks with each of a pipeline's
+    writers, keeping the stats of each stage
+    """
+
+    def __init__(self, writers, stage_names):
+        self.writers = writers
+        self.stats = {
+            "num_reads": 0,
+            "stages": [
+                {
+                    "name": name,
+                    "num_reads_in": 0,
+                    "num_reads_out": 0,
+                    "seconds": 0.0
+                }
+                for name in stage_names
+            ],
+        }
+
+    def write_block(self, result):
+        outputs, counts, seconds = result
+        self.stats["num_reads"] += counts[0]
+        for stage_num, stage in enumerate(self.stats["stages"]):
+            stage["num_reads_in"] += counts[stage_num]
+            stage["num_reads_out"] += counts[stage_num + 1]
+            stage["seconds"] += seconds[stage_num]
+        for writer, output in zip(self.writers, outputs):
+            writer.write_block(output)
+
+    def close(self):
+        self.stats["writers"] = []
+        for writer in self.writers:
+            writer.close()
+            self.stats["writers"].append(writer.stats)
@@ -15,6 +15,11 @@
 import pyngsqc
 from sys import stderr
 from pyngsqc import _parallel
+from pyngsqc import filters as filt
+
+# Fraction of each chunk of a parallel run checked before its filters are
+# reordered
+CHUNK_REORDER_FRACTION = 0.1
 
 
 class QualFilter(pyngsqc.QualBase):
@@ -30,6 +35,10 @@ class QualFilter(pyngsqc.QualBase):
             qual_threshold (int): minimum "pass" phred score
             pass_rate (float): minimum fraction of bases which must be equal
                 to or greater than qual_threshold
+            filters (list): further filters.ReadFilter predicates, which
+                reads must also pass, checked in the same pass over the file
+            adaptive (bool): reorder all predicates by how often, and how
+                cheaply, they reject reads
     """
     def __init__(
             self,
@@ -43,10 +52,15 @@ class QualFilter(pyngsqc.QualBase):
             deduplicate_header=True,
             verbose=False,
             print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
             # Local kwargs
             qual_threshold=15,
             pass_rate=0.9,
-            max_Ns=-1
+            max_Ns=-1,
+            filters=None,
+            adaptive=True
     ):
         # Initialise base class
         super(QualFilter, self).__init__(
@@ -56,12 +70,37 @@ class QualFilter(pyngsqc.QualBase):
             compression=compression,
             deduplicate_header=deduplicate_header,
             verbose=verbose,
-            print_summary=print_summary
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         # Initialise local variables
         self.pass_rate = float(pass_rate)
         self.qual_threshold = qual_threshold
         self.max_Ns = max_Ns
+        self.filters = list(filters or [])
+        self.adaptive = adaptive
+        self._build_chain()
+
+    def _build_chain(self, first_reorder=None):
+        """Builds the FilterChain of the pass rate and N checks, and of
+        self.filters
+        """
+        filters = [
+            filt.PassRateFilter(
+                self.qual_threshold,
+                self.pass_rate,
+                self.qual_offset
+            )
+        ]
+        if self.max_Ns != -1:
+            filters.append(filt.MaxNsFilter(self.max_Ns))
+        self.chain = filt.FilterChain(
+            filters + self.filters,
+            adaptive=self.adaptive,
+            first_reorder=first_reorder
+        )
 
     def _print_summary(self):
         stderr.write("QC check finished:\n")
@@ -74,37 +113,29 @@ class QualFilter(pyngsqc.QualBase):
             "\t%i sequences failed QC, and were ignored\n" %
             self.stats["writer"]["num_reads"]
         )
+        for name, count in sorted(self.stats["rejected"].items()):
+            stderr.write("\t\t%i rejected by %s\n" % (count, name))
 
     def filter_read(self, read):
-        def _passes_qc(read):
-            qual = read[3]
-            read_len = len(qual)
-            low_scores = 0
-            for p in qual:
-                if pyngsqc.get_qual_from_phred(p, self.qual_offset) <\
-                        self.qual_threshold:
-                    low_scores += 1
-            this_pass_rate = 1.0 - float(low_scores) / float(read_len)
-            if this_pass_rate <= self.pass_rate:
-                return False
-            elif self.max_Ns != -1 and \
-                    int(pyngsqc.num_Ns_in_read(read)) > self.max_Ns:
-                return False
-            else:
-                return True
-
-        if _passes_qc(read):
+        if self.chain.passes(read):
             return read
         else:
             return []
 
-    def run(self):
-        for read in self.reader:
+    def filter_block(self, block):
+        passed = pyngsqc.FastqBlock()
+        for read in block:
             if self.filter_read(read):
-                self.writer.write(read)
+                passed.append(read)
+        return passed
+
+    def run(self):
+        for block in self.reader.iter_blocks():
+            self.writer.write_block(self.filter_block(block))
 
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.writer.stats
+        self.stats["rejected"] = self.chain.rejections()
         if self.print_summary:
             self._print_summary()
         self.reader.close()
@@ -113,42 +144,121 @@ class QualFilter(pyngsqc.QualBase):
             self.stats["writer"]["num_reads"]
         )
 
-    def run_parallel(self):
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
+        """Filters chunks of reads in separate processes. Each chunk is
+        filtered by a new FilterChain, so if adaptive, its filters are
+        reordered once CHUNK_REORDER_FRACTION of the chunk has been
+        checked, rather than every reorder_interval reads of the file.
+        """
         runner = _parallel.ParallelRunner(
             QualFilterTask,
             self.reader,
-            self.writer,
+            _QualFilterWriter(self.writer),
             (  # Task Options
                 self.pass_rate,
                 self.qual_threshold,
                 self.qual_offset,
-                self.max_Ns
-            )
+                self.max_Ns,
+                self.filters,
+                self.adaptive
+            ),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
         )
         runner.run()
 
         self.stats["runner"] = runner.stats
         self.stats["reader"] = self.reader.stats
-        self.stats["writer"] = self.writer.stats
+        self.stats["writer"] = runner.stats["writer"]
+        self.stats["rejected"] = runner.stats["rejected"]
         if self.print_summary:
             self._print_summary()
 
+    def _run_shard(self):
+        answer = super(QualFilter, self)._run_shard()
+        answer["rejected"] = self.chain.rejections()
+        return answer
+
+    def run_sharded(self, num_shards=None):
+        """Filters num_shards byte ranges of an uncompressed or BGZF input
+        file at once, in separate processes
+        """
+        runner = _parallel.ShardRunner(self, num_shards)
+        runner.run()
+
+        self.stats["reader"] = runner.stats["reader"]
+        self.stats["writer"] = runner.stats["writer"]
+        self.stats["rejected"] = {}
+        for answer in runner.answers:
+            for name, count in answer["rejected"].items():
+                self.stats["rejected"][name] = \
+                    self.stats["rejected"].get(name, 0) + count
+        if self.print_summary:
+            self._print_summary()
+        return (
+            self.stats["reader"]["num_reads"],
+            self.stats["writer"]["num_reads"]
+        )
+
 
 class QualFilterTask(QualFilter):
 
     def __init__(
             self,
-            read,
+            block,
             pass_rate,
             qual_threshold,
             qual_offset,
             max_Ns,
+            filters,
+            adaptive
     ):
-        self.read = read
+        self.block = block
         self.pass_rate = float(pass_rate)
         self.qual_threshold = qual_threshold
         self.qual_offset = qual_offset
         self.max_Ns = max_Ns
+        self.filters = filters
+        self.adaptive = adaptive
+        # The chain is new for each chunk, usually shorter than the chain's
+        # reorder_interval, so the order is instead learnt from its first
+        # reads
+        self._build_chain(
+            first_reorder=max(1, int(len(block) * CHUNK_REORDER_FRACTION))
+        )
 
     def __call__(self):
-        return self.filter_read(self.read)
+        return (self.filter_block(self.block), self.chain.rejections())
+
+
+class _QualFilterWriter(object):
+    """Writes the blocks of QualFilterTasks with writer, summing the number
+    of reads each chunk's filters rejected
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.stats = {
+            "num_reads": 0,
+            "rejected": {}
+        }
+
+    def write_block(self, answer):
+        block, rejected = answer
+        self.writer.write_block(block)
+        self.stats["num_reads"] += len(block)
+        for name, count in rejected.items():
+            self.stats["rejected"][name] = \
+                self.stats["rejected"].get(name, 0) + count
+
+    def close(self):
+        self.writer.close()
+        self.stats["writer"] = self.writer.stats
@@ -13,17 +13,438 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import pyngsqc
-from copy import deepcopy
+from array import array
+from collections import Counter
+from itertools import zip_longest
+from pyngsqc import _parallel
+try:
+    import numpy as np
+except ImportError:
+    # Counting falls back to pure python
+    np = None
 
+# Counts of one cycle, for growing flat arrays of counts
+ZEROS_ROW = array("Q", [0] * 256)
 
-class _QualStatsTask():
 
-    def __init__(self):
-        super(_QualStatsTask, self).__init__()
+class CycleCounts(object):
+    """Counts of each quality and base character at each cycle (position in
+    the read). If NumPy is installed, and use_numpy is not False, counts are
+    kept in (cycle x character) matrices, and whole blocks of reads are
+    counted at once. Otherwise counts are kept in flat arrays, with the
+    counts of each cycle in turn, and the characters at each cycle of a
+    block are counted by Counter. Either way, storage is grown geometrically
+    to fit the longest read, so long reads cost little more than short.
 
+    Counts from separate runs, such as of workers, shards or lanes, can be
+    combined with merge(), in any order. to_dict() gives them a JSON
+    serialisable form, to be read back by from_dict().
+    """
 
-class QualStats(pyngsqc.QualBase):
+    def __init__(self, use_numpy=None, reserve_cycles=0):
+        if use_numpy is None:
+            use_numpy = np is not None
+        self.use_numpy = use_numpy
+        self.num_reads = 0
+        self.num_cycles = 0
+        # Number of cycles there is room for
+        self._capacity = 0
+        if use_numpy:
+            self.quals = np.zeros((0, 256), dtype=np.uint64)
+            self.bases = np.zeros((0, 256), dtype=np.uint64)
+        else:
+            self.quals = array("Q")
+            self.bases = array("Q")
+        self._reserve(reserve_cycles)
+
+    def _reserve(self, num_cycles):
+        """Makes room for the counts of at least num_cycles cycles"""
+        if num_cycles <= self._capacity:
+            return
+        capacity = max(num_cycles, 2 * self._capacity)
+        for attr in ("quals", "bases"):
+            old = getattr(self, attr)
+            if self.use_numpy:
+                new = np.zeros((capacity, 256), dtype=np.uint64)
+                new[:len(old)] = old
+                setattr(self, attr, new)
+            else:
+                old.extend(ZEROS_ROW * (capacity - self._capacity))
+        self._capacity = capacity
+
+    def _grow(self, num_cycles):
+        if num_cycles > self.num_cycles:
+            self._reserve(num_cycles)
+            self.num_cycles = num_cycles
+
+    def _row(self, counts, cycle):
+        """Returns the counts of each character at cycle"""
+        if self.use_numpy:
+            return counts[cycle]
+        return counts[cycle * 256:(cycle + 1) * 256]
+
+    def add_block(self, seqs, quals):
+        """Counts the characters of the sequences and qualities of a block,
+        which may be str or bytes
+        """
+        if not seqs:
+            return
+        self.num_reads += len(seqs)
+        if self.use_numpy:
+            self._add_block_numpy(seqs, quals)
+        else:
+            self._add_block_python(seqs, quals)
+
+    def _add_block_numpy(self, seqs, quals):
+        lengths = np.fromiter(map(len, seqs), dtype=np.intp, count=len(seqs))
+        num_cycles = int(lengths.max())
+        if num_cycles == 0:
+            return
+        self._grow(num_cycles)
+        # Each character is counted at index cycle * 256 + character
+        same_length = bool((lengths == num_cycles).all())
+        if same_length:
+            # Broadcast over each read of a (read x cycle) matrix
+            cycle_offsets = np.arange(num_cycles, dtype=np.intp) * 256
+        else:
+            starts = np.cumsum(lengths) - lengths
+            cycle_offsets = np.arange(lengths.sum(), dtype=np.intp)
+            cycle_offsets -= np.repeat(starts, lengths)
+            cycle_offsets *= 256
+        for lines, counts in ((seqs, self.bases), (quals, self.quals)):
+            joined = lines[0][:0].join(lines)
+            if isinstance(joined, str):
+                joined = joined.encode("latin-1")
+            chars = np.frombuffer(joined, dtype=np.uint8)
+            if same_length:
+                chars = chars.reshape(len(lines), num_cycles)
+            counts[:num_cycles] += np.bincount(
+                (cycle_offsets + chars).ravel(),
+                minlength=num_cycles * 256
+            ).reshape(num_cycles, 256).astype(np.uint64)
+
+    def _add_block_python(self, seqs, quals):
+        self._grow(max(map(len, seqs)))
+        for lines, counts in ((seqs, self.bases), (quals, self.quals)):
+            # Columns are padded with None past the end of shorter reads
+            row_start = 0
+            for column in zip_longest(*lines):
+                for char, count in Counter(column).items():
+                    if char is None:
+                        continue
+                    if not isinstance(char, int):
+                        char = ord(char)
+                    counts[row_start + char] += count
+                row_start += 256
+
+    def merge(self, other):
+        """Adds the counts of other to these, and returns self"""
+        self.num_reads += other.num_reads
+        self._grow(other.num_cycles)
+        if self.use_numpy:
+            num_cycles = other.num_cycles
+            for counts, other_counts in ((self.quals, other.quals),
+                                         (self.bases, other.bases)):
+                for cycle in range(num_cycles):
+                    counts[cycle] += np.asarray(
+                        other._row(other_counts, cycle),
+                        dtype=np.uint64
+                    )
+            return self
+        for counts, other_counts in ((self.quals, other.quals),
+                                     (self.bases, other.bases)):
+            for cycle in range(other.num_cycles):
+                row_start = cycle * 256
+                for char, count in enumerate(other._row(other_counts, cycle)):
+                    if count:
+                        counts[row_start + char] += int(count)
+        return self
+
+    def to_dict(self):
+        """Returns the counts as a dict of lists, with only the non-zero
+        counts of each cycle, as [character, count] pairs
+        """
+        data = {"num_reads": self.num_reads}
+        for attr in ("quals", "bases"):
+            counts = getattr(self, attr)
+            data[attr] = [
+                [[char, int(count)]
+                 for char, count in enumerate(self._row(counts, cycle))
+                 if count]
+                for cycle in range(self.num_cycles)
+            ]
+        return data
+
+    @classmethod
+    def from_dict(cls, data, use_numpy=None):
+        counts = cls(use_numpy)
+        counts.num_reads = data["num_reads"]
+        counts._grow(len(data["quals"]))
+        for attr in ("quals", "bases"):
+            rows = getattr(counts, attr)
+            for cycle, pairs in enumerate(data[attr]):
+                for char, count in pairs:
+                    if counts.use_numpy:
+                        rows[cycle, char] = count
+                    else:
+                        rows[cycle * 256 + char] = count
+        return counts
+
+    # Only non-zero counts are pickled, when sent between processes
+    def __getstate__(self):
+        return {"use_numpy": self.use_numpy, "data": self.to_dict()}
+
+    def __setstate__(self, state):
+        use_numpy = state["use_numpy"] and np is not None
+        self.__dict__ = CycleCounts.from_dict(state["data"], use_numpy).__dict__
+
+    def quartiles(self, qual_offset):
+        """Returns the first quartile, median and third quartile of the
+        scores at each cycle
+        """
+        return [
+            pyngsqc.quartiles_from_counts([
+                int(count)
+                for count in self._row(self.quals, cycle)[qual_offset:126]
+            ])
+            for cycle in range(self.num_cycles)
+        ]
+
+    def positions(self, initial_dict, qual_offset):
+        """Returns the counts in QualStats' positions format: a list of dicts
+        of base and score counts, copied from initial_dict, per cycle
+        """
+        positions = []
+        num_scores = len(initial_dict["scores"])
+        for cycle in range(self.num_cycles):
+            qual_row = [int(count) for count in self._row(self.quals, cycle)]
+            scores = qual_row[qual_offset:qual_offset + num_scores]
+            for char in range(256):
+                if qual_row[char] and not \
+                        qual_offset <= char < qual_offset + num_scores:
+                    # Raises the error for an invalid score
+                    score = pyngsqc.get_qual_from_phred(char, qual_offset)
+                    scores[score] += qual_row[char]
+            base_row = [int(count) for count in self._row(self.bases, cycle)]
+            bases = dict(initial_dict["bases"])
+            # Anything other than the four bases counts as an N
+            bases["N"] = sum(base_row)
+            for base in "ACGT":
+                bases[base] = base_row[ord(base)]
+                bases["N"] -= base_row[ord(base)]
+            positions.append({
+                "bases": bases,
+                "scores": scores,
+                "summary": dict(initial_dict["summary"])
+            })
+        return positions
+
+
+class ReadCounts(object):
+    """Per-read counts, as FastQC's modules other than those of each cycle:
+    histograms of the mean quality, length and GC percentage of each read,
+    and counts of each distinct sequence. Only the first max_tracked
+    distinct sequences are counted, which bounds memory use; later reads
+    only add to the counts of sequences already seen. As in FastQC, reads
+    longer than 75 bases are tracked by their first 50.
+
+    Counts are merged and serialised like those of CycleCounts.
+    """
+
+    def __init__(self, qual_offset, max_tracked=100000):
+        self.qual_offset = qual_offset
+        self.max_tracked = max_tracked
+        self.num_reads = 0
+        self.mean_quals = Counter()
+        self.lengths = Counter()
+        self.gc = Counter()
+        # Sequences are always bytes
+        self.sequences = {}
+
+    def add_block(self, seqs, quals):
+        if not seqs:
+            return
+        self.num_reads += len(seqs)
+        sequences = self.sequences
+        is_str = isinstance(seqs[0], str)
+        for seq, qual in zip(seqs, quals):
+            if is_str:
+                seq = seq.encode("latin-1")
+                qual = qual.encode("latin-1")
+            length = len(seq)
+            self.lengths[length] += 1
+            if length == 0:
+                continue
+            # Both rounded down, as in FastQC
+            self.mean_quals[sum(qual) // length - self.qual_offset] += 1
+            gc = seq.count(b"G") + seq.count(b"C")
+            self.gc[100 * gc // length] += 1
+            if length > 75:
+                seq = seq[:50]
+            if seq in sequences:
+                sequences[seq] += 1
+            elif len(sequences) < self.max_tracked:
+                sequences[seq] = 1
+
+    def merge(self, other):
+        """Adds the counts of other to these, and returns self"""
+        self.num_reads += other.num_reads
+        self.mean_quals.update(other.mean_quals)
+        self.lengths.update(other.lengths)
+        self.gc.update(other.gc)
+        sequences = self.sequences
+        for seq, count in other.sequences.items():
+            if seq in sequences:
+                sequences[seq] += count
+            elif len(sequences) < self.max_tracked:
+                sequences[seq] = count
+        return self
+
+    def duplication_levels(self):
+        """Returns a dict of the number of distinct tracked sequences seen
+        each number of times, and the percentage of tracked reads which
+        would remain if they were deduplicated
+        """
+        levels = Counter(self.sequences.values())
+        num_tracked = sum(self.sequences.values())
+        if num_tracked == 0:
+            return dict(levels), 100.0
+        return dict(levels), 100.0 * len(self.sequences) / num_tracked
+
+    def overrepresented(self, min_fraction=0.001):
+        """Returns (sequence, count, percentage of all reads) for each
+        sequence which makes up more than min_fraction of all reads, most
+        frequent first
+        """
+        min_count = self.num_reads * min_fraction
+        found = [
+            (seq.decode("latin-1"), count, 100.0 * count / self.num_reads)
+            for seq, count in self.sequences.items()
+            if count > min_count
+        ]
+        found.sort(key=lambda item: (-item[1], item[0]))
+        return found
+
+    def summary(self):
+        levels, percent_remaining = self.duplication_levels()
+        return {
+            "mean_quality": dict(self.mean_quals),
+            "length": dict(self.lengths),
+            "gc": dict(self.gc),
+            "duplication_levels": levels,
+            "percent_remaining_if_deduplicated": percent_remaining,
+            "overrepresented": self.overrepresented(),
+        }
+
+    def to_dict(self):
+        data = {
+            "qual_offset": self.qual_offset,
+            "max_tracked": self.max_tracked,
+            "num_reads": self.num_reads,
+            "sequences": [
+                [seq.decode("latin-1"), count]
+                for seq, count in self.sequences.items()
+            ],
+        }
+        for attr in ("mean_quals", "lengths", "gc"):
+            data[attr] = sorted(getattr(self, attr).items())
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        counts = cls(data["qual_offset"], data["max_tracked"])
+        counts.num_reads = data["num_reads"]
+        for attr in ("mean_quals", "lengths", "gc"):
+            getattr(counts, attr).update(dict(data[attr]))
+        counts.sequences = dict(
+            (seq.encode("latin-1"), count) for seq, count in data["sequences"]
+        )
+        return counts
+
+
+class _QualStatsTask(object):
+
+    def __init__(
+            self,
+            block,
+            offset,
+            use_numpy,
+            sample_every,
+            qual_offset,
+            max_tracked
+    ):
+        self.block = block
+        # The number of reads before the block, so its reads are sampled as
+        # they would be by a serial run
+        self.offset = offset
+        self.use_numpy = use_numpy
+        self.sample_every = sample_every
+        self.qual_offset = qual_offset
+        # Of the ReadCounts to make, or None for none
+        self.max_tracked = max_tracked
+
+    def __call__(self):
+        start = -self.offset % self.sample_every
+        seqs = self.block.seqs[start::self.sample_every]
+        quals = self.block.quals[start::self.sample_every]
+        counts = CycleCounts(self.use_numpy)
+        counts.add_block(seqs, quals)
+        read_counts = None
+        if self.max_tracked is not None:
+            read_counts = ReadCounts(self.qual_offset, self.max_tracked)
+            read_counts.add_block(seqs, quals)
+        return counts, read_counts, self.offset, len(self.block)
 
+
+class _CycleCountsWriter(object):
+    """Takes the place of a writer in a ParallelRunner, merging the counts
+    of each block rather than writing them. ReadCounts are merged in the
+    order of their blocks in the input, whatever order they arrive in, so
+    the same sequences are tracked by every run.
+    """
+
+    def __init__(self, counts, read_counts):
+        self.stats = {
+            "num_reads": 0,
+            "counts": counts,
+            "read_counts": read_counts
+        }
+        # The offset of the next block whose ReadCounts are merged, and the
+        # ReadCounts and lengths of the blocks which arrived ahead of it, by
+        # offset
+        self._next_offset = 0
+        self._waiting = {}
+
+    def write_block(self, answer):
+        counts, read_counts, offset, num_reads = answer
+        self.stats["counts"].merge(counts)
+        self.stats["num_reads"] += counts.num_reads
+        if read_counts is None:
+            return
+        self._waiting[offset] = (read_counts, num_reads)
+        while self._next_offset in self._waiting:
+            read_counts, num_reads = self._waiting.pop(self._next_offset)
+            self.stats["read_counts"].merge(read_counts)
+            self._next_offset += num_reads
+
+    def close(self):
+        pass
+
+
+class QualStats(pyngsqc.QualBase):
+    """
+    Usage:
+        QualStats(in_file_name, qual_offset=33, sample_every=1,
+                  tolerance=None, check_interval=100000)
+            in_file_name (str): path of input file
+            sample_every (int): only count every sample_every-th read
+            tolerance (float): if given, run() stops early once no cycle's
+                quartiles have changed by more than tolerance over the last
+                check_interval counted reads
+            read_stats (bool): also count per-read histograms, duplication
+                and overrepresented sequences, with at most max_tracked
+                distinct sequences counted
+    """
     def __init__(
             self,
             # Inherited args
@@ -35,8 +456,15 @@ class QualStats(pyngsqc.QualBase):
             deduplicate_header=True,
             verbose=False,
             print_summary=False,
+            binary=False,
+            threads=1,
             # Local kwargs
-            output=pyngsqc.STDOUT
+            output=pyngsqc.STDOUT,
+            sample_every=1,
+            tolerance=None,
+            check_interval=100000,
+            read_stats=False,
+            max_tracked=100000
     ):
         # Initialise base class
         super(QualStats, self).__init__(
@@ -46,11 +474,23 @@ class QualStats(pyngsqc.QualBase):
             compression=compression,
             deduplicate_header=deduplicate_header,
             verbose=verbose,
-            print_summary=print_summary
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads
         )
         # Initialise local variables
         self.output = output
+        self.sample_every = sample_every
+        self.tolerance = tolerance
+        self.check_interval = check_interval
         self.stats["positions"] = []
+        self.counts = CycleCounts()
+        if read_stats:
+            self.read_counts = ReadCounts(qual_offset, max_tracked)
+        else:
+            self.read_counts = None
+        # Index of the first read of the next block to be sampled
+        self._sample_start = 0
 
         # Set default dicts for the position_bases and position_qualities lists
         bases = list("AGCTN")
@@ -91,6 +531,26 @@ class QualStats(pyngsqc.QualBase):
             cycle += 1
             values = [str(position["summary"][col]) for col in self.columns]
             print("%i\t" % cycle, "\t".join(values))
+        if self.read_counts is None:
+            return
+        reads = self.stats["reads"]
+        for name in ("mean_quality", "length", "gc"):
+            print()
+            print("%s\tcount" % name)
+            for value, count in sorted(reads[name].items()):
+                print("%i\t%i" % (value, count))
+        print()
+        print("duplication_level\tcount")
+        for level, count in sorted(reads["duplication_levels"].items()):
+            print("%i\t%i" % (level, count))
+        print(
+            "percent_remaining_if_deduplicated\t%f" %
+            reads["percent_remaining_if_deduplicated"]
+        )
+        print()
+        print("overrepresented\tcount\tpercent")
+        for seq, count, percent in reads["overrepresented"]:
+            print("%s\t%i\t%f" % (seq, count, percent))
 
     def _summarize_data(self):
         for position in self.stats["positions"]:
@@ -106,24 +566,16 @@ class QualStats(pyngsqc.QualBase):
             # Mean
             position["summary"]["mean"] = position["summary"]["sum"] / \
                 position["summary"]["count"]
-            # Quartiles, median, iqr and whiskers
-            position["summary"]["Q1"] = pyngsqc.percentile_from_counts(
-                position["scores"],
-                0.25
-            )
-            position["summary"]["median"] = pyngsqc.percentile_from_counts(
-                position["scores"],
-                0.5
-            )
-            position["summary"]["Q3"] = pyngsqc.percentile_from_counts(
-                position["scores"],
-                0.75
-            )
+            # Quartiles, median, iqr and whiskers, from one pass over the
+            # scores
+            quartiles = pyngsqc.quartiles_from_counts(position["scores"])
+            (position["summary"]["Q1"], position["summary"]["median"],
+             position["summary"]["Q3"]) = quartiles
             position["summary"]["IQR"] = position["summary"]["Q3"] - \
                 position["summary"]["Q1"]
 
             (position["summary"]["lW"], position["summary"]["rW"]) = \
-                pyngsqc.whiskers_from_counts(position["scores"])
+                pyngsqc.whiskers_from_quartiles(*quartiles)
 
             # Calculate Base Counts
             total_count = 0
@@ -134,24 +586,147 @@ class QualStats(pyngsqc.QualBase):
             position["summary"]["total"] = total_count
             position["summary"]["GC"] = float(g_plus_c) / float(total_count)
 
+    def _summarize_counts(self):
+        self.stats["positions"] = self.counts.positions(
+            self.initial_dict,
+            self.qual_offset
+        )
+        self._summarize_data()
+        if self.read_counts is not None:
+            self.stats["reads"] = self.read_counts.summary()
+
+    def merge_counts(self, counts, read_counts=None):
+        """Adds counts, a CycleCounts from another run such as that of
+        another lane, to this one's, and summarises them again. read_counts
+        is that run's ReadCounts, if both runs have them.
+        """
+        self.counts.merge(counts)
+        if read_counts is not None:
+            self.read_counts.merge(read_counts)
+        self.num_reads = self.counts.num_reads
+        self._summarize_counts()
+
     def _process_read(self, read):
-        while len(self.stats["positions"]) < len(read[1]):
-            self.stats["positions"].append(deepcopy(self.initial_dict))
-
-        for pos in range(len(read[1])):
-            base = read[1][pos]
-            score = pyngsqc.get_qual_from_phred(read[3][pos], self.qual_offset)
-            self.stats["positions"][pos]["scores"][score] += 1
-            try:
-                self.stats["positions"][pos]["bases"][base] += 1
-            except KeyError:
-                self.stats["positions"][pos]["bases"]["N"] += 1
+        self.counts.add_block([read[1]], [read[3]])
+        if self.read_counts is not None:
+            self.read_counts.add_block([read[1]], [read[3]])
+
+    def _process_block(self, block):
+        seqs = block.seqs
+        quals = block.quals
+        if self.sample_every > 1:
+            start = self._sample_start
+            seqs = seqs[start::self.sample_every]
+            quals = quals[start::self.sample_every]
+            self._sample_start = (start - len(block)) % self.sample_every
+        self.counts.add_block(seqs, quals)
+        if self.read_counts is not None:
+            self.read_counts.add_block(seqs, quals)
+
+    def _has_settled(self, last_quartiles, quartiles):
+        if last_quartiles is None or len(last_quartiles) != len(quartiles):
+            return False
+        for last_cycle, cycle in zip(last_quartiles, quartiles):
+            for last_value, value in zip(last_cycle, cycle):
+                if abs(value - last_value) > self.tolerance:
+                    return False
+        return True
 
     def run(self):
-        for read in self.reader:
-            self.num_reads += 1
-            self._process_read(read)
-        self._summarize_data()
+        block_size = pyngsqc.DEFAULT_BLOCK_SIZE
+        if self.tolerance is not None:
+            # Checks are made between blocks
+            block_size = min(block_size, self.check_interval)
+        next_check = self.check_interval
+        last_quartiles = None
+        self.stats["stopped_early"] = False
+        for block in self.reader.iter_blocks(block_size):
+            self.num_reads += len(block)
+            self._process_block(block)
+            if self.tolerance is not None and \
+                    self.counts.num_reads >= next_check:
+                next_check = self.counts.num_reads + self.check_interval
+                quartiles = self.counts.quartiles(self.qual_offset)
+                if self._has_settled(last_quartiles, quartiles):
+                    self.stats["stopped_early"] = True
+                    break
+                last_quartiles = quartiles
+        self.stats["reader"] = self.reader.stats
+        self.stats["num_sampled_reads"] = self.counts.num_reads
+        self._summarize_counts()
+
+        if self.print_summary:
+            self._print_summary()
+
+    def _run_shard(self):
+        for block in self.reader.iter_blocks():
+            self.num_reads += len(block)
+            self._process_block(block)
+        return {
+            "reader": self.reader.stats,
+            "counts": self.counts,
+            "read_counts": self.read_counts
+        }
+
+    def run_sharded(self, num_shards=None):
+        """Counts num_shards byte ranges of an uncompressed or BGZF input file
+        at once, in separate processes
+        """
+        runner = _parallel.ShardRunner(self, num_shards)
+        runner.run()
+
+        for answer in runner.answers:
+            self.counts.merge(answer["counts"])
+            if self.read_counts is not None:
+                self.read_counts.merge(answer["read_counts"])
+        self.stats["reader"] = runner.stats["reader"]
+        self.num_reads = self.stats["reader"]["num_reads"]
+        self.stats["num_sampled_reads"] = self.counts.num_reads
+        self._summarize_counts()
+
+        if self.print_summary:
+            self._print_summary()
+
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None
+    ):
+        read_counts = None
+        if self.read_counts is not None:
+            read_counts = ReadCounts(
+                self.read_counts.qual_offset,
+                self.read_counts.max_tracked
+            )
+        runner = _parallel.ParallelRunner(
+            _QualStatsTask,
+            self.reader,
+            _CycleCountsWriter(
+                CycleCounts(self.counts.use_numpy),
+                read_counts
+            ),
+            (  # Task Options
+                self.counts.use_numpy,
+                self.sample_every,
+                self.qual_offset,
+                None if read_counts is None else read_counts.max_tracked
+            ),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            with_offsets=True
+        )
+        runner.run()
+
+        self.counts.merge(runner.stats["counts"])
+        if self.read_counts is not None:
+            self.read_counts.merge(runner.stats["read_counts"])
+        self.num_reads = runner.num_reads
+        self.stats["runner"] = {"num_reads": runner.num_written_reads}
+        self.stats["reader"] = self.reader.stats
+        self.stats["num_sampled_reads"] = self.counts.num_reads
+        self._summarize_counts()
 
         if self.print_summary:
             self._print_summary()
@@ -18,6 +18,24 @@ from pyngsqc import _parallel
 
 
 class QualTrimmer(pyngsqc.QualBase):
+    """
+    Usage:
+        QualTrimmer(in_file_name, out_file_name, qual_threshold=15,
+                    min_length=15, mode=pyngsqc.TRIM_TRAILING, window_size=4)
+            mode: one of
+                TRIM_TRAILING: remove bases below qual_threshold from the 3'
+                    end, up to the first one which is not
+                TRIM_LEADING_TRAILING: as above, from both ends
+                TRIM_MOTT: cut the 3' end where the sum of qual_threshold
+                    minus each score, from the 3' end, is greatest, as BWA's
+                    -q does
+                TRIM_SLIDING_WINDOW: cut at the first window of window_size
+                    bases whose mean score is below qual_threshold, keeping
+                    any leading bases of the window which are not, as
+                    Trimmomatic's SLIDINGWINDOW does
+            remove_trailing_Ns (bool): also remove Ns from the 3' end
+            min_length (int): drop reads shorter than this once trimmed
+    """
     def __init__(
             self,
             # Inherited args
@@ -31,9 +49,14 @@ class QualTrimmer(pyngsqc.QualBase):
             deduplicate_header=True,
             verbose=False,
             print_summary=False,
+            binary=False,
+            threads=1,
+            compression_level=pyngsqc.DEFAULT_COMPRESSION_LEVEL,
             # Local kwargs
             min_length=15,
             remove_trailing_Ns=False,
+            mode=pyngsqc.TRIM_TRAILING,
+            window_size=4
     ):
         # Initialise base class
         super(QualTrimmer, self).__init__(
@@ -44,26 +67,117 @@ class QualTrimmer(pyngsqc.QualBase):
             compression=compression,
             deduplicate_header=deduplicate_header,
             verbose=verbose,
-            print_summary=print_summary
+            print_summary=print_summary,
+            binary=binary,
+            threads=threads,
+            compression_level=compression_level
         )
         # Initialise local variables
         self.remove_trailing_Ns = remove_trailing_Ns
         self.min_length = min_length
+        self.mode = mode
+        self.window_size = window_size
+        self._compile()
+
+    def _compile(self):
+        """Builds a table to translate quality characters which are at least
+        qual_threshold to "G", and the rest to "L"
+        """
+        if self.mode not in (
+                pyngsqc.TRIM_TRAILING,
+                pyngsqc.TRIM_LEADING_TRAILING,
+                pyngsqc.TRIM_MOTT,
+                pyngsqc.TRIM_SLIDING_WINDOW
+        ):
+            raise ValueError("%r is not a valid trimming mode" % self.mode)
+        good_start = self.qual_offset + self.qual_threshold
+        self._good_table = bytes(
+            ord("G") if char >= good_start else ord("L")
+            for char in range(256)
+        )
+
+    def _mott_end(self, qual):
+        """Returns the end of the region kept by Mott's algorithm"""
+        good_start = self.qual_offset + self.qual_threshold
+        running_sum = 0
+        max_sum = 0
+        end = len(qual)
+        for iii in range(len(qual) - 1, -1, -1):
+            running_sum += good_start - qual[iii]
+            if running_sum < 0:
+                break
+            if running_sum > max_sum:
+                max_sum = running_sum
+                end = iii
+        return end
+
+    def _window_end(self, qual):
+        """Returns the end of the region kept by sliding window trimming"""
+        window_size = min(self.window_size, len(qual))
+        if window_size < 1:
+            return len(qual)
+        # Sum of the window's characters, rather than of their scores
+        min_sum = (self.qual_offset + self.qual_threshold) * window_size
+        window_sum = sum(qual[:window_size])
+        start = 0
+        while window_sum >= min_sum:
+            if start + window_size >= len(qual):
+                return len(qual)
+            window_sum += qual[start + window_size] - qual[start]
+            start += 1
+        # Keep leading bases of the failing window which are good
+        good_start = self.qual_offset + self.qual_threshold
+        while qual[start] >= good_start:
+            start += 1
+        return start
+
+    def cut_positions(self, read):
+        """Returns the start and end of the region of read which is kept"""
+        seq = read[1]
+        qual = read[3]
+        if isinstance(qual, str):
+            qual = qual.encode("latin-1")
+        if qual and min(qual) < self.qual_offset:
+            # Raises the error for the invalid character
+            pyngsqc.get_qual_from_phred(min(qual), self.qual_offset)
+        start = 0
+        marks = None
+        if self.mode == pyngsqc.TRIM_MOTT:
+            end = self._mott_end(qual)
+        elif self.mode == pyngsqc.TRIM_SLIDING_WINDOW:
+            end = self._window_end(qual)
+        else:
+            marks = qual.translate(self._good_table)
+            end = marks.rfind(b"G") + 1
+            if self.mode == pyngsqc.TRIM_LEADING_TRAILING and end > 0:
+                start = marks.find(b"G")
+        if self.remove_trailing_Ns:
+            if isinstance(seq, str):
+                seq = seq.encode("latin-1")
+            # In the leading and trailing modes, trailing Ns and low quality
+            # bases may alternate
+            while end > start and (seq[end - 1] in b"Nn" or
+                                   (marks and marks[end - 1] == ord("L"))):
+                end -= 1
+        return start, end
 
     def trim_read(self, read):
-        for iii in reversed(range(len(read[1]))):
-            if self.remove_trailing_Ns and read[1][iii].upper() == "N":
-                # Remove last base and score
-                read[1] = read[1][:-1]  # Base
-                read[3] = read[3][:-1]  # Phred Score
-            elif pyngsqc.get_qual_from_phred(read[3][iii], self.qual_offset) \
-                    < self.qual_threshold:
-                read[1] = read[1][:-1]  # Base
-                read[3] = read[3][:-1]  # Phred Score
-        if len(read[1]) < self.min_length:
+        start, end = self.cut_positions(read)
+        if end - start < self.min_length:
             return ()
-        else:
-            return read
+        if start > 0 or end < len(read[1]):
+            # Sliced once, whatever is removed
+            read[1] = read[1][start:end]  # Bases
+            read[3] = read[3][start:end]  # Phred Scores
+        return read
+
+    def trim_block(self, block):
+        trimmed = pyngsqc.FastqBlock()
+        for read in block:
+            read = self.trim_read(read)
+            if len(read) == 4:  # If it's a valid read
+                trimmed.append(read)
+        return trimmed
 
     def _print_summary(self):
         stderr.write("QualTrimmer finished:\n")
@@ -78,10 +192,8 @@ class QualTrimmer(pyngsqc.QualBase):
         )
 
     def run(self):
-        for read in self.reader:
-            read = self.trim_read(read)
-            if len(read) == 4:  # If it's a valid read
-                self.writer.write(read)
+        for block in self.reader.iter_blocks():
+            self.writer.write_block(self.trim_block(block))
 
         self.stats["reader"] = self.reader.stats
         self.stats["writer"] = self.reader.stats
@@ -91,7 +203,13 @@ class QualTrimmer(pyngsqc.QualBase):
         if self.print_summary:
             self._print_summary()
 
-    def run_parallel(self):
+    def run_parallel(
+            self,
+            chunk_size=pyngsqc.DEFAULT_BLOCK_SIZE,
+            num_procs=None,
+            queue_depth=None,
+            ordered=False
+    ):
         runner = _parallel.ParallelRunner(
             QualTrimmerTask,
             self.reader,
@@ -100,8 +218,14 @@ class QualTrimmer(pyngsqc.QualBase):
                 self.qual_threshold,
                 self.qual_offset,
                 self.min_length,
-                self.remove_trailing_Ns
-            )
+                self.remove_trailing_Ns,
+                self.mode,
+                self.window_size
+            ),
+            chunk_size=chunk_size,
+            num_procs=num_procs,
+            queue_depth=queue_depth,
+            ordered=ordered
         )
         runner.run()
 
@@ -115,17 +239,22 @@ class QualTrimmer(pyngsqc.QualBase):
 class QualTrimmerTask(QualTrimmer):
     def __init__(
             self,
-            read,
+            block,
             qual_threshold,
             qual_offset,
             min_length,
             remove_trailing_Ns,
+            mode,
+            window_size
     ):
-        self.read = read
+        self.block = block
         self.qual_threshold = qual_threshold
         self.qual_offset = qual_offset
         self.min_length = min_length
         self.remove_trailing_Ns = remove_trailing_Ns
+        self.mode = mode
+        self.window_size = window_size
+        self._compile()
 
     def __call__(self):
-        return self.trim_read(self.read)
+        return self.trim_block(self.block)
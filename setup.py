@@ -16,11 +16,12 @@ setup(
     author="Kevin Murray",
     author_email="k.d.murray.91@gmail.com",
     url="https://github.com/kdmurray91/pyNGSQC",
+    python_requires=">=3.6",
     keywords=["http", "multipart", "post", "urllib2"],
     classifiers=[
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
         "Programming Language :: Python :: Implementation :: PyPy",
         "Development Status :: 3 - Alpha",
         "Environment :: Console",
@@ -21,12 +21,19 @@ from pyngsqc import hardtrimmer as htrim
 from pyngsqc import barcodesplitter as bcs
 from pyngsqc import collapser as col
 from pyngsqc import converter as conv
+from pyngsqc import adaptertrimmer as atrim
+from pyngsqc import pipeline as pipe
+from pyngsqc import filters
+from pyngsqc import _compression
 from test.data.expected import (
     EXPECTED_BARCODE_COUNTS,
     EXPECTED_QUALSTATS_POSITIONS,
 )
 import time
 import csv
+import json
+import pickle
+import random
 import unittest
 import os
 
@@ -47,6 +54,247 @@ class Tester(unittest.TestCase):
             count += 1
         self.assertEqual(count, 1000)
 
+    def testFastqReaderBlocks(self):
+        reads = list(ngs.FastqReader(in_file))
+        # A tiny chunk size makes records straddle chunk boundaries
+        fqrdr = ngs.FastqReader(in_file, chunk_size=100)
+        block_reads = []
+        for block in fqrdr.iter_blocks(n_records=333):
+            self.assertTrue(len(block) <= 333)
+            block_reads.extend(block)
+        self.assertEqual(block_reads, reads)
+        self.assertEqual(fqrdr.stats["num_reads"], 1000)
+
+    def testMmapFastqReader(self):
+        reads = list(ngs.FastqReader(in_file))
+        self.assertEqual(list(ngs.MmapFastqReader(in_file)), reads)
+        bin_reads = list(ngs.FastqReader(in_file, binary=True))
+        fqrdr = ngs.MmapFastqReader(in_file, chunk_size=100, zero_copy=True)
+        view_reads = []
+        for block in fqrdr.iter_blocks(n_records=300):
+            view_reads.extend([bytes(line) for line in read] for read in block)
+        self.assertEqual(view_reads, bin_reads)
+        fqra = ngs.FastqRandomAccess(in_file, use_mmap=True)
+        self.assertEqual(fqra.get(999), reads[999])
+        self.assertEqual(fqra.get(0), reads[0])
+
+    def testBinaryMode(self):
+        reads = list(ngs.FastqReader(in_file))
+        bin_reads = list(ngs.FastqReader(in_file, binary=True))
+        self.assertEqual(
+            bin_reads,
+            [[line.encode("ascii") for line in read] for read in reads]
+        )
+        # Text and binary mode must read compressed files the same way
+        writer = ngs.FastqWriter(out_dir + "binary.fastq.gz", binary=True)
+        for block in ngs.FastqReader(in_file, binary=True).iter_blocks():
+            writer.write_block(block)
+        writer.close()
+        self.assertEqual(list(ngs.FastqReader(out_dir + "binary.fastq.gz")),
+                         reads)
+        qf = qfil.QualFilter(
+            in_file,
+            out_dir + "qf_binary.fastq",
+            qual_threshold=20,
+            qual_offset=33,
+            binary=True
+        )
+        qf.run()
+        self.assertEqual(qf.stats["writer"]["num_reads"], 996)
+
+    def testThreadedGzip(self):
+        reads = list(ngs.FastqReader(in_file))
+        gz_file = out_dir + "threaded.fastq.gz"
+        writer = ngs.FastqWriter(gz_file, threads=3, compression_level=1)
+        for block in ngs.FastqReader(in_file).iter_blocks(n_records=100):
+            writer.write_block(block)
+        writer.close()
+        # Both the standard library and the threaded reader must read it
+        self.assertEqual(list(ngs.FastqReader(gz_file)), reads)
+        self.assertEqual(list(ngs.FastqReader(gz_file, threads=2)), reads)
+        # Files of many gzip members, as written from many threads
+        with open(in_file, "rb") as fh:
+            data = fh.read()
+        with open(gz_file, "wb") as fh:
+            for start in range(0, len(data), 4096):
+                fh.write(_compression.compress_member(
+                    data[start:start + 4096],
+                    6
+                ))
+        self.assertEqual(list(ngs.FastqReader(gz_file)), reads)
+        self.assertEqual(list(ngs.FastqReader(gz_file, threads=2)), reads)
+
+    def testFastqRandomAccess(self):
+        reads = list(ngs.FastqReader(in_file))
+        fqra = ngs.FastqRandomAccess(in_file)
+        self.assertEqual(len(fqra), 1000)
+        for index in (0, 1, 517, 999):
+            self.assertEqual(fqra.get(index), reads[index])
+
+    def testPersistentIndex(self):
+        reads = list(ngs.FastqReader(in_file))
+        index_file = out_dir + "test.fastq.fqi"
+        if os.path.exists(index_file):
+            os.remove(index_file)
+        fqra = ngs.FastqRandomAccess(
+            in_file,
+            persist_index=True,
+            index_file_name=index_file,
+            index_lengths=True,
+        )
+        self.assertIsNone(fqra._index_map)
+        self.assertTrue(os.path.exists(index_file))
+        fqra.close()
+        # The saved index is mapped, not rebuilt
+        fqra = ngs.FastqRandomAccess(
+            in_file,
+            persist_index=True,
+            index_file_name=index_file,
+        )
+        self.assertIsNotNone(fqra._index_map)
+        self.assertEqual(len(fqra), 1000)
+        self.assertEqual(fqra.get(999), reads[999])
+        self.assertEqual(fqra.record_lengths[999], len(reads[999][1]))
+        fqra.close()
+        # Asking for more than was indexed rebuilds the index
+        fqra = ngs.FastqRandomAccess(
+            in_file,
+            persist_index=True,
+            index_file_name=index_file,
+            index_names=True,
+        )
+        self.assertIsNone(fqra._index_map)
+        fqra.close()
+        # As does a change to the fastq file's modification time
+        with open(index_file, "r+b") as fh:
+            fh.seek(16)  # Source file mtime
+            fh.write(b"\0" * 8)
+        fqra = ngs.FastqRandomAccess(
+            in_file,
+            persist_index=True,
+            index_file_name=index_file,
+        )
+        self.assertIsNone(fqra._index_map)
+        self.assertEqual(fqra.get(0), reads[0])
+        fqra.close()
+
+    def testNameLookup(self):
+        reads = list(ngs.FastqReader(in_file))
+        names = [ngs.read_name(read[0]) for read in reads]
+        index_file = out_dir + "names.fastq.fqi"
+        for iii in range(2):
+            # First built in memory, then loaded from the index file
+            fqra = ngs.FastqRandomAccess(
+                in_file,
+                persist_index=True,
+                index_file_name=index_file,
+                index_names=True,
+            )
+            self.assertEqual(fqra.get_by_name(names[421]), reads[421])
+            self.assertEqual(fqra.get_by_name("@" + names[7]), reads[7])
+            wanted = [990, 3, 500, 3]
+            self.assertEqual(
+                fqra.get_many([names[iii] for iii in wanted]),
+                [reads[iii] for iii in wanted]
+            )
+            self.assertRaises(KeyError, fqra.get_by_name, "not_a_read")
+            self.assertRaises(KeyError, fqra.get_many,
+                              [names[3], "not_a_read"])
+            fqra.close()
+        os.remove(index_file)
+        # Reads are fetched in one forward pass, with one seek each
+        fqra = ngs.FastqRandomAccess(in_file, index_names=True)
+        order = sorted(range(1000), key=fqra.name_hashes.__getitem__)
+        self.assertEqual(list(fqra.name_order), order)
+        # As sorted in chunks
+        sort_chunk = ngs.NAME_SORT_CHUNK
+        ngs.NAME_SORT_CHUNK = 300
+        try:
+            fqra._build_name_index()
+        finally:
+            ngs.NAME_SORT_CHUNK = sort_chunk
+        self.assertEqual(list(fqra.name_order), order)
+        self.assertEqual(list(fqra.sorted_name_hashes),
+                         sorted(fqra.name_hashes))
+        seeks = []
+        seek = fqra._seek
+        fqra._seek = lambda position: seeks.append(position) or seek(position)
+        fqra.get_many([names[iii] for iii in wanted])
+        self.assertEqual(seeks, sorted(seeks))
+        self.assertEqual(len(seeks), len(wanted))
+        # Reads whose name hashes collide are told apart by their names
+        name_hash = ngs.name_hash
+        ngs.name_hash = lambda name: 0
+        try:
+            fqra = ngs.FastqRandomAccess(in_file, index_names=True)
+            self.assertEqual(
+                fqra.get_many([names[iii] for iii in wanted]),
+                [reads[iii] for iii in wanted]
+            )
+            self.assertEqual(fqra.get_by_name(names[421]), reads[421])
+        finally:
+            ngs.name_hash = name_hash
+
+    def testBgzfRandomAccess(self):
+        reads = list(ngs.FastqReader(in_file))
+        bgz_file = out_dir + "bgzf.fastq.gz"
+        writer = ngs.FastqWriter(bgz_file, compression=ngs.BGZIPPED)
+        # Write enough to need several BGZF blocks
+        for iii in range(3):
+            for block in ngs.FastqReader(in_file).iter_blocks():
+                writer.write_block(block)
+        writer.close()
+        self.assertEqual(list(ngs.FastqReader(bgz_file)), reads * 3)
+        fqra = ngs.FastqRandomAccess(bgz_file)
+        self.assertTrue(fqra.bgzf)
+        self.assertEqual(len(fqra), 3000)
+        for index in (2999, 0, 1234, 1000, 2001):
+            self.assertEqual(fqra.get(index), reads[index % 1000])
+
+    def testShardedRun(self):
+        reads = list(ngs.FastqReader(in_file))
+        shards = ngs.plan_shards(in_file, 7)
+        self.assertEqual(len(shards), 7)
+        shard_reads = []
+        for shard in shards:
+            shard_reads.extend(ngs.FastqShardReader(in_file, shard))
+        self.assertEqual(shard_reads, reads)
+        qf = qfil.QualFilter(
+            in_file,
+            out_dir + "qf_sharded.fastq",
+            qual_threshold=20,
+            qual_offset=33,
+            pass_rate=0.9,
+            max_Ns=-1,
+        )
+        self.assertEqual(qf.run_sharded(num_shards=3), (1000, 996))
+        passed = [read for read in reads if qf.filter_read(read)]
+        self.assertEqual(list(ngs.FastqReader(out_dir + "qf_sharded.fastq")),
+                         passed)
+        qs = qstat.QualStats(in_file, qual_offset=33)
+        qs.run_sharded(num_shards=3)
+        self.assertEqual(qs.stats["reader"]["num_reads"], 1000)
+        self.assertEqual(qs.stats["positions"], EXPECTED_QUALSTATS_POSITIONS)
+        # BGZF files are split at block boundaries
+        bgz_file = out_dir + "sharded.fastq.bgz"
+        writer = ngs.FastqWriter(bgz_file)
+        for iii in range(3):
+            for block in ngs.FastqReader(in_file).iter_blocks():
+                writer.write_block(block)
+        writer.close()
+        self.assertTrue(len(ngs.plan_shards(bgz_file, 3)) > 1)
+        ht = htrim.HardTrimmer(bgz_file, out_dir + "ht_sharded.fastq.bgz",
+                               length=30)
+        ht.run_sharded(num_shards=3)
+        self.assertEqual(ht.stats["writer"]["num_reads"], 3000)
+        trimmed = list(ngs.FastqReader(out_dir + "ht_sharded.fastq.bgz"))
+        # Only the last shard's EOF marker is kept
+        with open(out_dir + "ht_sharded.fastq.bgz", "rb") as fh:
+            data = fh.read()
+        self.assertEqual(data.count(_compression.BGZF_EOF), 1)
+        self.assertTrue(data.endswith(_compression.BGZF_EOF))
+        self.assertEqual(trimmed, [ht.trim_read(read) for read in reads] * 3)
+
     def testQualFilterParallel(self):
         qf = qfil.QualFilter(
             in_file,
@@ -56,7 +304,22 @@ class Tester(unittest.TestCase):
             pass_rate=0.9,
             max_Ns=-1,
         )
-        qf.run_parallel()
+        qf.run_parallel(chunk_size=100, num_procs=2)
+        self.assertEqual(qf.stats["reader"]["num_reads"], 1000)
+        self.assertEqual(qf.stats["runner"]["num_reads"], 996)
+        self.assertEqual(qf.stats["writer"]["num_reads"], 996)
+        self.assertEqual(qf.stats["rejected"], {"pass_rate": 4})
+
+    def testParallelRunnerOptions(self):
+        qf = qfil.QualFilter(
+            in_file,
+            out_dir + "qf_chunked.fastq",
+            qual_threshold=20,
+            qual_offset=33,
+            pass_rate=0.9,
+            max_Ns=-1,
+        )
+        qf.run_parallel(chunk_size=64, num_procs=2, queue_depth=2)
         self.assertEqual(qf.stats["reader"]["num_reads"], 1000)
         self.assertEqual(qf.stats["runner"]["num_reads"], 996)
 
@@ -73,6 +336,57 @@ class Tester(unittest.TestCase):
         self.assertEqual(qf.stats["reader"]["num_reads"], 1000)
         self.assertEqual(qf.stats["writer"]["num_reads"], 996)
 
+    def testQualFilterTable(self):
+        qf = qfil.QualFilter(in_file, out_dir + "qf_table.fastq",
+                             qual_threshold=20, qual_offset=33, pass_rate=0.5)
+        # Long reads are counted in segments, and may fail early
+        for num_low in (0, 149, 150, 151, 300):
+            qual = "+" * num_low + "I" * (300 - num_low)
+            read = ["@r", "A" * 300, "+", qual]
+            self.assertEqual(bool(qf.filter_read(read)), num_low < 150)
+            read = [line.encode() for line in read]
+            self.assertEqual(bool(qf.filter_read(read)), num_low < 150)
+        with self.assertRaises(ValueError):
+            qf.filter_read(["@r", "AAAA", "+", "II I"])
+
+    def testReadFilters(self):
+        reads = list(ngs.FastqReader(in_file))
+        read_filters = [
+            filters.DustFilter(4),
+            filters.LengthFilter(min_length=32),
+            filters.GCFilter(0.3, 0.6),
+            filters.HomopolymerFilter(6),
+            filters.EntropyFilter(1.5),
+            filters.ExpectedErrorsFilter(1, 33),
+            filters.MeanQualityFilter(30, 33),
+        ]
+        qf = qfil.QualFilter(in_file, out_dir + "qf_filters.fastq",
+                             qual_threshold=20, qual_offset=33,
+                             filters=read_filters)
+        qf.chain.reorder_interval = 100
+        num_read, num_written = qf.run()
+        self.assertEqual(num_read, 1000)
+        self.assertEqual(num_read - num_written,
+                         sum(qf.stats["rejected"].values()))
+        self.assertEqual(qf.stats["rejected"]["length"], 33)
+        # The cheapest and most selective filters end up first
+        self.assertEqual(qf.chain.filters[0].name, "length")
+        # As in each chunk of a parallel run, though chunks are shorter than
+        # reorder_interval
+        block = ngs.FastqBlock()
+        for read in reads:
+            block.append(read)
+        task = qfil.QualFilterTask(block, 0.0, 20, 33, -1,
+                                   [filters.LengthFilter(min_length=0),
+                                    filters.MeanQualityFilter(36, 33)],
+                                   True)
+        task()
+        self.assertEqual(task.chain.filters[0].name, "mean_quality")
+        self.assertFalse(read_filters[3].passes(b"ACGTTTTTTTA", b""))
+        self.assertTrue(read_filters[3].passes(b"ACGTTTTTTA", b""))
+        self.assertFalse(read_filters[0].passes(b"CA" * 20, b""))
+        self.assertTrue(read_filters[0].passes(reads[0][1].encode(), b""))
+
     def testCollapser(self):
         co = col.Collapser(
             in_file,
@@ -94,6 +408,100 @@ class Tester(unittest.TestCase):
         self.assertEqual(qt.stats["reader"]["num_reads"], 1000)
         self.assertEqual(qt.stats["runner"]["num_reads"], 1000)
 
+    def testQualTrimmerModes(self):
+        # With an offset of 33 and threshold of 20, "+" is low and "I" high
+        qual = "++I+IIIIII+I++"
+        cases = [
+            (ngs.TRIM_TRAILING, False, (0, 12)),
+            (ngs.TRIM_LEADING_TRAILING, False, (2, 12)),
+            (ngs.TRIM_MOTT, False, (0, 12)),
+            (ngs.TRIM_SLIDING_WINDOW, False, (0, 0)),
+            (ngs.TRIM_TRAILING, True, (0, 10)),
+        ]
+        for mode, remove_Ns, positions in cases:
+            qt = qtrim.QualTrimmer(in_file, out_dir + "qt_modes.fastq",
+                                   qual_threshold=20, qual_offset=33,
+                                   min_length=5, mode=mode,
+                                   remove_trailing_Ns=remove_Ns)
+            self.assertEqual(qt.cut_positions(["@r", "ACGTACGTACNNAC", "+",
+                                               qual]), positions)
+        qt.mode = ngs.TRIM_SLIDING_WINDOW
+        # Good bases at the start of the first failing window are kept
+        self.assertEqual(qt.cut_positions(["@r", "A" * 12, "+",
+                                           "IIIIII++++II"]), (0, 6))
+        qt.mode = ngs.TRIM_MOTT
+        # An interior low base does not shorten the read on its own
+        read = qt.trim_read(["@r", "ACGTAC", "+", b"II+III"])
+        self.assertEqual(read[3], b"II+III")
+        self.assertEqual(qt.cut_positions(["@r", "ACGTAC", "+", b"III+++"]),
+                         (0, 3))
+        # Too short once trimmed
+        self.assertEqual(qt.trim_read(["@r", "ACGTAC", "+", b"III+++"]), ())
+
+    def testAdapterTrimmer(self):
+        adapter = "AGATCGGAAGAGCACACGTC"
+        matcher = atrim.AdapterMatcher([adapter, "CTGTCTCTTATACACATCT"])
+        insert = "TTGACCATGAGGTCAGTACA"
+        cases = [
+            (insert + adapter + "ACGTA", (20, 0)),
+            (insert + "AGATCGTAAGAGCACACGTC", (20, 0)),  # One mismatch
+            (insert + "AGATCGG", (20, 0)),  # Partial, at the 3' end
+            (insert + "AG", None),  # Shorter than min_overlap
+            (insert + "CTGTCTCTTATAC", (20, 1)),
+            (insert, None),
+        ]
+        for seq, match in cases:
+            self.assertEqual(matcher.find(seq), match)
+        # IUPAC codes in adapters, and Ns in reads
+        matcher = atrim.AdapterMatcher(["AGATCGGAAGAGCRCACGTC"])
+        self.assertEqual(matcher.find(insert + adapter), (20, 0))
+        self.assertEqual(matcher.find(insert + "AGATCGGNAGAG"), (20, 0))
+        # The index finds every match a check of each position would
+        rand = random.Random(42)
+        for _ in range(200):
+            seq = bytearray(rand.choice(b"ACGT") for _ in range(100))
+            pos = rand.randint(0, 100)
+            seq[pos:pos + len(adapter)] = adapter.encode()
+            seq[rand.randrange(len(seq))] = ord(rand.choice("ACGT"))
+            seq = bytes(seq[:100])
+            expected = None
+            for iii in range(len(seq)):
+                if matcher.matches_at(0, seq, iii):
+                    expected = (iii, 0)
+                    break
+            self.assertEqual(matcher.find(seq), expected)
+        at = atrim.AdapterTrimmer(in_file, out_dir + "at.fastq", [adapter],
+                                  min_length=10)
+        at.run()
+        self.assertEqual(at.stats["reader"]["num_reads"], 1000)
+        adapter_counts = dict(at.stats["adapters"])
+        # Workers build each matcher once, and keep only the most recently
+        # used
+        self.assertIs(atrim._get_matcher((adapter,), 0.1, 3, True),
+                      at.matcher)
+        for iii in range(atrim.MATCHER_CACHE_SIZE + 1):
+            atrim._get_matcher((adapter,), 0.1, iii + 4, True)
+        self.assertEqual(atrim._get_matcher.cache_info().currsize,
+                         atrim.MATCHER_CACHE_SIZE)
+        # Each trimmer keeps its own counts
+        other = atrim.AdapterTrimmer(in_file, out_dir + "at_other.fastq",
+                                     ["CTGTCTCTTATACACATCT"])
+        self.assertEqual(at.stats["adapters"], adapter_counts)
+        other.run()
+        self.assertEqual(list(other.stats["adapters"]),
+                         ["CTGTCTCTTATACACATCT"])
+        self.assertEqual(at.stats["adapters"], adapter_counts)
+        num_written = at.stats["writer"]["num_reads"]
+        at = atrim.AdapterTrimmer(in_file, out_dir + "at_parallel.fastq",
+                                  [adapter], min_length=10)
+        at.run_parallel(chunk_size=100, num_procs=2)
+        self.assertEqual(at.stats["adapters"], adapter_counts)
+        self.assertEqual(at.stats["writer"]["num_reads"], num_written)
+        read = at.trim_read(["@r", insert + adapter, "+", "I" * 40])
+        self.assertEqual(read[1:], [insert, "+", "I" * 20])
+        self.assertEqual(at.trim_read(["@r", "ACGT" + adapter, "+",
+                                       "I" * 24]), ())
+
     def testQualTrimmer(self):
         qt = qtrim.QualTrimmer(
             in_file,
@@ -111,14 +519,179 @@ class Tester(unittest.TestCase):
         bc.run_parallel()
         self.assertEqual(bc.stats["runner"]["barcode_counts"],
                          EXPECTED_BARCODE_COUNTS)
+        self.assertEqual(bc.stats["writer"]["barcode_counts"],
+                         EXPECTED_BARCODE_COUNTS)
+        self.assertEqual(bc.stats["writer"]["num_reads"], 994)
+        self.assertEqual(bc.stats["writer"][bcs.UNMATCHED], 6)
 
     def testBarcodeSplitter(self):
+        if os.path.exists(out_dir + "test_RPI9.fastq"):
+            os.remove(out_dir + "test_RPI9.fastq")
         bc = bcs.BarcodeSplitter(in_file, out_dir, prefix + "barcodes.csv")
         bc.run()
         self.assertEqual(bc.stats["reader"]["num_reads"], 1000)
         self.assertEqual(bc.stats["writer"]["num_reads"], 994)
         self.assertEqual(bc.stats["writer"]["barcode_counts"],
                          EXPECTED_BARCODE_COUNTS)
+        # run() leaves no reads buffered by the writer
+        with open(out_dir + "test_RPI9.fastq") as fh:
+            self.assertEqual(len(fh.readlines()),
+                             4 * EXPECTED_BARCODE_COUNTS["CACGATCAGATC"])
+
+    def testBarcodeIndex(self):
+        index = bcs.BarcodeIndex(["AAAA", "AACC", "GGGGGG"], mismatches=1)
+        self.assertEqual(index.lookup("AAAATTT"), ("AAAA", 0))
+        self.assertEqual(index.lookup("AAGATTT"), ("AAAA", 1))
+        self.assertEqual(index.lookup("GGGTGGAA"), ("GGGGGG", 1))
+        self.assertEqual(index.lookup("TTTTTTT"), None)
+        self.assertEqual(index.lookup("AAA"), None)
+        # Equally close to AAAA and AACC
+        self.assertEqual(index.lookup("AACATTT"), (None, 1))
+        self.assertEqual(index.collisions, set([("AAAA", "AACC")]))
+        index = bcs.BarcodeIndex(["AAAA", "AAAATT"], binary=True)
+        self.assertEqual(index.lookup(b"AAAATTGC"), ("AAAATT", 0))
+        self.assertEqual(index.lookup(b"AAAAGG"), ("AAAA", 0))
+        # Indices are sent to workers by their arguments, and each process
+        # keeps only the most recently used
+        copy = pickle.loads(pickle.dumps(index))
+        self.assertEqual(copy.lookup(b"AAAATTGC"), ("AAAATT", 0))
+        self.assertIs(pickle.loads(pickle.dumps(index)), copy)
+        for iii in range(bcs.INDEX_CACHE_SIZE + 1):
+            bcs._get_index(("AAAA",), iii, False)
+        self.assertEqual(bcs._get_index.cache_info().currsize,
+                         bcs.INDEX_CACHE_SIZE)
+        bc = bcs.BarcodeSplitter(in_file, out_dir, prefix + "barcodes.csv",
+                                 mismatches=1)
+        bc.run_parallel()
+        self.assertEqual(bc.stats["runner"]["num_reads"],
+                         sum(bc.stats["runner"]["barcode_counts"].values()))
+
+    def testDualBarcodeSplitter(self):
+        with open(out_dir + "dual_barcodes.csv", "w") as fh:
+            fh.write("AAAA+CCCC,s1\nAAAA+GGGG,s2\nTTTT+GGGG,s3\n")
+        seqs = [
+            "AAAAACGTACGTCCCC",  # s1
+            "AAATACGTACGTGGGG",  # s2, with one mismatch
+            "TTTTACGTACGTCCCC",  # TTTT+CCCC is not listed
+            "ACACACGTACGTACAC",  # Neither half
+        ]
+        with open(out_dir + "dual.fastq", "w") as fh:
+            for iii, seq in enumerate(seqs):
+                fh.write("@r%i\n%s\n+\n%s\n" % (iii, seq, "I" * len(seq)))
+        bc = bcs.BarcodeSplitter(out_dir + "dual.fastq", out_dir,
+                                 out_dir + "dual_barcodes.csv",
+                                 barcode_end=bcs.FORWARD_AND_REVERSE,
+                                 mismatches=1, write_unassigned=True)
+        bc.run()
+        stats = bc.stats["writer"]
+        self.assertEqual(stats["barcode_counts"], {"AAAA+CCCC": 1,
+                                                   "AAAA+GGGG": 1})
+        self.assertEqual(stats["mismatch_counts"]["AAAA+GGGG"], [0, 1])
+        self.assertEqual(stats[bcs.UNMATCHED], 2)
+        with open(out_dir + "dual_s1.fastq") as fh:
+            self.assertEqual(fh.read().split("\n")[1], "ACGTACGT")
+        with open(out_dir + "dual_unmatched.fastq") as fh:
+            self.assertEqual(len(fh.read().split("\n")), 9)
+        # Barcodes at the 3' end, or either end
+        with open(out_dir + "end_barcodes.csv", "w") as fh:
+            fh.write("AAAA,s1\nCCCC,s2\n")
+        bc = bcs.BarcodeSplitter(out_dir + "dual.fastq", out_dir,
+                                 out_dir + "end_barcodes.csv",
+                                 barcode_end=bcs.FORWARD_OR_REVERSE)
+        self.assertEqual(bc._match("AAAAGTCCCC"), (bcs.AMBIGUOUS, 0, 0, 10))
+        self.assertEqual(bc._match("AAAAGTCCCA"), ("AAAA", 0, 4, 10))
+        self.assertEqual(bc._match("GTGTGTCCCC"), ("CCCC", 0, 0, 6))
+        bc.barcode_end = bcs.REVERSE_ONLY
+        self.assertEqual(bc._match("AAAAGTCCCA"), (bcs.UNMATCHED, None, 0,
+                                                   10))
+
+    def testFastqWriterPool(self):
+        reads = list(ngs.FastqReader(in_file))
+        names = [out_dir + "pool_%i.fastq%s" % (iii, ext)
+                 for iii, ext in enumerate(["", ".gz", ".bgz", ".bz2"])]
+        # Small buffers and few handles, so files are reopened many times
+        pool = ngs.FastqWriterPool(threads=2, buffer_size=500,
+                                   max_buffered=1500, max_open=2)
+        for iii, read in enumerate(reads):
+            pool.write(names[iii % 4], read)
+        pool.close()
+        self.assertEqual(pool.stats["num_files"], 4)
+        for iii, name in enumerate(names):
+            self.assertEqual(list(ngs.FastqReader(name)), reads[iii::4])
+        self.assertTrue(_compression.is_bgzf(names[2]))
+
+    def testPairedBarcodeSplitter(self):
+        reads = list(ngs.FastqReader(in_file))
+        names = dict((end, out_dir + "paired_%s.fastq" % end)
+                     for end in ("R1", "R2", "I1", "I2"))
+        with open(names["R1"], "w") as r1, open(names["R2"], "w") as r2, \
+                open(names["I1"], "w") as i1, open(names["I2"], "w") as i2:
+            for read in reads:
+                r1.write("\n".join(read) + "\n")
+                # Read 2 is read 1 reversed, with its barcode moved to I1
+                r2.write("%s\n%s\n+\n%s\n" % (read[0], read[1][::-1],
+                                                read[3][::-1]))
+                i1.write("%s\n%s\n+\n%s\n" % (read[0], read[1][:12],
+                                                read[3][:12]))
+                i2.write("%s\n%s\n+\n%s\n" % (read[0], "ACGTAC",
+                                                "I" * 6))
+        # Inline barcodes in read 1
+        bc = bcs.PairedBarcodeSplitter(names["R1"], names["R2"], out_dir,
+                                       prefix + "barcodes.csv")
+        bc.run()
+        self.assertEqual(bc.stats["reader"]["num_reads"], 1000)
+        self.assertEqual(bc.stats["writer"]["barcode_counts"],
+                         EXPECTED_BARCODE_COUNTS)
+        with open(out_dir + "paired_R1_RPI9.fastq") as fh:
+            lines_1 = fh.read().split("\n")
+        with open(out_dir + "paired_R2_RPI9.fastq") as fh:
+            lines_2 = fh.read().split("\n")
+        self.assertEqual(lines_1[0], lines_2[0])
+        self.assertEqual(lines_1[1], lines_2[1][::-1][12:])
+        # Barcodes in the first index read, in parallel
+        bc = bcs.PairedBarcodeSplitter(names["R1"], names["R2"], out_dir,
+                                       prefix + "barcodes.csv",
+                                       index_1_file_name=names["I1"])
+        bc.run_parallel(chunk_size=100)
+        self.assertEqual(bc.stats["runner"]["barcode_counts"],
+                         EXPECTED_BARCODE_COUNTS)
+        self.assertEqual(bc.stats["writer"]["barcode_counts"],
+                         EXPECTED_BARCODE_COUNTS)
+        self.assertEqual(bc.stats["writer"][bcs.UNMATCHED], 6)
+        with open(out_dir + "paired_R1_RPI9.fastq") as fh:
+            self.assertEqual(len(fh.read().split("\n")[1]), 33)
+        # Dual index barcodes
+        with open(out_dir + "dual_index.csv", "w") as fh:
+            fh.write("CACGATCAGATC+ACGTAC,RPI9\n")
+        bc = bcs.PairedBarcodeSplitter(names["R1"], names["R2"], out_dir,
+                                       out_dir + "dual_index.csv",
+                                       index_1_file_name=names["I1"],
+                                       index_2_file_name=names["I2"])
+        bc.run()
+        self.assertEqual(bc.stats["writer"]["barcode_counts"],
+                         {"CACGATCAGATC+ACGTAC":
+                          EXPECTED_BARCODE_COUNTS["CACGATCAGATC"]})
+        # Mate suffixes are not part of the names compared
+        with open(names["R1"], "w") as r1, open(names["R2"], "w") as r2:
+            for read in reads:
+                name, comment = read[0].split(" ", 1)
+                r1.write("%s/1 %s\n%s\n+\n%s\n" % (name, comment, read[1],
+                                                     read[3]))
+                r2.write("%s/2 %s\n%s\n+\n%s\n" % (name, comment, read[1],
+                                                     read[3]))
+        bc = bcs.PairedBarcodeSplitter(names["R1"], names["R2"], out_dir,
+                                       prefix + "barcodes.csv")
+        bc.run()
+        self.assertEqual(bc.stats["writer"]["barcode_counts"],
+                         EXPECTED_BARCODE_COUNTS)
+        self.assertEqual(ngs.mate_name(b"@r1/2 x"), b"r1")
+        # Mates out of sync
+        with open(names["R2"], "w") as r2:
+            for read in reads[1:] + reads[:1]:
+                r2.write("\n".join(read) + "\n")
+        bc = bcs.PairedBarcodeSplitter(names["R1"], names["R2"], out_dir,
+                                       prefix + "barcodes.csv")
+        self.assertRaises(ValueError, bc.run)
 
     def testHardTrimmer(self):
         ht = htrim.HardTrimmer(in_file, out_dir + "ht.fastq", length=30)
@@ -126,18 +699,207 @@ class Tester(unittest.TestCase):
         self.assertEqual(ht.stats["reader"]["num_reads"], 1000)
         self.assertEqual(ht.stats["writer"]["num_reads"], 1000)
 
+    def testOrderedParallel(self):
+        ht = htrim.HardTrimmer(in_file, out_dir + "ht_serial.fastq", length=30)
+        ht.run()
+        ht.writer.close()
+        ht = htrim.HardTrimmer(in_file, out_dir + "ht_ordered.fastq", length=30)
+        ht.run_parallel(chunk_size=10, num_procs=3, ordered=True)
+        self.assertEqual(ht.stats["runner"]["num_reads"], 1000)
+        with open(out_dir + "ht_serial.fastq") as fh:
+            serial = fh.read()
+        with open(out_dir + "ht_ordered.fastq") as fh:
+            self.assertEqual(fh.read(), serial)
+
     def testHardTrimmerParallel(self):
         ht = htrim.HardTrimmer(in_file, out_dir + "ht.fastq", length=30)
         ht.run_parallel()
         self.assertEqual(ht.stats["reader"]["num_reads"], 1000)
         self.assertEqual(ht.stats["runner"]["num_reads"], 1000)
 
+    def testThreadedGzipParallel(self):
+        out_file = out_dir + "ht_threaded.fastq.gz"
+        ht = htrim.HardTrimmer(in_file, out_file, length=30, threads=2)
+        ht.run_parallel(chunk_size=100, num_procs=2)
+        self.assertEqual(ht.stats["runner"]["num_reads"], 1000)
+        reader = ngs.FastqReader(out_file)
+        self.assertEqual(sum(1 for read in reader), 1000)
+
     def testQualStats(self):
         qs = qstat.QualStats(in_file, qual_offset=33)
         qs.run()
         self.assertEqual(qs.stats["reader"]["num_reads"], 1000)
         self.assertEqual(qs.stats["positions"], EXPECTED_QUALSTATS_POSITIONS)
 
+    def testPercentiles(self):
+        cases = [
+            ([0, 0, 3, 0, 1], (2.0, 2.0, 2.5)),
+            ([2, 2], (0.0, 0.5, 1.0)),
+            ([1], (0.0, 0.0, 0.0)),
+            ([0, 1], (0.0, 0.0, 1.0)),
+            ([5, 0, 0, 4, 1, 0], (0.0, 0.5, 3.0)),
+            ([0, 0, 0, 7, 0, 0, 2], (3.0, 3.0, 3.0)),
+        ]
+        for counts, quartiles in cases:
+            self.assertEqual(ngs.quartiles_from_counts(counts), quartiles)
+            self.assertEqual(ngs.percentile_from_counts(counts, 0.5),
+                             quartiles[1])
+        self.assertEqual(ngs.whiskers_from_counts([5, 0, 0, 4, 1, 0]),
+                         (-4.0, 5.0))
+
+    def testCycleCounts(self):
+        qs = qstat.QualStats(in_file, qual_offset=33)
+        block = ngs.FastqReader(in_file, binary=True).read_block(1000)
+        # Reads of differing lengths are counted up to their own length
+        seqs = [seq[:iii % 7 + 20] for iii, seq in enumerate(block.seqs)]
+        quals = [qual[:iii % 7 + 20] for iii, qual in enumerate(block.quals)]
+        positions = []
+        for use_numpy in (False, qstat.np is not None):
+            # Storage grows past any reserved cycles as needed
+            counts = qstat.CycleCounts(use_numpy=use_numpy, reserve_cycles=8)
+            counts.add_block(seqs[:500], quals[:500])
+            counts.add_block(seqs[500:], quals[500:])
+            positions.append(counts.positions(qs.initial_dict, 33))
+        self.assertEqual(positions[0], positions[1])
+        self.assertEqual(len(positions[0]), 26)
+        self.assertEqual(sum(positions[0][25]["bases"].values()), 142)
+
+    def testQualStatsParallel(self):
+        qs = qstat.QualStats(in_file, qual_offset=33)
+        qs.run_parallel(chunk_size=100, num_procs=2)
+        self.assertEqual(qs.stats["runner"]["num_reads"], 1000)
+        self.assertEqual(qs.stats["positions"], EXPECTED_QUALSTATS_POSITIONS)
+
+    def testSampledQualStats(self):
+        qs = qstat.QualStats(in_file, qual_offset=33, sample_every=3)
+        qs.run()
+        self.assertEqual(qs.num_reads, 1000)
+        self.assertEqual(qs.stats["num_sampled_reads"], 334)
+        positions = qs.stats["positions"]
+        # Strides continue across blocks
+        qs = qstat.QualStats(in_file, qual_offset=33, sample_every=3)
+        for block in qs.reader.iter_blocks(n_records=100):
+            qs._process_block(block)
+        self.assertEqual(qs.counts.num_reads, 334)
+        # And parallel runs sample the same reads
+        qs = qstat.QualStats(in_file, qual_offset=33, sample_every=3)
+        qs.run_parallel(chunk_size=100, num_procs=2)
+        self.assertEqual(qs.stats["num_sampled_reads"], 334)
+        self.assertEqual(qs.stats["positions"], positions)
+        qs = qstat.QualStats(in_file, qual_offset=33, tolerance=100,
+                             check_interval=200)
+        qs.run()
+        self.assertTrue(qs.stats["stopped_early"])
+        self.assertEqual(qs.stats["num_sampled_reads"], 400)
+        qs = qstat.QualStats(in_file, qual_offset=33, tolerance=0,
+                             check_interval=200)
+        qs.run()
+        self.assertFalse(qs.stats["stopped_early"])
+        self.assertEqual(qs.stats["positions"], EXPECTED_QUALSTATS_POSITIONS)
+
+    def testQualStatsReadModules(self):
+        qs = qstat.QualStats(in_file, qual_offset=33, read_stats=True)
+        qs.run()
+        reads = qs.stats["reads"]
+        self.assertEqual(reads["length"],
+                         {25: 1, 29: 1, 30: 2, 31: 29, 32: 539, 33: 428})
+        self.assertEqual(sum(reads["mean_quality"].values()), 1000)
+        self.assertEqual(sum(reads["gc"].values()), 1000)
+        # As found by the Collapser
+        self.assertEqual(reads["duplication_levels"], {1: 985, 2: 6, 3: 1})
+        self.assertAlmostEqual(
+            reads["percent_remaining_if_deduplicated"],
+            99.2
+        )
+        self.assertEqual(reads["overrepresented"][0],
+                         ("CACACTTGAATCGTTTGTTAGACTCTTCGATTT", 3, 0.3))
+        # Only the first max_tracked sequences are tracked
+        qs = qstat.QualStats(in_file, qual_offset=33, read_stats=True,
+                             max_tracked=10, binary=True)
+        qs.run_parallel(chunk_size=100, num_procs=2)
+        self.assertEqual(len(qs.read_counts.sequences), 10)
+        # The first sequences of the input, whatever order chunks finish in
+        serial = qstat.ReadCounts(33, max_tracked=10)
+        answers = []
+        for block in ngs.FastqReader(in_file).iter_blocks(n_records=100):
+            serial.add_block(block.seqs, block.quals)
+            answers.append(qstat._QualStatsTask(block, len(answers) * 100,
+                                                False, 1, 33, 10)())
+        self.assertEqual(set(qs.read_counts.sequences), set(serial.sequences))
+        for order in (answers, answers[::-1]):
+            writer = qstat._CycleCountsWriter(qstat.CycleCounts(False),
+                                              qstat.ReadCounts(33, 10))
+            for answer in order:
+                writer.write_block(answer)
+            self.assertEqual(writer.stats["read_counts"].sequences,
+                             qs.read_counts.sequences)
+        self.assertEqual(qs.stats["reads"]["length"], reads["length"])
+        data = json.loads(json.dumps(qs.read_counts.to_dict()))
+        self.assertEqual(qstat.ReadCounts.from_dict(data).summary(),
+                         qs.stats["reads"])
+
+    def testMergeQualStats(self):
+        # Counts of separate runs, e.g. of lanes, reduce to those of one run
+        lanes = []
+        for block in ngs.FastqReader(in_file).iter_blocks(n_records=300):
+            counts = qstat.CycleCounts()
+            counts.add_block(block.seqs, block.quals)
+            lanes.append(json.loads(json.dumps(counts.to_dict())))
+        qs = qstat.QualStats(None, qual_offset=33)
+        for data in lanes:
+            qs.merge_counts(qstat.CycleCounts.from_dict(data, use_numpy=False))
+        self.assertEqual(qs.num_reads, 1000)
+        self.assertEqual(qs.stats["positions"], EXPECTED_QUALSTATS_POSITIONS)
+
+    def testPipeline(self):
+        # Trimming then filtering in separate passes
+        ht = htrim.HardTrimmer(in_file, out_dir + "pipe_ht.fastq", length=30)
+        ht.run()
+        ht.writer.close()
+        qf = qfil.QualFilter(out_dir + "pipe_ht.fastq",
+                             out_dir + "pipe_qf.fastq", qual_threshold=20,
+                             qual_offset=33, pass_rate=0.9)
+        qf.run()
+        qf.writer.close()
+        with open(out_dir + "pipe_qf.fastq") as fh:
+            expected = fh.read()
+        for parallel in (False, True):
+            pl = pipe.Pipeline(in_file)
+            pl.add_stage(htrim.HardTrimmer(None, None, length=30))
+            pl.add_stage(qfil.QualFilter(None, None, qual_threshold=20,
+                                         qual_offset=33, pass_rate=0.9))
+            pl.add_writer(ngs.FastqWriter(out_dir + "pipe.fastq"))
+            pl.add_writer(ngs.FastaWriter(out_dir + "pipe_raw.fasta"),
+                          after=0)
+            pl.add_writer(bcs.BarcodeSplitter(in_file, out_dir,
+                                              prefix + "barcodes.csv"),
+                          after=1)
+            if parallel:
+                pl.run_parallel(chunk_size=100, num_procs=2, ordered=True)
+            else:
+                pl.run()
+            with open(out_dir + "pipe.fastq") as fh:
+                self.assertEqual(fh.read(), expected)
+            stages = pl.stats["stages"]
+            self.assertEqual([stage["name"] for stage in stages],
+                             ["HardTrimmer", "QualFilter"])
+            self.assertEqual(stages[0]["num_reads_in"], 1000)
+            self.assertEqual(stages[1]["num_reads_out"],
+                             qf.stats["writer"]["num_reads"])
+            # The reads the QualFilter rejected, even from separate processes
+            self.assertEqual(stages[1]["num_reads_in"] -
+                             stages[1]["num_reads_out"],
+                             sum(qf.stats["rejected"].values()))
+            writers = pl.stats["writer"]["writers"]
+            self.assertEqual(writers[0]["num_reads"],
+                             qf.stats["writer"]["num_reads"])
+            self.assertEqual(writers[1]["num_reads"], 1000)
+            self.assertEqual(writers[2]["barcode_counts"],
+                             EXPECTED_BARCODE_COUNTS)
+        with open(out_dir + "pipe_raw.fasta") as fh:
+            lines = fh.read().split("\n")
+        self.assertEqual(lines[1], next(ngs.FastqReader(in_file))[1])
+
     def testFastqToFasta(self):
         ftf = conv.FastqToFasta(in_file, out_dir + "fasta.fasta")
         ftf.run()